@@ -15,6 +15,8 @@ const BUFFER_SIZE: usize = 1024;
 const NUM_THREADS: usize = 32;
 
 pub type FileMap = HashMap<String, String>;
+/// Digest, size in bytes (-1 if unknown) and mtime in seconds since the epoch, as Manifest.add takes them
+pub type FileEntry = (String, i64, f64);
 
 
 /// Compute digest value for given `Reader` and print it
@@ -35,15 +37,91 @@ fn hash_file<D: Digest + Default, R: Read>(reader: &mut R) -> Output<D> {
     sh.finalize()
 }
 
-fn _walk_dir(dir: &Path, mut files: &mut Vec<String>) -> io::Result<()> {
+/// One parsed ignore pattern; semantics match syncprojects/sync/ignore.py exactly
+pub struct IgnoreRule {
+    pattern: Vec<char>,
+    anchored: bool,
+    dir_only: bool,
+}
+
+pub fn parse_ignore_rules(patterns: &[String]) -> Vec<IgnoreRule> {
+    patterns.iter().filter_map(|line| {
+        let line = line.trim();
+        if line.is_empty() || line.starts_with('#') {
+            return None;
+        }
+        let dir_only = line.ends_with('/');
+        let line = line.trim_end_matches('/');
+        let anchored = line.contains('/');
+        let line = line.trim_start_matches('/');
+        if line.is_empty() {
+            return None;
+        }
+        Some(IgnoreRule { pattern: line.to_lowercase().chars().collect(), anchored, dir_only })
+    }).collect()
+}
+
+/// `*` matches anything but `/`, `?` one character but `/`, `**` anything
+fn glob_match(pattern: &[char], text: &[char]) -> bool {
+    if pattern.is_empty() {
+        return text.is_empty();
+    }
+    if pattern[0] == '*' {
+        if pattern.len() > 1 && pattern[1] == '*' {
+            let rest = &pattern[2..];
+            return (0..=text.len()).any(|i| glob_match(rest, &text[i..]));
+        }
+        let rest = &pattern[1..];
+        for i in 0..=text.len() {
+            if glob_match(rest, &text[i..]) {
+                return true;
+            }
+            if i < text.len() && text[i] == '/' {
+                break;
+            }
+        }
+        return false;
+    }
+    if text.is_empty() {
+        return false;
+    }
+    if pattern[0] == '?' {
+        return text[0] != '/' && glob_match(&pattern[1..], &text[1..]);
+    }
+    pattern[0] == text[0] && glob_match(&pattern[1..], &text[1..])
+}
+
+pub fn is_ignored(rules: &[IgnoreRule], rel_path: &str, name: &str, is_dir: bool) -> bool {
+    if rules.is_empty() {
+        return false;
+    }
+    let rel_path: Vec<char> = rel_path.to_lowercase().chars().collect();
+    let name: Vec<char> = name.to_lowercase().chars().collect();
+    rules.iter().any(|rule| {
+        if rule.dir_only && !is_dir {
+            return false;
+        }
+        glob_match(&rule.pattern, if rule.anchored { &rel_path } else { &name })
+    })
+}
+
+/// Errors reading any directory are returned, as os.scandir raises them for the Python walker
+fn _walk_dir(dir: &Path, rel: &str, rules: &[IgnoreRule], mut files: &mut Vec<String>) -> io::Result<()> {
     if dir.is_dir() {
         for entry in fs::read_dir(dir)? {
-            let path = entry.unwrap().path();
-            if path.is_dir() {
-                if _walk_dir(&path, &mut files).is_err() {
-                    println!("Error walking directory {}", dir.to_string_lossy());
-                }
-            } else {
+            let path = entry?.path();
+            let name = match path.file_name() {
+                Some(name) => name.to_string_lossy().to_string(),
+                None => continue,
+            };
+            let entry_rel = if rel.is_empty() { name.clone() } else { format!("{}/{}", rel, name) };
+            let is_dir = path.is_dir();
+            if is_ignored(rules, &entry_rel, &name, is_dir) {
+                continue;
+            }
+            if is_dir {
+                _walk_dir(&path, &entry_rel, rules, &mut files)?;
+            } else if !name.contains('\\') {
                 files.push(path.to_string_lossy().to_string());
             }
         }
@@ -64,11 +142,13 @@ pub fn get_difference(src: FileMap, dst: FileMap) -> Vec<String> {
 }
 
 #[pyfunction]
-pub fn walk_dir(base_path: String) -> FileMap {
+pub fn walk_dir(base_path: String, ignore: Option<Vec<String>>) -> PyResult<HashMap<String, FileEntry>> {
     let dir = Path::new(&base_path);
+    let rules = parse_ignore_rules(&ignore.unwrap_or_default());
     let mut files = Vec::new();
+    // Raised in Python as the matching OSError subclass
+    _walk_dir(&dir, "", &rules, &mut files)?;
     let files_len = files.len();
-    _walk_dir(&dir, &mut files).unwrap();
     let data = Arc::new(Mutex::new(files));
     let (tx, rx) = channel();
     for _ in 0..NUM_THREADS {
@@ -81,10 +161,13 @@ pub fn walk_dir(base_path: String) -> FileMap {
                 };
                 match path {
                     Some(path) => {
-                        if path.ends_with(".peak") {
-                            continue;
-                        }
                         if let Ok(mut file) = fs::File::open(&path) {
+                            let (size, mtime) = match file.metadata() {
+                                Ok(meta) => (meta.len() as i64, meta.modified().ok()
+                                    .and_then(|t| t.duration_since(time::UNIX_EPOCH).ok())
+                                    .map_or(0.0, |d| d.as_secs_f64())),
+                                Err(_) => (-1, 0.0),
+                            };
                             let hash = hash_file::<Md5, _>(&mut file);
                             let mut hash_str = String::with_capacity(32);
                             for b in hash {
@@ -95,7 +178,7 @@ pub fn walk_dir(base_path: String) -> FileMap {
                                 // Windows compat
                                 path_dst.strip_prefix("\\").unwrap()
                             });
-                            tx.send(Some((path_dst.to_string().replace("\\", "/"), hash_str))).unwrap();
+                            tx.send(Some((path_dst.to_string().replace("\\", "/"), (hash_str, size, mtime)))).unwrap();
                         }
                     },
                     None => {
@@ -108,7 +191,7 @@ pub fn walk_dir(base_path: String) -> FileMap {
         let ten_millis = time::Duration::from_millis(10);
         thread::sleep(ten_millis); // hack to let stack populate
     }
-    let mut map = FileMap::with_capacity(files_len);
+    let mut map = HashMap::with_capacity(files_len);
     let mut done = 0;
     while done < NUM_THREADS {
         match rx.recv() {
@@ -119,7 +202,7 @@ pub fn walk_dir(base_path: String) -> FileMap {
             _ => done += 1
         }
     }
-    map
+    Ok(map)
 }
 
 #[pymodule]
@@ -131,7 +214,7 @@ fn syncprojects_fast(_py: Python, m: &PyModule) -> PyResult<()> {
 
 #[cfg(test)]
 mod tests {
-    use crate::{get_difference, walk_dir};
+    use crate::{get_difference, is_ignored, parse_ignore_rules, walk_dir};
 
     #[test]
     fn test_diff() {
@@ -143,10 +226,24 @@ mod tests {
 
     #[test]
     fn test_walk() {
-        let map = walk_dir("/home/keane/Documents/Divided".to_string());
-        for (k, v) in &map {
-            println!("{}: {}", k, v);
+        let map = walk_dir("/home/keane/Documents/Divided".to_string(), None).unwrap();
+        for (k, (hash, size, mtime)) in &map {
+            println!("{}: {} {} {}", k, hash, size, mtime);
         }
         assert_eq!(1368, map.len());
     }
-}
\ No newline at end of file
+
+    #[test]
+    fn test_ignore() {
+        // Shared with test/test_ignore.py, so both implementations are held to the same cases
+        let vectors = include_str!("../test/ignore_vectors.txt").replace("\r\n", "\n");
+        let (patterns, cases) = vectors.split_at(vectors.find("\n---\n").unwrap());
+        let rules = parse_ignore_rules(&patterns.lines().map(String::from).collect::<Vec<_>>());
+        for case in cases.lines().skip(2).filter(|line| !line.is_empty() && !line.starts_with('#')) {
+            let mut fields = case.splitn(3, ' ');
+            let (expected, kind, path) = (fields.next().unwrap(), fields.next().unwrap(), fields.next().unwrap());
+            let name = path.rsplit('/').next().unwrap();
+            assert_eq!(expected == "ignored", is_ignored(&rules, path, name, kind == "dir"), "{}", case);
+        }
+    }
+}
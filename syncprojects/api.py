@@ -1,24 +1,112 @@
 import datetime
 import getpass
 import logging
+import math
+import random
+import threading
+import time
+import uuid
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from json import JSONDecodeError
 from queue import Queue
-from typing import Dict
+from threading import Event, Lock
+from typing import Callable, Dict, Iterable, Tuple, Union
 from typing import List
+from urllib.parse import urlparse, parse_qs
 
 import requests
-import sys
 from requests import HTTPError
+from requests.adapters import HTTPAdapter
 
+from syncprojects import config, tracing
 from syncprojects.config import LOGIN_MODE, SYNCPROJECTS_URL
+from syncprojects.metrics import API_REQUEST_SECONDS, API_RETRIES, API_CACHE, endpoint_label
 from syncprojects.storage import appdata
 from syncprojects.system import get_host_string
-from syncprojects.ui.message import MessageBoxUI
+from syncprojects.tracing import span
 
 API_BASE_URL = SYNCPROJECTS_URL + "api/v1/"
 logger = logging.getLogger('syncprojects.api')
 
+# Safe to repeat if the response was lost (RFC 7231)
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRY_STATUSES = {429, 502, 503, 504}
+# Path prefix -> read timeout, for calls that are expected to take longer than API_READ_TIMEOUT
+ENDPOINT_READ_TIMEOUTS = {
+    'logs/': 300,
+}
+
+
+def get_timeout(path: str) -> Tuple[float, float]:
+    for prefix, read_timeout in ENDPOINT_READ_TIMEOUTS.items():
+        if path.startswith(prefix):
+            return config.API_CONNECT_TIMEOUT, read_timeout
+    return config.API_CONNECT_TIMEOUT, config.API_READ_TIMEOUT
+
+
+def get_backoff(attempt: int, retry_after: str = None) -> float:
+    """
+    Exponential backoff with full jitter, or the server's Retry-After if it asked for longer.
+    """
+    delay = random.uniform(0, min(config.API_BACKOFF_MAX, config.API_BACKOFF_BASE * 2 ** attempt))
+    try:
+        delay = max(delay, min(float(retry_after), config.API_BACKOFF_MAX))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+class ResponseCache:
+    """
+    Parsed GET responses by path and params. Entries are used as-is until their TTL runs out, then revalidated with
+    If-None-Match. Callers get copies, since they tend to modify what they're given.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def key(path: str, params: Dict = None) -> Tuple:
+        return path, tuple(sorted((params or {}).items()))
+
+    def get(self, key: Tuple) -> Union[Dict, None]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def store(self, key: Tuple, etag: Union[str, None], body):
+        with self._lock:
+            self._entries[key] = {'etag': etag, 'body': deepcopy(body), 'expires': time.monotonic() + self.ttl}
+
+    def refresh(self, key: Tuple):
+        with self._lock:
+            if entry := self._entries.get(key):
+                entry['expires'] = time.monotonic() + self.ttl
+
+    def invalidate(self, *paths: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in paths]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def new_session() -> requests.Session:
+    """
+    Keeps connections to the API alive between calls, so most calls skip the TCP and TLS handshakes.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.API_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers['User-Agent'] = "syncprojects-client"
+    return session
+
 
 # TODO: this should go back under class
 def login_prompt(sync_api) -> bool:
@@ -55,6 +143,14 @@ class SyncAPI:
         self.logger = logging.getLogger('syncprojects.api.SyncAPI')
         self.recv_queue = recv_queue
         self.send_queue = send_queue
+        self.session = new_session()
+        self.cache = ResponseCache(config.API_CACHE_TTL)
+        # Whether the server has the batch lock endpoint; unknown until first tried
+        self.batch_locks = None
+        # Set by the thread reading recv_queue (run_service) while it runs; web_login must not read it then
+        self.queue_thread = None
+        self.auth_event = Event()
+        self._login_lock = Lock()
 
     @property
     def username(self) -> str:
@@ -73,56 +169,175 @@ class SyncAPI:
         return bool(self.refresh_token and self.access_token)
 
     def _request(self, path: str, method: str = 'GET', params: dict = {}, json: dict = {}, headers: dict = {},
-                 files: Dict = None, auth: bool = True, refresh: bool = True, no_fail: bool = False):
+                 files: Dict = None, data: Callable[[], Iterable[bytes]] = None, auth: bool = True,
+                 refresh: bool = True, no_fail: bool = False, cache: bool = False):
+        """
+        :param data: Returns a new streamed request body for each attempt
+        :param cache: Serve from, and store in, the response cache (GET only)
+        :raises requests.exceptions.RequestException: If the API couldn't be reached or kept failing, unless no_fail
+        """
         attempts = 0
-        headers['User-Agent'] = "syncprojects-client"
+        headers = dict(headers)
+        cache_key = self.cache.key(path, params) if cache else None
+        if cache and (entry := self.cache.get(cache_key)):
+            if entry['expires'] > time.monotonic():
+                API_CACHE.inc(endpoint=endpoint_label(path), result="hit")
+                return deepcopy(entry['body'])
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+        else:
+            entry = None
         while attempts < 2:
             if auth and self.access_token:
                 headers['Authorization'] = f"Bearer {self.access_token}"
             # Try using access token, fall back to refreshing, then re-login
+            if attempts:
+                API_RETRIES.inc(endpoint=endpoint_label(path), method=method, reason="auth")
             try:
-                r = requests.request(method=method, url=API_BASE_URL + path, params=params, json=json,
-                                     headers=headers, files=files)
-            except requests.exceptions.ConnectionError:
-                MessageBoxUI.error("Failed to connect to the Syncprojects API! Check your internet connection and try "
-                                   "again, or contact support if the error persists.\n\nExiting...")
-                sys.exit(1)
+                r = self._send(path, method, params=params, json=json, headers=headers, files=files, data=data)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.logger.error("Request to %s failed: %s", path, e)
+                if no_fail:
+                    self.logger.warning("Not failing due to no_fail set.")
+                    return {}
+                # Raised rather than exiting, so the command's error handling reports it and releases its locks
+                raise e
+            if r.status_code == 304 and entry:
+                API_CACHE.inc(endpoint=endpoint_label(path), result="revalidated")
+                self.cache.refresh(cache_key)
+                return deepcopy(entry['body'])
             # 2xx status code
             if r.status_code // 100 == 2:
                 try:
-                    return r.json()
+                    body = r.json()
                 except JSONDecodeError:
                     return r.text
+                if cache:
+                    API_CACHE.inc(endpoint=endpoint_label(path), result="miss")
+                    self.cache.store(cache_key, r.headers.get('ETag'), body)
+                return body
             elif r.status_code == 401:
                 self.logger.debug("Got 401 response, requesting credential re-entry...")
-                login_prompt(self)
+                if not login_prompt(self):
+                    # Fails the command rather than retrying with the same credentials
+                    raise HTTPError("Login failed", response=r)
             elif refresh and r.status_code == 403:
                 self.logger.debug("Got 403 response, attempting credential refresh...")
                 self.refresh()
+            else:
+                # Only new credentials are worth another attempt; _send has already retried transient failures
+                break
             attempts += 1
-        self.logger.error(
-            f"Multiple requests failed, most recent response code {r.status_code} and msg {r.text}.")
+        self.logger.error(f"Request to {path} failed, most recent response code {r.status_code} and msg {r.text}.")
         if not no_fail:
-            if r.status_code // 100 == 4:
-                MessageBoxUI.error(
-                    "Error communicating with Syncprojects API! You could not be authenticated, or are not authorized "
-                    "to perform this action. Try again, or contact support if the error persists.\n\nExiting...")
-            elif r.status_code // 100 == 5:
-                MessageBoxUI.error("Error communicating with Syncprojects API! A server error occurred. Try again, "
-                                   "or contact support if the error persists.\n\nExiting...")
-            self.logger.error("Exiting due to communication error.")
-            sys.exit(1)
-        self.logger.warning("Not exiting due to no_fail set.")
+            raise HTTPError(f"{r.status_code} response from {path}", response=r)
+        self.logger.warning("Not failing due to no_fail set.")
         return {}
 
-    def get_all_projects(self):
-        return self._request("projects/")["results"]
+    def _send(self, path: str, method: str, data: Callable[[], Iterable[bytes]] = None,
+              **kwargs) -> requests.Response:
+        """
+        Make one logical request over the pooled session, retrying idempotent methods on transient failures.
+        :raises requests.exceptions.ConnectionError, requests.exceptions.Timeout: If the last attempt failed
+        """
+        endpoint = endpoint_label(path)
+        retries = config.API_RETRIES if method in IDEMPOTENT_METHODS else 0
+        retry_after = None
+        for attempt in range(retries + 1):
+            if attempt:
+                delay = get_backoff(attempt, retry_after)
+                self.logger.debug("Retrying %s %s in %.2fs", method, path, delay)
+                API_RETRIES.inc(endpoint=endpoint, method=method, reason="transport")
+                time.sleep(delay)
+            start = time.perf_counter()
+            try:
+                with span('api', cat="api", endpoint=endpoint, method=method):
+                    r = self.session.request(method=method, url=API_BASE_URL + path, timeout=get_timeout(path),
+                                             data=data() if data else None, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                API_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=method,
+                                            status="error")
+                if attempt == retries:
+                    raise e
+                self.logger.warning("%s %s failed: %s", method, path, e)
+                retry_after = None
+                continue
+            API_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=method,
+                                        status=r.status_code)
+            if r.status_code not in RETRY_STATUSES or attempt == retries:
+                return r
+            self.logger.warning("%s %s got %d", method, path, r.status_code)
+            retry_after = r.headers.get('Retry-After')
 
-    def get_project(self, project_id: int):
-        return self._request(f"projects/{project_id}/")
+    def _map(self, func: Callable, items: List) -> List:
+        """
+        Call func on each item using up to API_CONCURRENCY connections; results are in the order of items.
+        """
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=config.API_CONCURRENCY, thread_name_prefix='api') as executor:
+            return list(executor.map(tracing.bind(func), items))
 
-    def get_song(self, song_id: int):
-        return self._request(f"songs/{song_id}/")
+    def _get_all_pages(self, path: str) -> List[Dict]:
+        """
+        Fetch every result of a paginated list endpoint. The first page gives the total count and page size, and
+        the remaining pages are fetched in parallel.
+        """
+        first = self._request(path, cache=True)
+        results = list(first['results'])
+        if not first.get('next'):
+            return results
+        query = parse_qs(urlparse(first['next']).query)
+        params = {key: values[0] for key, values in query.items()}
+        page_size = len(first['results'])
+        if 'page' in params and first.get('count') and page_size:
+            pages = [{**params, 'page': n} for n in range(2, math.ceil(first['count'] / page_size) + 1)]
+        elif 'offset' in params and first.get('count') and page_size:
+            pages = [{**params, 'offset': offset} for offset in range(page_size, first['count'], page_size)]
+        else:
+            # Cursor pagination can't be parallelised; follow the links
+            while params:
+                page = self._request(path, params=params, cache=True)
+                results.extend(page['results'])
+                params = ({key: values[0] for key, values in parse_qs(urlparse(page['next']).query).items()}
+                          if page.get('next') else None)
+            return results
+        self.logger.debug("Fetching %d more pages of %s", len(pages), path)
+        for page in self._map(lambda page_params: self._request(path, params=page_params, cache=True), pages):
+            results.extend(page['results'])
+        return results
+
+    def get_all_projects(self, with_songs: bool = True) -> List[Dict]:
+        """
+        :param with_songs: Fetch the full project for any that were listed without their songs
+        """
+        projects = self._get_all_pages("projects/")
+        if with_songs:
+            missing = [i for i, project in enumerate(projects) if 'songs' not in project]
+            for i, project in zip(missing, self.get_projects([projects[i]['id'] for i in missing])):
+                projects[i] = project
+        return projects
+
+    def get_project(self, project_id: int, cache: bool = True):
+        """
+        :param cache: Whether a cached copy will do; pass False for data that sync decisions are made from
+        """
+        return self._request(f"projects/{project_id}/", cache=cache)
+
+    def get_projects(self, project_ids: List[int], cache: bool = True) -> List[Dict]:
+        """
+        Fetch several projects in parallel, in the order given.
+        """
+        return self._map(lambda project_id: self.get_project(project_id, cache), list(project_ids))
+
+    def get_song(self, song_id: int, cache: bool = True):
+        return self._request(f"songs/{song_id}/", cache=cache)
+
+    def invalidate_project(self, project_id: int, song_ids: Iterable[int] = ()):
+        """
+        Drop cached metadata that a change to a project or its songs makes stale.
+        """
+        self.cache.invalidate("projects/", f"projects/{project_id}/", *(f"songs/{song_id}/" for song_id in song_ids))
 
     def _lock_request(self, obj: dict, lock: bool = False, force: bool = True, reason: str = "",
                       until: datetime.datetime = None):
@@ -137,10 +352,17 @@ class SyncAPI:
         if 'project' in obj:
             # obj is song
             json['song'] = obj['id']
-            return self._request(f"projects/{obj['project']}/lock/", method='PUT' if lock else 'DELETE', json=json)
+            try:
+                return self._request(f"projects/{obj['project']}/lock/", method='PUT' if lock else 'DELETE',
+                                     json=json)
+            finally:
+                self.invalidate_project(obj['project'], [obj['id']])
         elif 'songs' in obj:
             # obj is project
-            return self._request(f"projects/{obj['id']}/lock/", method='PUT' if lock else 'DELETE', json=json)
+            try:
+                return self._request(f"projects/{obj['id']}/lock/", method='PUT' if lock else 'DELETE', json=json)
+            finally:
+                self.invalidate_project(obj['id'], [song['id'] for song in obj['songs']])
         else:
             raise NotImplementedError()
 
@@ -150,6 +372,67 @@ class SyncAPI:
     def unlock(self, obj: dict, force: bool = False):
         return self._lock_request(obj, False, force)
 
+    def _lock_many_request(self, objs: List[Dict], lock: bool, force: bool = False, reason: str = "",
+                           until: datetime.datetime = None) -> List[Dict]:
+        """
+        Lock or unlock many projects and songs in one request, falling back to parallel single requests on servers
+        without the batch endpoint.
+        :return: The lock response for each of objs, in order
+        """
+        if not objs:
+            return []
+        if self.batch_locks is not False:
+            items = []
+            for obj in objs:
+                if 'project' in obj:
+                    items.append({'project': obj['project'], 'song': obj['id']})
+                elif 'songs' in obj:
+                    items.append({'project': obj['id']})
+                else:
+                    raise NotImplementedError()
+            json = {'lock': lock, 'items': items}
+            if force:
+                json['force'] = force
+            if reason:
+                json['reason'] = reason
+            if until:
+                json['until'] = until.timestamp()
+            self.logger.debug("Submitting batch %sLOCK request for %d items", '' if lock else 'UN', len(items))
+            try:
+                resp = self._request("locks/", method='POST', json=json)
+            except HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status == 401:
+                    # Login failed; single requests would only prompt again
+                    raise e
+                if status == 404:
+                    self.logger.info("Batch locking not supported by server, using single requests")
+                    self.batch_locks = False
+                else:
+                    self.logger.warning("Batch %sLOCK request failed, retrying with single requests",
+                                        '' if lock else 'UN')
+                resp = None
+            finally:
+                for obj in objs:
+                    if 'project' in obj:
+                        self.invalidate_project(obj['project'], [obj['id']])
+                    else:
+                        self.invalidate_project(obj['id'], [song['id'] for song in obj['songs']])
+            if isinstance(resp, dict) and len(resp.get('results', ())) == len(objs):
+                self.batch_locks = True
+                return resp['results']
+            if resp is not None:
+                self.logger.warning("Unexpected batch %sLOCK response, retrying with single requests",
+                                    '' if lock else 'UN')
+        return self._map(lambda obj: self._lock_request(obj, lock, force, reason, until), objs)
+
+    def lock_many(self, objs: List[Dict], force: bool = False, reason: str = "sync",
+                  until: datetime.datetime = None) -> List[Dict]:
+        return self._lock_many_request(objs, True, force, reason, until)
+
+    def unlock_many(self, objs: List[Dict], force: bool = False) -> List[Dict]:
+        return self._lock_many_request(objs, False, force)
+
     def login(self, username: str, password: str):
         self.logger.debug("Sending creds for login")
         resp = self._request('token/', 'POST', json={'username': username, 'password': password}, auth=False)
@@ -173,25 +456,44 @@ class SyncAPI:
         appdata.update(config)
         self.logger.debug("Saved credentials updated from API")
         self._username = None
+        self.auth_event.set()
         return self.username
 
     def web_login(self):
-        webbrowser.open(SYNCPROJECTS_URL + "sync/client_login/")
-        self.logger.info("Waiting for successful login...")
-        while config := self.recv_queue.get():
-            if config['msg_type'] == 'auth':
-                self.handle_auth_msg(config['data'])
-                break
-        return True
+        if not self._login_lock.acquire(blocking=False):
+            # Another command hit the same expired login; its browser window will do
+            self.logger.debug("Login already in progress, waiting for it")
+            with self._login_lock:
+                return self.auth_event.is_set()
+        try:
+            self.auth_event.clear()
+            webbrowser.open(SYNCPROJECTS_URL + "sync/client_login/")
+            self.logger.info("Waiting for successful login...")
+            if self.queue_thread not in (None, threading.get_ident()):
+                # run_service owns the queue, and its AuthHandler passes the credentials to handle_auth_msg
+                if not self.auth_event.wait(config.LOGIN_TIMEOUT):
+                    self.logger.error("Timed out waiting for login")
+                    return False
+                return True
+            while msg := self.recv_queue.get():
+                if msg['msg_type'] == 'auth':
+                    self.handle_auth_msg(msg['data'])
+                    return True
+            return False
+        finally:
+            self._login_lock.release()
 
     def get_client_updates(self):
         return self._request("updates/", params={'target': get_host_string()})['results']
 
     def add_sync(self, project: Dict, songs: List[int]):
-        return self._request("syncs/", "POST", json={
-            'project': project['id'],
-            'songs': songs,
-        })
+        try:
+            return self._request("syncs/", "POST", json={
+                'project': project['id'],
+                'songs': songs,
+            })
+        finally:
+            self.invalidate_project(project['id'], songs)
 
     def get_backend_creds(self):
         return self._request("backend_creds/", headers={"Content-Type": "application/json"}, params={'id': 1})
@@ -202,8 +504,21 @@ class SyncAPI:
                 'url': '#'
             })
 
-    def report_logs(self, log_data: bytes):
-        return self._request("logs/", "POST", files={'log_compressed': log_data})
+    def report_logs(self, log_chunks: Callable[[], Iterable[bytes]]):
+        """
+        Upload a log archive as the multipart 'log_compressed' file, streamed with chunked transfer encoding.
+        :param log_chunks: Returns a new iterator over the archive each time it's called
+        """
+        boundary = uuid.uuid4().hex
+
+        def body():
+            yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"log_compressed\"; "
+                   f"filename=\"logs.zip\"\r\nContent-Type: application/zip\r\n\r\n").encode()
+            yield from (chunk for chunk in log_chunks() if chunk)
+            yield f"\r\n--{boundary}--\r\n".encode()
+
+        return self._request("logs/", "POST", data=body,
+                             headers={'Content-Type': f"multipart/form-data; boundary={boundary}"})
 
     def audio_sync(self, project, song):
         return self._request("sync/audio_sync/", "POST", json={'project': project, 'song': song}, no_fail=True)
@@ -1,20 +1,23 @@
-from os import unlink
-from os.path import join, getmtime
+from os.path import join, getmtime, getsize, basename
 
 import glob
 import logging
 import sys
-import tempfile
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from requests import HTTPError
-from typing import Dict
-from zipfile import ZipFile
+from typing import Callable, Dict, Iterable, List, Union
 
+from syncprojects import config
 from syncprojects.api import SyncAPI
+from syncprojects.log import get_rotated_logs, trim_to_size, iter_zip
+from syncprojects.profiling import list_profiles, set_enabled, is_enabled, get_profile_dir
 from syncprojects.storage import appdata
 from syncprojects.sync.backends import Verdict
+from syncprojects.sync import scheduler
 from syncprojects.sync.operations import get_lock_status
 from syncprojects.system import open_default_app
+from syncprojects.tracing import task, span, bind
 from syncprojects.ui.settings_menu import SettingsUI
 from syncprojects.ui.tray import notify
 from syncprojects.utils import check_update, get_song_dir, commit_settings
@@ -66,15 +69,183 @@ class CommandHandler(ABC):
         """
         self.sync_manager.tasks.add(self.task_id)
         self.logger.debug("Starting")
-        self.handle(data)
+        with task(self.task_id), span(self.__class__.__name__, cat="command"):
+            self.handle(data)
         self.logger.debug("Done")
         self.sync_manager.tasks.remove(self.task_id)
 
     def send_queue(self, response_data: Dict) -> None:
         self.api_client.send_queue.put({'task_id': self.task_id, **response_data})
 
+    def refetch_locked(self, project: Dict, song_ids: Iterable[int] = None) -> Dict:
+        """
+        Fetch a project again once it or some of its songs are locked, bypassing the API cache, so verdicts are made
+        from the revisions as they are now rather than from data cached before the lock.
+        :param song_ids: Songs we've locked; only these are kept, and our own locks on them don't count
+        """
+        project = self.api_client.get_project(project['id'], cache=False)
+        if song_ids is not None:
+            song_ids = set(song_ids)
+            project['songs'] = [song for song in project['songs'] if song['id'] in song_ids]
+            for song in project['songs']:
+                song['is_locked'] = False
+        return project
+
+    def check_project_lock(self, project: Dict, lock: Dict) -> bool:
+        """
+        Check whether a lock was given for a project, reporting it to send_queue if not.
+        """
+        if get_lock_status(lock):
+            self.logger.debug(f"Unlocked project {project['name']}; starting sync.")
+            return True
+        self.logger.debug("Project is locked; returning error.")
+        # Lock is only a warning here since other projects can still sync
+        self.send_queue({'status': 'warn', 'failed': {'project': project['name'], 'lock': lock},
+                         'msg': f"Project \"{project['name']}\" is locked"})
+        return False
+
+    def sync_locked_project(self, project: Dict):
+        """
+        Sync a project we hold the lock of, reporting progress to send_queue. The caller unlocks it.
+        """
+        project = self.refetch_locked(project)
+        with self.sync_manager.claim(project['id']):
+            sync = self.sync_manager.sync(project)
+            self.sync_manager.sync_amps(project)
+        self.send_queue({'status': 'progress', 'completed': {'project': project['name'], **sync}})
+
+    def lock_and_sync_project(self, project: Dict):
+        """
+        Lock a whole project and sync it.
+        """
+        try:
+            lock = self.api_client.lock(project)
+        except HTTPError:
+            self.send_queue({'status': 'error', 'msg': f'Error checking out {project["name"]}'})
+            return
+        if self.check_project_lock(project, lock):
+            try:
+                self.sync_locked_project(project)
+            finally:
+                self.api_client.unlock(project)
+
+    def lock_and_sync_projects(self, projects: List[Dict], workers: int):
+        """
+        Lock whole projects and sync them, locking and unlocking each group of up to workers projects with one request
+        each. Projects are only locked once there's a worker to sync them, and a group that fails to lock doesn't hold
+        up the others.
+        """
+        for start in range(0, len(projects), workers):
+            batch = projects[start:start + workers]
+            try:
+                locks = self.api_client.lock_many(batch)
+            except HTTPError as e:
+                # Lock them one at a time instead, so only the projects that fail are reported
+                self.logger.warning("Couldn't lock %d projects together: %s", len(batch), e)
+                self.run_projects(self.lock_and_sync_project, batch, workers)
+                continue
+            locked = [project for project, lock in zip(batch, locks) if self.check_project_lock(project, lock)]
+            try:
+                self.run_projects(self.sync_locked_project, locked, workers)
+            finally:
+                self.api_client.unlock_many(locked)
+
+    @staticmethod
+    def run_projects(func: Callable[[Dict], None], projects: List[Dict], workers: int):
+        """
+        Call func on each project using up to workers threads, raising the first error once they're all done.
+        """
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='project') as executor:
+            for future in [executor.submit(bind(scheduler.bind(func)), project) for project in projects]:
+                future.result()
+
+    def sync_project_songs(self, project: Dict):
+        """
+        Sync a project holding locks on only the songs that need syncing, so others can sync the rest of it at the
+        same time. Which songs need syncing comes from a pre-plan of their verdicts, which doesn't list or transfer
+        anything.
+        """
+        # Songs changed on the server since the project was cached would otherwise be left out
+        project = self.api_client.get_project(project['id'], cache=False)
+        try:
+            verdicts = self.sync_manager.pre_plan(project)
+        except NotImplementedError:
+            self.logger.debug("Backend can't pre-plan; locking whole project")
+            return self.lock_and_sync_project(project)
+        songs = [song for song in project['songs'] if verdicts.get(song['id'])]
+        self.logger.debug("%d of %d songs of %s need syncing", len(songs), len(project['songs']), project['name'])
+        locked = []
+        for song, song_lock in zip(songs, self.api_client.lock_many(songs)):
+            if get_lock_status(song_lock):
+                locked.append(song)
+            else:
+                self.send_queue({'status': 'warn', 'failed': {'project': project['name'], 'lock': song_lock},
+                                 'msg': f"Song \"{song['name']}\" is locked"})
+        # Disabled songs and ones someone else had locked are still reported, as a whole-project sync would
+        _, pre_results = self.sync_manager.get_syncable_songs(project)
+        sync = {'status': 'done', 'songs': None}
+        try:
+            if locked:
+                project = self.refetch_locked(project, [song['id'] for song in locked])
+                with self.sync_manager.claim(project['id'], [song['id'] for song in locked]):
+                    # The pre-plan has just hashed these songs
+                    sync = self.sync_manager.sync(project, hashed=True)
+        finally:
+            self.api_client.unlock_many(locked)
+        # Amp settings belong to the whole project, so they're synced as a whole-project sync would, whichever songs
+        # needed syncing or could be locked
+        with self.sync_manager.claim(project['id']):
+            self.sync_manager.sync_amps(project)
+        if pre_results:
+            sync['songs'] = (sync['songs'] or []) + pre_results
+        self.send_queue({'status': 'progress', 'completed': {'project': project['name'], **sync}})
+
+    def resolve_projects(self, projects: List[Union[Dict, int]]) -> List[Dict]:
+        """
+        Replace project IDs (requests from the API, where we don't have the project data yet) with the projects,
+        fetched in parallel.
+        """
+        ids = [project for project in projects if not isinstance(project, dict)]
+        fetched = dict(zip(ids, self.api_client.get_projects(ids)))
+        return [project if isinstance(project, dict) else fetched[project] for project in projects]
+
+    def lock_and_sync_songs(self, songs: List[Dict], reason: str = "Sync") -> List[Dict]:
+        """
+        Like lock_and_sync_song for many songs, locking and unlocking them all with one request each and syncing
+        each project's locked songs together.
+        :param songs: {'project': id, 'song': id} of each song
+        :return: The songs which were synced
+        """
+        song_ids = {}
+        for song in songs:
+            song_ids.setdefault(song['project'], set()).add(song['song'])
+        projects = self.api_client.get_projects(list(song_ids))
+        to_lock = [song for project in projects for song in project['songs'] if song['id'] in song_ids[project['id']]]
+        locked = []
+        for song, song_lock in zip(to_lock, self.api_client.lock_many(to_lock, reason=reason)):
+            if get_lock_status(song_lock):
+                locked.append(song)
+            else:
+                self.send_queue({'status': 'error', 'lock': song_lock, 'msg': f"Song \"{song['name']}\" is locked",
+                                 'component': 'song'})
+        try:
+            for project in projects:
+                project_locked = [song['id'] for song in locked if song['project'] == project['id']]
+                if not project_locked:
+                    continue
+                project = self.refetch_locked(project, project_locked)
+                self.logger.debug("Got exclusive lock of %d songs in %s", len(project['songs']), project['name'])
+                with self.sync_manager.claim(project['id'], [song['id'] for song in project['songs']]):
+                    sync = self.sync_manager.sync(project)
+                self.send_queue({'status': 'progress', 'completed': {'project': project['name'], **sync}})
+        finally:
+            self.logger.debug("Unlocking %d songs", len(locked))
+            self.api_client.unlock_many(locked)
+        return locked
+
     # TODO: does this really belong here?
-    def lock_and_sync_song(self, song: Dict, unlock: bool = True, reason: str = "Sync") -> Dict:
+    def lock_and_sync_song(self, song: Dict, unlock: bool = True, reason: str = "Sync",
+                           on_ready: Callable[[Dict], None] = None) -> Dict:
         # Thoughts on this: to avoid conflicts, we first lock the entire project, which will also ensure nobody
         # else is syncing. Then, while project is still locked, set the individual song to locked and unlock the
         # rest of the project. This way, if someone else wants to sync, they will see that the song is locked.
@@ -82,8 +253,10 @@ class CommandHandler(ABC):
         song = next(s for s in project['songs'] if s['id'] == song['song'])
         if get_lock_status(song_lock := self.api_client.lock(song, reason=reason)):
             self.logger.debug("Got exclusive lock of song")
-            project['songs'] = [song]
-            sync = self.sync_manager.sync(project)
+            project = self.refetch_locked(project, [song['id']])
+            song = project['songs'][0]
+            with self.sync_manager.claim(project['id'], [song['id']]):
+                sync = self.sync_manager.sync(project, on_ready=on_ready)
             if unlock:
                 self.logger.debug("Unlocking song")
                 self.api_client.unlock(song)
@@ -114,60 +287,92 @@ class SyncMultipleHandler(CommandHandler):
         If a project is locked, status will instead be 'lock', and 'lock' will contain information about the lock.
         If the current task is finished, it returns status 'complete'.
         If an error happens, I imagine we will return status 'error'.
+        If 'rehash' is set, every song is hashed rather than trusting the change journal.
         """
+        if data.get('rehash'):
+            self.sync_manager.invalidate_journal()
         if 'projects' in data:
             self.logger.debug("Got request to sync projects")
-            for project in data['projects']:
-                if not isinstance(project, dict):
-                    # This request came from the API, we don't have the project data yet
-                    project = self.api_client.get_project(project)
-                try:
-                    if not project['sync_enabled']:
-                        self.logger.debug(f"Project {project['name']} sync disabled, skipping...")
-                        continue
-                except KeyError:
-                    pass
-                try:
-                    lock = self.api_client.lock(project)
-                except HTTPError:
-                    self.send_queue({'status': 'error', 'msg': f'Error checking out {project["name"]}'})
+            projects = []
+            for project in self.resolve_projects(data['projects']):
+                if not project.get('sync_enabled', True):
+                    self.logger.debug(f"Project {project['name']} sync disabled, skipping...")
                     continue
-                if get_lock_status(lock):
-                    self.logger.debug(f"Unlocked project {project['name']}; starting sync.")
-                    sync = self.sync_manager.sync(project)
-                    self.sync_manager.sync_amps(project)
-                    self.api_client.unlock(project)
-                    self.send_queue({'status': 'progress', 'completed': {'project': project['name'], **sync}})
-                else:
-                    self.logger.debug("Project is locked; returning error.")
-                    # Lock is only a warning here since other projects can still sync
-                    self.send_queue({'status': 'warn', 'failed': {'project': project['name'], 'lock': lock},
-                                     'msg': f"Project \"{project['name']}\" is locked"})
+                projects.append(project)
+            workers = min(appdata.get('project_workers', config.PROJECT_WORKERS), len(projects)) or 1
+            if appdata.get('song_locking', False):
+                # Locks are taken per song once the pre-plan is done
+                self.run_projects(self.sync_project_songs, projects, workers)
+            else:
+                self.lock_and_sync_projects(projects, workers)
             self.send_queue({'status': 'complete'})
         elif 'songs' in data:
             self.logger.debug("Got request to sync songs")
-            for song in data['songs']:
-                self.lock_and_sync_song(song)
+            self.lock_and_sync_songs(data['songs'])
             self.send_queue({'status': 'complete'})
 
 
+class PlanHandler(CommandHandler):
+    def handle(self, data: Dict):
+        """
+        Reports what syncing the given projects or songs would transfer, without locking or transferring anything.
+        Sends {'status': 'progress', 'plan': {'project', 'songs', 'totals'}} per project, then {'status': 'complete'}.
+        """
+        if data.get('rehash'):
+            self.sync_manager.invalidate_journal()
+        if 'projects' in data:
+            projects = self.resolve_projects(data['projects'])
+        elif 'songs' in data:
+            song_ids = {}
+            for song in data['songs']:
+                song_ids.setdefault(song['project'], set()).add(song['song'])
+            projects = self.api_client.get_projects(list(song_ids))
+            for project in projects:
+                project['songs'] = [s for s in project['songs'] if s['id'] in song_ids[project['id']]]
+        else:
+            projects = []
+        for project in projects:
+            if not project.get('sync_enabled', True):
+                continue
+            plan = self.sync_manager.plan(project)
+            self.send_queue({'status': 'progress', 'plan': {'project': project['name'], **plan}})
+        self.send_queue({'status': 'complete'})
+
+
 class WorkOnHandler(CommandHandler):
     def handle(self, data: Dict):
         song = data['song']
         self.logger.info(f"Working on {song=}")
+        opened = []
+        on_ready = None
+        if appdata.get('open_early', False):
+            # Open as soon as the project file and the audio it uses are down; the rest follows in the background
+            def on_ready(ready_song: Dict):
+                opened.append(self.open_project_file(ready_song))
+                if opened[-1]:
+                    self.send_queue({'status': 'progress', 'opened': ready_song['name']})
+
         # Keep song checked out afterwards
-        if not (song := self.lock_and_sync_song(song, unlock=False, reason="Checked out")):
+        if not (song := self.lock_and_sync_song(song, unlock=False, reason="Checked out", on_ready=on_ready)):
             self.logger.warning("Couldn't sync/check out song")
             self.send_queue({'status': 'complete'})
             return
         self.logger.debug("Sync complete")
+        if on_ready and not opened:
+            # Only songs which synced successfully are handed to on_ready
+            self.send_queue({'status': 'error', 'msg': f"Couldn't sync \"{song['name']}\"; not opening it"})
+            return
+        if (opened[-1] if opened else self.open_project_file(song)):
+            self.send_queue({'status': 'complete'})
+
+    def open_project_file(self, song: Dict) -> bool:
         # TODO: DAW agnostic?
         # just guessing at which file to open
         self.logger.debug("Resolving project file")
-        # inject project name
-        # unnecessary API call?
-        project = self.api_client.get_project(song['project'])
-        song['project_name'] = project['name']
+        if 'project_name' not in song:
+            # inject project name
+            project = self.api_client.get_project(song['project'])
+            song['project_name'] = project['name']
         project_files = glob.glob(join(appdata['source'], get_song_dir(song), "*.cpr"))
         latest_project_file = None
         try:
@@ -180,7 +385,7 @@ class WorkOnHandler(CommandHandler):
                 latest_project_file = max(project_files, key=getmtime)
             except ValueError:
                 self.send_queue({'status': 'error', 'msg': 'no DAW project file'})
-                return
+                return False
         else:
             latest_project_file = join(appdata['source'], get_song_dir(song), latest_project_file)
         self.logger.debug(f"Resolved project file to {latest_project_file}, opening in DAW")
@@ -188,8 +393,8 @@ class WorkOnHandler(CommandHandler):
             open_default_app(latest_project_file)
         except FileNotFoundError:
             self.send_queue({'status': 'error', 'msg': 'no DAW project file'})
-            return
-        self.send_queue({'status': 'complete'})
+            return False
+        return True
 
 
 class WorkDoneHandler(CommandHandler):
@@ -207,7 +412,8 @@ class WorkDoneHandler(CommandHandler):
             verdict = Verdict.REMOTE
         else:
             verdict = None
-        sync = self.sync_manager.sync(project, force_verdict=verdict)
+        with self.sync_manager.claim(project['id'], [song['id']]):
+            sync = self.sync_manager.sync(project, force_verdict=verdict)
         self.logger.debug("Sync done; trying unlock")
         try:
             self.api_client.unlock(song)
@@ -218,6 +424,24 @@ class WorkDoneHandler(CommandHandler):
         self.send_queue({'status': 'complete', 'sync': sync})
 
 
+class ArchiveHandler(CommandHandler):
+    def handle(self, data: Dict):
+        song = data['song']
+        self.logger.info(f"Archiving {song=}")
+        project = self.api_client.get_project(song['project'])
+        song = next(s for s in project['songs'] if s['id'] == song['song'])
+        if not get_lock_status(song_lock := self.api_client.lock(song, reason="Archive")):
+            self.send_queue({'status': 'error', 'lock': song_lock, 'msg': f"Song \"{song['name']}\" is locked",
+                             'component': 'song'})
+            return
+        try:
+            with self.sync_manager.claim(project['id'], [song['id']]):
+                result = self.sync_manager.archive(project, song, prune=data.get('prune', False))
+        finally:
+            self.api_client.unlock(song)
+        self.send_queue({'status': 'complete', 'archive': result})
+
+
 class UpdateHandler(CommandHandler):
     def handle(self, data: Dict):
         notify("Checking for updates...")
@@ -247,18 +471,32 @@ class LogReportHandler(CommandHandler):
             notify("No logs, so there's nothing to send...")
             return
         notify("Now sending your logs...")
-        tf = tempfile.NamedTemporaryFile(mode='wb', delete=False)
-        self.logger.debug("Compressing logs into zip...")
-        with ZipFile(tf, 'w') as z:
-            z.write(appdata['telemetry_file'])
-        tf.close()
-        self.logger.debug("Uploading...")
-        with open(tf.name, 'rb') as f:
-            self.api_client.report_logs(f.read())
-        unlink(tf.name)
+        logs = get_rotated_logs(appdata['telemetry_file'])
+        entries = []
+        space = config.LOG_UPLOAD_MAX_BYTES
+        if logs:
+            # The current log always goes first, cut down to its most recent part if it's too big on its own
+            if (size := getsize(logs[0])) > space:
+                self.logger.warning("Current log is %d bytes; sending only the last %d", size, space)
+            entries.append((logs[0], basename(logs[0]), space))
+            space -= min(size, space)
+        # Older logs and profiles fill the rest of the space, newest first
+        profile_dir = str(get_profile_dir())
+        for path in trim_to_size(logs[1:] + [str(path) for path in list_profiles()], space):
+            entries.append((path, f"profiles/{basename(path)}" if path.startswith(profile_dir) else basename(path),
+                            None))
+        self.logger.debug("Streaming %d files into log upload...", len(entries))
+        self.api_client.report_logs(lambda: iter_zip(entries, config.LOG_UPLOAD_CHUNK))
         notify("Logs have been sent.")
 
 
+class ProfilingHandler(CommandHandler):
+    def handle(self, data: Dict):
+        set_enabled(data.get('enabled', False))
+        notify(f"Profiling {'enabled' if is_enabled() else 'disabled'}.")
+        self.send_queue({'status': 'complete', 'profiling': is_enabled()})
+
+
 class SettingsHandler(CommandHandler):
     def handle(self, data: Dict):
         settings = SettingsUI()
@@ -266,4 +504,6 @@ class SettingsHandler(CommandHandler):
         settings.run()
         commit_settings(settings)
         self.sync_manager.context['watcher'].change_watch(appdata['audio_sync_dir'])
+        if journal_watcher := self.sync_manager.context.get('journal'):
+            journal_watcher.change_watch(appdata['source'])
         notify("Settings saved.")
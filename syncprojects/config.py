@@ -28,7 +28,10 @@ FIREWALL_NAME = "My Firewall"
 ##########################
 TELEMETRY = ""
 # Number of threads
+# Used for anything compared against S3 ETags or other clients' hashes
 DEFAULT_HASH_ALGO = md5
+# Used for purely local change detection; see syncprojects.hashing.HASH_ALGOS
+FINGERPRINT_ALGO = "blake2b"
 # Use hashing over SMB instead of quicker, manifest hashfile
 LEGACY_MODE = False
 NEURAL_DSP_PATH = "C:\\ProgramData\\Neural DSP"
@@ -40,9 +43,48 @@ AMP_PRESET_DIR = "X:\\SomeDir\\Amp Settings"
 #############
 CHANGELOG_HEADER_WIDTH = 50
 MAX_WORKERS = 25
+# Projects of one sync command processed at the same time; their file transfers share the MAX_WORKERS threads
+PROJECT_WORKERS = 3
+# Commands from the local API run at the same time
+COMMAND_WORKERS = 8
+# Transfer threads left to other syncs while a workon or workdone is transferring
+TRANSFER_BACKGROUND_SHARE = 4
+# How often newer revisions of songs are downloaded ahead of a sync, and at most how much per round
+PREFETCH_INTERVAL = 15 * 60
+PREFETCH_MAX_BYTES = 4 * 1024 * 1024 * 1024
+# Read size for hashing; rounded to a multiple of the filesystem block size
+HASH_BLOCK_SIZE = 1024 * 1024
+# Files at least this large are memory-mapped for hashing, and hashed this much at a time
+HASH_MMAP_THRESHOLD = 32 * 1024 * 1024
+HASH_MMAP_CHUNK = 8 * 1024 * 1024
+HASH_WORKERS_MAX = 16
+HASH_WORKERS_HDD = 2
+# Hashing read rate limits (bytes/s) while the DAW is running. The limit moves between these based on how busy the DAW
+# is, with the maximum configurable in settings.
+IO_THROTTLE_RATE = 50 * 1024 * 1024
+IO_THROTTLE_MIN_RATE = 5 * 1024 * 1024
+# Fraction of total CPU above which the DAW counts as fully busy (i.e. playing back or rendering)
+DAW_BUSY_CPU = 0.25
+DAW_CHECK_INTERVAL = 5
 TEXT_EDITOR = which("notepad") or which("gedit")
 PROJECT_GLOB = "*.cpr"
+# Applied to every song in addition to its project's and its own .syncignore; see syncprojects.sync.ignore for syntax
+DEFAULT_IGNORE_PATTERNS = (
+    "*.peak",
+    "*.csh",
+    "*.bak",
+    "Auto Saves/",
+    "Freeze/",
+    ".DS_Store",
+    "._*",
+    "Thumbs.db",
+    "desktop.ini",
+)
 BINARY_CLEAN_GLOB = "syncprojects*.exe"
+# Uncompressed size of the logs and profiles sent by a log report; the oldest are left out beyond this, and a current
+# log over it on its own is cut down to its end
+LOG_UPLOAD_MAX_BYTES = 8 * 1024 * 1024
+LOG_UPLOAD_CHUNK = 64 * 1024
 DAW_PROCESS_REGEX = re.compile(r'cubase', re.IGNORECASE)
 DAW_EXE_SEARCH_PATH = "C:\\Program Files\\Steinberg"
 UPDATE_INTERVAL = 3600 * 12
@@ -64,7 +106,21 @@ SIGNING_PUBLIC_KEY = ""
 DEBUG = False
 ENV = "DEV"
 LOGIN_MODE = "web"  # prompt, web
+# Seconds a command waits for the user to finish logging in through the browser
+LOGIN_TIMEOUT = 5 * 60
 SYNCPROJECTS_URL = "https://syncprojects.example.com/"
+# Seconds; individual endpoints can override the read timeout in syncprojects.api.ENDPOINT_READ_TIMEOUTS
+API_CONNECT_TIMEOUT = 5
+API_READ_TIMEOUT = 30
+# Idempotent API calls are retried this many times on connection errors, timeouts and 429/502/503/504
+API_RETRIES = 3
+API_BACKOFF_BASE = 0.5
+API_BACKOFF_MAX = 10
+API_POOL_SIZE = 10
+# Parallel calls when fetching many pages or projects at once
+API_CONCURRENCY = 4
+# Seconds project and song metadata is reused without asking the API; after that it's revalidated by ETag
+API_CACHE_TTL = 10
 
 # Temporary
 ACCESS_ID = ""
@@ -0,0 +1,241 @@
+import atexit
+import logging
+import mmap
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import md5, blake2b
+from threading import local, Lock
+from time import monotonic, sleep
+from typing import Callable
+
+from syncprojects import config, tracing
+from syncprojects.system import disk_is_rotational, process_running, set_thread_io_priority
+
+logger = logging.getLogger('syncprojects.hashing')
+
+HASH_ALGOS = {
+    'md5': md5,
+    # Considerably faster than md5 on 64-bit CPUs; truncated to the same length
+    'blake2b': lambda: blake2b(digest_size=16),
+}
+
+# One reusable read buffer per thread, so hashing doesn't allocate a new bytes object for every block
+_buffers = local()
+
+
+def get_buffer(size: int) -> memoryview:
+    buf = getattr(_buffers, 'buf', None)
+    if buf is None or len(buf) < size:
+        buf = _buffers.buf = bytearray(size)
+    return memoryview(buf)[:size]
+
+
+def get_block_size(stat: os.stat_result) -> int:
+    """
+    Round the configured block size to a multiple of the filesystem's preferred I/O size.
+    """
+    fs_block = getattr(stat, 'st_blksize', 0) or 4096
+    return max(fs_block, config.HASH_BLOCK_SIZE // fs_block * fs_block)
+
+
+class IOThrottle:
+    """
+    Lowers I/O priority and rate-limits hashing reads while the DAW is running, to avoid audio dropouts. The rate
+    limit adapts to how busy the DAW is. Shared by all hashing threads in this process; only the threads which read
+    through it get their I/O priority lowered.
+    """
+
+    def __init__(self):
+        self.engaged = False
+        self.rate = 0
+        self.throttled_seconds = 0.0
+        self.throttled_bytes = 0
+        self._daw = None
+        self._next_check = 0.0
+        self._allowance = 0.0
+        self._last = monotonic()
+        self._lock = Lock()
+        self._threads = local()
+
+    def check(self) -> bool:
+        """
+        :return: Whether reads should be throttled. Only actually looks for the DAW every DAW_CHECK_INTERVAL seconds.
+        """
+        now = monotonic()
+        if now < self._next_check:
+            return self.engaged
+        with self._lock:
+            if now < self._next_check:
+                return self.engaged
+            self._next_check = now + config.DAW_CHECK_INTERVAL
+            from syncprojects.storage import appdata
+            engaged = False
+            if appdata.get('low_priority_io', True):
+                try:
+                    if not self._daw or not self._daw.is_running():
+                        self._daw = process_running(config.DAW_PROCESS_REGEX)
+                    engaged = bool(self._daw)
+                    if engaged:
+                        self.rate = self.get_rate(appdata.get('io_throttle_rate', config.IO_THROTTLE_RATE))
+                except Exception as e:
+                    logger.debug("Couldn't check for DAW: %s", e)
+                    self._daw = None
+            if engaged != self.engaged:
+                logger.info("DAW %s; %s low-priority I/O", "running" if engaged else "stopped",
+                            "using" if engaged else "leaving")
+                self._allowance = 0.0
+                self._last = now
+            self.engaged = engaged
+            return engaged
+
+    def get_rate(self, max_rate: int) -> int:
+        # cpu_percent() is relative to the previous call, which is DAW_CHECK_INTERVAL ago
+        busy = self._daw.cpu_percent() / (100 * (os.cpu_count() or 1)) / config.DAW_BUSY_CPU
+        min_rate = min(config.IO_THROTTLE_MIN_RATE, max_rate)
+        return int(max_rate - (max_rate - min_rate) * min(1.0, busy))
+
+    def consume(self, size: int):
+        """
+        Account for size bytes read, sleeping as needed to stay under the current rate.
+        """
+        engaged = self.check()
+        if getattr(self._threads, 'low', False) != engaged:
+            set_thread_io_priority(engaged)
+            self._threads.low = engaged
+        if not engaged:
+            return
+        with self._lock:
+            now = monotonic()
+            # Allow at most a second's worth of burst
+            self._allowance = min(float(self.rate), self._allowance + (now - self._last) * self.rate) - size
+            self._last = now
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0.0
+            if wait:
+                self.throttled_seconds += wait
+                self.throttled_bytes += size
+        if wait:
+            sleep(wait)
+
+
+_io_throttle = IOThrottle()
+
+
+def get_io_throttle() -> IOThrottle:
+    return _io_throttle
+
+
+def hash_file(file_path, hash_inst=None, block_size: int = None) -> str:
+    """
+    Hash a file without copying it into Python objects: large files are memory-mapped, anything else is read into a
+    preallocated buffer.
+    :param file_path: File to hash
+    :param hash_inst: Hash object to update; a new DEFAULT_HASH_ALGO instance if not provided
+    :param block_size: Override the read size
+    :return: The hex digest of hash_inst
+    """
+    if not hash_inst:
+        hash_inst = config.DEFAULT_HASH_ALGO()
+    with open(file_path, 'rb', buffering=0) as fp:
+        stat = os.fstat(fp.fileno())
+        block_size = block_size or get_block_size(stat)
+        if stat.st_size >= config.HASH_MMAP_THRESHOLD:
+            try:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                    for offset in range(0, len(view), config.HASH_MMAP_CHUNK):
+                        # Every slice must be released before the map can be closed
+                        with view[offset:offset + config.HASH_MMAP_CHUNK] as chunk:
+                            _io_throttle.consume(len(chunk))
+                            hash_inst.update(chunk)
+                return hash_inst.hexdigest()
+            except (OSError, ValueError) as e:
+                # e.g. the file shrank, or the platform refuses to map it; fall back to reading
+                logger.debug("Couldn't mmap %s: %s", file_path, e)
+                fp.seek(0)
+        view = get_buffer(block_size)
+        while n := fp.readinto(view):
+            _io_throttle.consume(n)
+            hash_inst.update(view[:n])
+    return hash_inst.hexdigest()
+
+
+def new_fingerprint(algo: str = None):
+    return HASH_ALGOS[algo or config.FINGERPRINT_ALGO]()
+
+
+def fingerprint_file(file_path, algo: str = None) -> str:
+    """
+    Hash a file for local change detection only; the result must not be compared with S3 ETags.
+    """
+    return hash_file(file_path, new_fingerprint(algo))
+
+
+class HashService:
+    """
+    Long-lived pool that all hashing is submitted to, kept separate from the transfer threads. In process mode,
+    hashing runs outside of this interpreter's GIL; that's only worthwhile without the Rust extension.
+    """
+
+    def __init__(self, workers: int, processes: bool = False):
+        self.workers = workers
+        self.processes = processes
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def executor(self) -> Executor:
+        with self._lock:
+            if not self._executor:
+                logger.debug("Starting hash %s pool with %d workers", "process" if self.processes else "thread",
+                             self.workers)
+                if self.processes:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hash')
+            return self._executor
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        :param func: Must be a module-level function (or staticmethod) in process mode so it can be pickled
+        """
+        if not self.processes:
+            func = tracing.bind(func)
+        return self.executor.submit(func, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def get_hash_workers(path: str) -> int:
+    """
+    Hashing is bound by CPU on SSDs, but parallel reads on a spinning disk just make it seek.
+    """
+    if disk_is_rotational(path):
+        return config.HASH_WORKERS_HDD
+    return min(config.HASH_WORKERS_MAX, (os.cpu_count() or 1) + 2)
+
+
+def rust_available() -> bool:
+    try:
+        import syncprojects_fast  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_hash_service = None
+_hash_service_lock = Lock()
+
+
+def get_hash_service() -> HashService:
+    global _hash_service
+    with _hash_service_lock:
+        if not _hash_service:
+            from syncprojects.storage import appdata
+            workers = appdata.get('hash_workers') or get_hash_workers(appdata.get('source', '.'))
+            processes = bool(appdata.get('hash_processes')) and not rust_available()
+            _hash_service = HashService(workers, processes)
+            atexit.register(_hash_service.shutdown, wait=False)
+        return _hash_service
@@ -0,0 +1,126 @@
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from os.path import basename, getmtime, getsize, isfile
+from typing import Iterable, Iterator, List, Optional, Tuple
+from zipfile import ZipFile, ZIP_DEFLATED
+
+# Argument types that can't change between the log call and the background write, so formatting can wait
+IMMUTABLE_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Hands records to the background writer without formatting them first. The stock QueueHandler formats in the
+    calling thread so records can be pickled; this queue never leaves the process, so only arguments that might be
+    mutated before the writer gets to them are merged into the message up front.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, IMMUTABLE_TYPES) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def start_async_logging(target: logging.Logger, handlers: List[logging.Handler]) -> QueueListener:
+    """
+    Route target's records through a queue to handlers, which are written to by a background thread.
+    :return: The running listener; stopped (flushing the queue) at exit
+    """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    target.addHandler(LazyQueueHandler(log_queue))
+    listener.start()
+
+    def stop():
+        if listener._thread:
+            listener.stop()
+
+    atexit.register(stop)
+
+    def restart_in_child():
+        # A forked child (e.g. the web server) inherits the queue but not the writer thread
+        listener._thread = None
+        listener.start()
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=restart_in_child)
+    return listener
+
+
+def get_rotated_logs(log_file: str, backups: int = 3) -> List[str]:
+    """
+    :return: log_file and its RotatingFileHandler backups (.1 being the newest) that exist, newest first
+    """
+    return [path for path in [log_file] + [f"{log_file}.{n}" for n in range(1, backups + 1)] if isfile(path)]
+
+
+def trim_to_size(paths: Iterable[str], max_bytes: int) -> List[str]:
+    """
+    Keep the newest files whose total size fits in max_bytes.
+    """
+    paths = sorted(paths, key=getmtime, reverse=True)
+    kept = []
+    total = 0
+    for path in paths:
+        size = getsize(path)
+        if total + size > max_bytes:
+            logging.getLogger('syncprojects.log').debug("Leaving %s out of log report", path)
+            continue
+        kept.append(path)
+        total += size
+    return kept
+
+
+class _ChunkSink:
+    """
+    Write-only, unseekable target for ZipFile whose output is drained as it's produced.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_zip(entries: Iterable[Tuple[str, str, Optional[int]]], chunk_size: int) -> Iterator[bytes]:
+    """
+    Stream a deflated zip of (path, name in archive, max bytes) entries, holding about one chunk of it in memory at a
+    time. Files over their max bytes are cut down to their last max bytes; None means the whole file.
+    """
+    sink = _ChunkSink()
+    with ZipFile(sink, 'w', ZIP_DEFLATED) as z:
+        for path, arcname, max_bytes in entries:
+            try:
+                with open(path, 'rb') as src, z.open(arcname, 'w') as dst:
+                    remaining = os.fstat(src.fileno()).st_size
+                    if max_bytes is not None and remaining > max_bytes:
+                        src.seek(remaining - max_bytes)
+                        remaining = max_bytes
+                    # Stops at the size it had when opened, so anything logged since doesn't go over
+                    while remaining > 0 and (data := src.read(min(chunk_size, remaining))):
+                        remaining -= len(data)
+                        dst.write(data)
+                        if len(sink.buffer) >= chunk_size:
+                            yield sink.drain()
+            except FileNotFoundError:
+                # Rotated away since it was listed
+                continue
+    # The rest of the last entry and the central directory
+    if sink.buffer:
+        yield sink.drain()
+
@@ -0,0 +1,181 @@
+import re
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Tuple
+
+# Upper bounds in seconds; covers everything from a single API call to a large transfer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(key: LabelKey, extra: Dict[str, str] = None) -> str:
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def key(labels: Dict) -> LabelKey:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def samples(self):
+        """
+        :return: (name suffix, label key, extra labels, value) for every sample
+        """
+        with self._lock:
+            return [("", key, None, value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(key, extra)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, _, _ = entry = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(("_bucket", key, {'le': format_value(bound)}, cumulative))
+                samples.append(("_sum", key, None, total))
+                samples.append(("_count", key, None, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _get(self, cls, name: str, documentation: str, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, documentation, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._get(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._get(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        :return: Every metric in Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+LOCAL_WALK_SECONDS = registry.histogram('syncprojects_local_walk_seconds',
+                                        "Time to walk and hash a song's local files")
+REMOTE_LIST_SECONDS = registry.histogram('syncprojects_remote_list_seconds',
+                                         "Time to list a song's remote files")
+DIFF_SECONDS = registry.histogram('syncprojects_diff_seconds', "Time to diff local and remote manifests")
+HASH_SECONDS = registry.histogram('syncprojects_hash_seconds', "Time to check a project's songs for local changes")
+HASH_THROTTLED_SECONDS = registry.counter('syncprojects_hash_throttled_seconds_total',
+                                          "Time hashing reads were held back while the DAW was running")
+HASH_CACHE_HITS = registry.counter('syncprojects_hash_cache_hits_total',
+                                   "Songs whose fingerprint came from the change journal")
+HASH_CACHE_MISSES = registry.counter('syncprojects_hash_cache_misses_total', "Songs which had to be hashed")
+TRANSFER_SECONDS = registry.histogram('syncprojects_transfer_seconds', "Duration of a song's file transfer")
+TRANSFER_BYTES = registry.counter('syncprojects_transfer_bytes_total', "Bytes transferred, before compression")
+TRANSFER_FILES = registry.counter('syncprojects_transfer_files_total', "Files transferred")
+TRANSFER_FAILURES = registry.counter('syncprojects_transfer_failures_total', "Files which failed to transfer")
+TRANSFER_MISSING_DIRS = registry.counter('syncprojects_transfer_missing_dirs_total',
+                                         "Downloads retried after creating their missing target directory")
+TRANSFER_STAGED = registry.counter('syncprojects_transfer_staged_total',
+                                   "Downloads served by moving a prefetched file into place")
+TRANSFER_THROUGHPUT = registry.gauge('syncprojects_transfer_throughput_bytes',
+                                     "Bytes per second of the last transfer of a song")
+API_REQUEST_SECONDS = registry.histogram('syncprojects_api_request_seconds', "Latency of Syncprojects API calls")
+API_RETRIES = registry.counter('syncprojects_api_retries_total', "Syncprojects API calls which were retried")
+API_CACHE = registry.counter('syncprojects_api_cache_total',
+                             "Cacheable API calls by result: hit, revalidated (304) or miss")
+
+
+def song_labels(song: Dict) -> Dict[str, str]:
+    return {'project': song.get('project_name', song.get('project', "")), 'song': song['name']}
+
+
+def endpoint_label(path: str) -> str:
+    """
+    Collapse IDs in an API path so each endpoint is one series.
+    """
+    return re.sub(r'\d+', ':id', path)
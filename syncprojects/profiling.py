@@ -0,0 +1,196 @@
+import cProfile
+import functools
+import io
+import logging
+import pathlib
+import pstats
+import time
+import tracemalloc
+from datetime import datetime
+from threading import Lock, local
+from typing import Callable, List, Union
+
+from syncprojects import config
+from syncprojects.storage import appdata
+from syncprojects.system import get_datadir
+
+logger = logging.getLogger('syncprojects.profiling')
+
+# Artifacts beyond this many sessions are deleted, oldest first, so the log upload stays small
+PROFILE_KEEP = 10
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 5
+
+_local = local()
+_tracemalloc_lock = Lock()
+_tracemalloc_users = 0
+
+
+def is_enabled() -> bool:
+    return bool(appdata.get('profiling', False))
+
+
+def set_enabled(enabled: bool):
+    appdata['profiling'] = enabled
+    logger.info("Profiling %s", "enabled" if enabled else "disabled")
+
+
+def get_profile_dir() -> pathlib.Path:
+    if config.DEBUG:
+        profile_dir = pathlib.Path(".") / "profiles"
+    else:
+        profile_dir = get_datadir("syncprojects") / "profiles"
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    return profile_dir
+
+
+def list_profiles() -> List[pathlib.Path]:
+    """
+    :return: Profile artifacts, newest first
+    """
+    profile_dir = get_profile_dir()
+    return sorted((p for p in profile_dir.iterdir() if p.suffix in ('.prof', '.txt')),
+                  key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+def prune_profiles():
+    sessions = []
+    for path in list_profiles():
+        if path.stem not in sessions:
+            sessions.append(path.stem)
+    for path in list_profiles():
+        if path.stem in sessions[PROFILE_KEEP:]:
+            path.unlink(missing_ok=True)
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if not _tracemalloc_users and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if not _tracemalloc_users:
+            tracemalloc.stop()
+
+
+class ProfileSession:
+    """
+    cProfile and tracemalloc data for one call of a profiled function, including any work it hands to worker threads
+    via wrap().
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profiles = []
+        self._lock = Lock()
+        self.start_snapshot = None
+        self.end_snapshot = None
+        self.peak = 0
+        self.seconds = 0.0
+
+    def _profile(self, func: Callable, *args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Newer Pythons only allow one active profiler at a time; the outer one sees this call anyway
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                self.profiles.append(profile)
+
+    def wrap(self, func: Callable) -> Callable:
+        """
+        Profile func into this session when it's called, e.g. from a thread pool.
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self._profile(func, *args, **kwargs)
+
+        return wrapper
+
+    def run(self, func: Callable, *args, **kwargs):
+        _start_tracemalloc()
+        self.start_snapshot = tracemalloc.take_snapshot()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        # Before Python 3.9 the peak can't be reset, so it covers everything since tracing started
+        start = time.perf_counter()
+        try:
+            return self._profile(func, *args, **kwargs)
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.end_snapshot = tracemalloc.take_snapshot()
+            self.peak = tracemalloc.get_traced_memory()[1]
+            _stop_tracemalloc()
+
+    def summary(self, stats: pstats.Stats) -> str:
+        out = io.StringIO()
+        out.write(f"{self.name}: {self.seconds:.3f}s wall, {len(self.profiles)} profiled threads, "
+                  f"peak traced memory {self.peak / 1024 / 1024:.1f} MiB\n\n")
+        stats.stream = out
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        out.write(f"Top {TOP_ALLOCATIONS} allocation changes:\n")
+        for diff in self.end_snapshot.compare_to(self.start_snapshot, 'lineno')[:TOP_ALLOCATIONS]:
+            out.write(f"{diff}\n")
+        return out.getvalue()
+
+    def save(self) -> Union[pathlib.Path, None]:
+        """
+        Write a .prof file (loadable with pstats or snakeviz) and a readable .txt summary.
+        :return: Path of the .prof file
+        """
+        if not self.profiles:
+            return None
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stem = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{self.name}"
+        path = get_profile_dir() / f"{stem}.prof"
+        stats.dump_stats(str(path))
+        with open(path.with_suffix('.txt'), 'w') as f:
+            f.write(self.summary(stats))
+        prune_profiles()
+        logger.info("Wrote profile of %s to %s", self.name, path)
+        return path
+
+
+def get_session() -> Union[ProfileSession, None]:
+    return getattr(_local, 'session', None)
+
+
+def profiled(name: str):
+    """
+    Profile each call of the decorated function while profiling is enabled. Calls made while the same thread is
+    already being profiled are part of the outer session.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if get_session() or not is_enabled():
+                return func(*args, **kwargs)
+            session = _local.session = ProfileSession(name)
+            try:
+                return session.run(func, *args, **kwargs)
+            finally:
+                _local.session = None
+                try:
+                    session.save()
+                except Exception as e:
+                    logger.error("Couldn't save profile of %s: %s", name, e)
+
+        return wrapper
+
+    return decorator
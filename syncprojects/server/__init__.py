@@ -1,7 +1,8 @@
 from syncprojects.server.apiserver import app
 
 
-def start_server(main_queue, server_queue, **kwargs):
+def start_server(main_queue, server_queue, query_conn=None, **kwargs):
     app.config['main_queue'] = main_queue
     app.config['server_queue'] = server_queue
+    app.config['query_conn'] = query_conn
     app.run(**kwargs)
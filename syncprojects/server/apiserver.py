@@ -1,8 +1,9 @@
 import logging
 
-from flask import Flask, request, cli
+from flask import Flask, Response, request, cli
 
 from syncprojects.config import DEBUG, SYNCPROJECTS_URL
+from syncprojects.server.query import query
 from syncprojects.server.utils import queue_put, queue_get, response_started, verify_frontend_data
 
 app = Flask(__name__)
@@ -45,9 +46,21 @@ def update_client():
 @verify_frontend_data
 def sync(data):
     if 'projects' in data:
-        task = queue_put('sync', {'projects': data['projects']})
+        task = queue_put('sync', {'projects': data['projects'], 'rehash': data.get('rehash', False)})
     elif 'songs' in data:
-        task = queue_put('sync', {'songs': data['songs']})
+        task = queue_put('sync', {'songs': data['songs'], 'rehash': data.get('rehash', False)})
+    else:
+        return RESP_BAD_DATA
+    return response_started(task)
+
+
+@app.route('/api/plan', methods=['POST'])
+@verify_frontend_data
+def plan(data):
+    if 'projects' in data:
+        task = queue_put('plan', {'projects': data['projects'], 'rehash': data.get('rehash', False)})
+    elif 'songs' in data:
+        task = queue_put('plan', {'songs': data['songs'], 'rehash': data.get('rehash', False)})
     else:
         return RESP_BAD_DATA
     return response_started(task)
@@ -75,6 +88,14 @@ def logs():
     return {'result': 'started', 'task_id': queue_put('logs')}
 
 
+@app.route('/api/profiling', methods=['POST'])
+@verify_frontend_data
+def profiling(data):
+    if 'enabled' in data:
+        return response_started(queue_put('profiling', {'enabled': bool(data['enabled'])}))
+    return RESP_BAD_DATA
+
+
 @app.route('/api/settings', methods=['POST'])
 def settings():
     # TODO: security
@@ -97,12 +118,37 @@ def work_done(data):
     return RESP_BAD_DATA
 
 
+@app.route('/api/archive', methods=['POST'])
+@verify_frontend_data
+def archive(data):
+    if 'song' in data:
+        return response_started(queue_put('archive', data))
+    return RESP_BAD_DATA
+
+
 @app.route('/api/tasks', methods=['POST'])
 @verify_frontend_data
 def get_tasks(_):
     return response_started(queue_put('tasks'))
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    try:
+        text = query('metrics')
+    except TimeoutError:
+        return {'result': 'error', 'msg': 'timed out'}, 503
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/trace', methods=['GET'])
+def trace():
+    try:
+        return query('trace', task_id=request.args.get('task_id'))
+    except TimeoutError:
+        return {'result': 'error', 'msg': 'timed out'}, 503
+
+
 @app.after_request
 def add_cors_header(response):
     response.headers['Access-Control-Allow-Origin'] = SYNCPROJECTS_URL.rstrip('/')
@@ -0,0 +1,61 @@
+import logging
+import uuid
+from multiprocessing.connection import Connection
+from threading import Thread, Lock
+from typing import Callable, Dict
+
+from syncprojects.utils import report_error
+
+logger = logging.getLogger('syncprojects.server.query')
+
+QUERY_TIMEOUT = 5
+
+_query_lock = Lock()
+
+
+class QueryServer(Thread):
+    """
+    Answers read-only queries from the web server process, which can't see the state of the main process. Runs on
+    its own so queries are answered while the command queue is busy with a sync.
+    """
+
+    def __init__(self, conn: Connection):
+        super().__init__(daemon=True)
+        self.conn = conn
+        self.handlers: Dict[str, Callable] = {}
+
+    def register(self, name: str, handler: Callable):
+        self.handlers[name] = handler
+
+    def run(self):
+        while True:
+            try:
+                query_id, name, kwargs = self.conn.recv()
+            except (EOFError, OSError):
+                logger.debug("Query connection closed")
+                break
+            try:
+                result = self.handlers[name](**kwargs)
+            except Exception as e:
+                logger.error("Query %s failed: %s", name, e)
+                report_error(e)
+                result = None
+            self.conn.send((query_id, result))
+
+
+def query(name: str, timeout: float = QUERY_TIMEOUT, **kwargs):
+    """
+    Ask the main process for something. Only for use in the web server process.
+    :raises TimeoutError: If there was no answer in time
+    """
+    from syncprojects.server.apiserver import app
+    conn = app.config['query_conn']
+    query_id = str(uuid.uuid4())
+    with _query_lock:
+        conn.send((query_id, name, kwargs))
+        while conn.poll(timeout):
+            response_id, result = conn.recv()
+            # Answers to queries that timed out earlier are discarded
+            if response_id == query_id:
+                return result
+    raise TimeoutError(name)
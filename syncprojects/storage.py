@@ -14,10 +14,14 @@ logger = logging.getLogger('syncprojects.storage')
 
 
 class SongData:
-    def __init__(self, song_id: int, revision: int = 0, known_hash: str = ""):
+    # Records stored before the algorithm was tracked were always md5
+    hash_algo = "md5"
+
+    def __init__(self, song_id: int, revision: int = 0, known_hash: str = "", hash_algo: str = None):
         self.song_id = song_id
         self.revision = revision
         self.known_hash = known_hash
+        self.hash_algo = hash_algo or config.FINGERPRINT_ALGO
 
 
 def get_song(data: SqliteDict, song: int):
@@ -82,6 +86,19 @@ def get_audiodata() -> SqliteDict:
     return loaded_config
 
 
+def get_journaldata() -> SqliteDict:
+    if config.DEBUG:
+        config_dir = pathlib.Path(".")
+    else:
+        config_dir = get_datadir("syncprojects")
+    config_file = str(config_dir / "journal.sqlite")
+    if not isfile(config_file):
+        logger.info("Created journal db.")
+    loaded_config = SqliteDict(config_file)
+    loaded_config.autocommit = True
+    return loaded_config
+
+
 appdata = get_appdata()
 
 
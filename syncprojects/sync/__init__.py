@@ -1,18 +1,31 @@
+import threading
 import traceback
+from concurrent.futures import Future
 
 import datetime
 import logging
 import uuid
-from threading import Lock
-from typing import Dict, List, Type
+from typing import Any, Callable, Dict, Iterable, List, Set, Type, Tuple
 
 from syncprojects import config, commands
 from syncprojects.api import SyncAPI
+from syncprojects.profiling import profiled
 from syncprojects.storage import appdata
 from syncprojects.sync.backends import SyncBackend, Verdict
+from syncprojects.sync.claims import Claims, ClaimBusy
+from syncprojects.sync.scheduler import PriorityExecutor, get_command_priority
 from syncprojects.sync.operations import check_out
+from syncprojects.sync.plan import summarize
+from syncprojects.tracing import span
+from syncprojects.ui.message import set_main_thread_runner
 from syncprojects.utils import check_daw_running, print_hr, get_input_choice, create_project_dirs
 
+# Run by the dispatch loop itself: shutdown and update have to exit the main thread, credentials must be in place
+# before any command queued after them runs, and settings opens a Tk window, which has to be on the main thread
+INLINE_COMMANDS = {'auth', 'shutdown', 'update', 'settings'}
+# Queued by command threads for the dispatch loop to run, e.g. to show a dialog
+MAIN_THREAD_CALL = 'main_thread'
+
 
 class SyncManager:
     def __init__(self, api_client: SyncAPI, backend: Type[SyncBackend], headless: bool = False, context: Dict = None,
@@ -21,13 +34,24 @@ class SyncManager:
         self.api_client = api_client
         self.headless = headless
         self.tasks = set()
+        self.claims = Claims()
+        self.fatal_error = None
         if appdata.get('nested_folders'):
             create_project_dirs(self.api_client, appdata['source'])
         self._backend = backend(self.api_client, *args, **kwargs)
-        self.context = context
+        self.context = context or {}
+        if journal_watcher := self.context.get('journal'):
+            self._backend.journal = journal_watcher.journal
 
-    def sync(self, project: Dict, force_verdict: Verdict = None) -> Dict:
-        self.logger.info(f"Syncing project {project['name']}...")
+    def invalidate_journal(self):
+        if journal_watcher := self.context.get('journal'):
+            journal_watcher.journal.invalidate()
+
+    @staticmethod
+    def get_syncable_songs(project: Dict) -> Tuple[List[Dict], List[Dict]]:
+        """
+        :return: Songs to sync, and results for the ones that are skipped
+        """
         pre_results = []
         songs = []
         for song in project['songs']:
@@ -40,57 +64,203 @@ class SyncManager:
             else:
                 song['project_name'] = project['name']
                 songs.append(song)
+        return songs, pre_results
+
+    @profiled('sync')
+    def sync(self, project: Dict, force_verdict: Verdict = None, on_ready: Callable[[Dict], None] = None,
+             hashed: bool = False) -> Dict:
+        """
+        :param on_ready: Called with each song once it can be opened, which may be before the rest of it is synced.
+        Songs which fail to sync are never passed to it.
+        :param hashed: The songs were hashed by a pre_plan just before, so don't check them for local changes again
+        """
+        self.logger.info(f"Syncing project {project['name']}...")
+        songs, pre_results = self.get_syncable_songs(project)
         if not songs:
             self.logger.warning("No songs, skipping")
+            if on_ready:
+                self.call_ready(project['songs'], pre_results, set(), on_ready)
             return {'status': 'done', 'songs': None}
-        self.logger.debug(f"Got songs list {songs}")
-        self._backend.get_local_changes(songs)
-        results = self._backend.sync(project, songs, force_verdict)
+        self.logger.debug("Got songs list %s", songs)
+        if not hashed:
+            with span('get_local_changes', project=project['name']):
+                self._backend.get_local_changes(songs)
+        ready = set()
+
+        def song_ready(song: Dict):
+            ready.add(song['id'])
+            on_ready(song)
+
+        with span('sync', project=project['name']):
+            results = self._backend.sync(project, songs, force_verdict, on_ready=song_ready if on_ready else None)
+        if on_ready:
+            self.call_ready(songs, results['songs'], ready, on_ready)
         results['songs'].extend(pre_results)
         api_results = [s['id'] for s in results['songs'] if 'id' in s and s['action'] == "local"]
         if api_results:
             self.api_client.add_sync(project, api_results)
         return results
 
+    @staticmethod
+    def call_ready(songs: List[Dict], results: List[Dict], ready: Set[int], on_ready: Callable[[Dict], None]):
+        """
+        Pass on_ready each of songs that synced successfully and wasn't already passed to it during the sync.
+        """
+        succeeded = {result['song'] for result in results if result['result'] == 'success'}
+        for song in songs:
+            if song['id'] not in ready and song['name'] in succeeded:
+                on_ready(song)
+
+    def plan(self, project: Dict, force_verdict: Verdict = None) -> Dict:
+        """
+        Dry run of sync: verdicts, files and bytes to transfer and an estimated duration per song, plus totals.
+        """
+        self.logger.info(f"Planning sync of project {project['name']}...")
+        songs, pre_results = self.get_syncable_songs(project)
+        if not songs:
+            return {'status': 'done', 'songs': pre_results, 'totals': {}}
+        with span('get_local_changes', project=project['name']):
+            self._backend.get_local_changes(songs)
+        with span('plan', project=project['name']):
+            results = self._backend.plan(project, songs, force_verdict)
+        results['totals'] = summarize(results['songs'])
+        results['songs'].extend(pre_results)
+        return results
+
+    def pre_plan(self, project: Dict) -> Dict[int, Verdict]:
+        """
+        Cheap first pass of a sync: the verdict of each syncable song, from revisions and local fingerprints only.
+        :raises NotImplementedError: If the backend can't tell without syncing
+        """
+        songs, _ = self.get_syncable_songs(project)
+        if not songs:
+            return {}
+        with span('get_local_changes', project=project['name']):
+            self._backend.get_local_changes(songs)
+        with span('pre_plan', project=project['name']):
+            return self._backend.get_verdicts(project, songs)
+
+    def archive(self, project: Dict, song: Dict, prune: bool = False) -> Dict:
+        self.logger.info(f"Archiving song {song['name']}...")
+        with span('archive', project=project['name'], song=song['name']):
+            return self._backend.archive_song(project, song, prune)
+
+    def prefetch(self, project: Dict, song: Dict, max_bytes: int) -> int:
+        """
+        :return: Bytes downloaded; nothing if a command is working on the song, as it's about to be synced anyway. A
+        command that wants the song while it's being prefetched only waits for the files already downloading.
+        """
+        try:
+            with self.claim(project['id'], [song['id']], blocking=False):
+                with span('prefetch', project=project['name'], song=song['name']):
+                    return self._backend.prefetch(project, song, max_bytes,
+                                                  stop=lambda: self.claims.waited_on(project['id'], [song['id']]))
+        except ClaimBusy:
+            self.logger.debug("Not prefetching %s while a command is working on it", song['name'])
+            return 0
+
     def sync_amps(self, project: Dict):
-        return self._backend.sync_amps(project)
+        with span('sync_amps', project=project['name']):
+            return self._backend.sync_amps(project)
+
+    def claim(self, project_id: int, song_ids: Iterable[int] = None, blocking: bool = True):
+        """
+        Wait until no other command is working on the project (or just these songs of it), and keep it to ourselves
+        until the block exits.
+        :raises ClaimBusy: If blocking is False and it would have to wait
+        """
+        return self.claims.claim(project_id, song_ids, blocking)
+
+    def run_command(self, msg: Dict):
+        try:
+            {
+                'auth': commands.AuthHandler,
+                'sync': commands.SyncMultipleHandler,
+                'workon': commands.WorkOnHandler,
+                'workdone': commands.WorkDoneHandler,
+                'tasks': commands.GetTasksHandler,
+                'shutdown': commands.ShutdownHandler,
+                'update': commands.UpdateHandler,
+                'logs': commands.LogReportHandler,
+                'settings': commands.SettingsHandler,
+                'archive': commands.ArchiveHandler,
+                'plan': commands.PlanHandler,
+                'profiling': commands.ProfilingHandler,
+            }[msg['msg_type']](msg['task_id'], self.api_client, self).exec(msg['data'])
+        except SystemExit as e:
+            if threading.current_thread() is threading.main_thread():
+                raise e
+            # A command thread can't exit the app itself (its executor would swallow the exception); stop the
+            # dispatch loop, which raises it on the main thread
+            self.logger.info("Command %s asked to exit", msg['task_id'])
+            self.tasks.discard(msg['task_id'])
+            self.fatal_error = e
+            self.api_client.recv_queue.put(None)
+        except Exception as e:
+            # Project and song claims are released on the way out of the handler; server locks aren't
+            self.logger.error(f"Caught exception: {e}\n\n{traceback.format_exc()}")
+            # TODO: a little out of style
+            self.api_client.send_queue.put({'task_id': msg['task_id'], 'status': 'error'})
+            self.tasks.discard(msg['task_id'])
+            if config.DEBUG:
+                # Stop the service, as an exception in the dispatch loop would
+                self.fatal_error = e
+                self.api_client.recv_queue.put(None)
+                raise e
+            try:
+                import sentry_sdk
+                sentry_sdk.capture_exception(e)
+            except ImportError:
+                pass
 
     def run_service(self):
+        """
+        Runs each command from the queue in a thread of its own, so a long sync doesn't hold up the rest. Commands
+        working on the same project or song wait for each other (see claim).
+        """
         self.logger.debug("Starting syncprojects-client service")
         self.headless = True
+        self.api_client.queue_thread = threading.get_ident()
+        executor = PriorityExecutor(config.COMMAND_WORKERS, 'command')
+        set_main_thread_runner(self.run_on_main_thread)
         try:
             while msg := self.api_client.recv_queue.get():
-                self.logger.debug(f"Received {msg['task_id']=} {msg['msg_type']=} {msg['data']=}")
-                try:
-                    {
-                        'auth': commands.AuthHandler,
-                        'sync': commands.SyncMultipleHandler,
-                        'workon': commands.WorkOnHandler,
-                        'workdone': commands.WorkDoneHandler,
-                        'tasks': commands.GetTasksHandler,
-                        'shutdown': commands.ShutdownHandler,
-                        'update': commands.UpdateHandler,
-                        'logs': commands.LogReportHandler,
-                        'settings': commands.SettingsHandler,
-                    }[msg['msg_type']](msg['task_id'], self.api_client, self).exec(msg['data'])
-                except Exception as e:
-                    # How do we clean up locks and stuff?
-                    self.logger.error(f"Caught exception: {e}\n\n{traceback.print_exc()}")
-                    # TODO: a little out of style
-                    self.api_client.send_queue.put({'task_id': msg['task_id'], 'status': 'error'})
-                    self.tasks.remove(msg['task_id'])
-                    if sync_lock.locked():
-                        self.logger.debug("Lock was locked, unlocking.")
-                        sync_lock.release()
-                    if config.DEBUG:
-                        raise e
-                    try:
-                        import sentry_sdk
-                        sentry_sdk.capture_exception(e)
-                    except ImportError:
-                        pass
+                if msg['msg_type'] == MAIN_THREAD_CALL:
+                    self.run_main_thread_call(msg['data'])
+                    continue
+                self.logger.debug("Received task_id=%s msg_type=%s data=%s", msg['task_id'], msg['msg_type'],
+                                  msg['data'])
+                if msg['msg_type'] in INLINE_COMMANDS:
+                    self.run_command(msg)
+                else:
+                    # Interactive commands skip ahead of queued syncs, and their transfers ahead of running ones
+                    executor.submit(self.run_command, msg, level=get_command_priority(msg['msg_type']))
+            if self.fatal_error:
+                raise self.fatal_error
         except KeyboardInterrupt:
             self.logger.warning("Received SIGINT, exiting...")
+        finally:
+            set_main_thread_runner(None)
+            self.api_client.queue_thread = None
+            # Commands still queued would run against a service that's going away
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run_on_main_thread(self, func: Callable[[], Any]) -> Any:
+        """
+        Have the dispatch loop call func, e.g. to show a dialog, and wait for its result.
+        """
+        future = Future()
+        self.api_client.recv_queue.put({'task_id': None, 'msg_type': MAIN_THREAD_CALL,
+                                        'data': {'func': func, 'future': future}})
+        return future.result()
+
+    @staticmethod
+    def run_main_thread_call(data: Dict):
+        future = data['future']
+        try:
+            future.set_result(data['func']())
+        except BaseException as e:
+            future.set_exception(e)
 
     def run_tui(self):
         self.logger.debug("Starting sync TUI")
@@ -118,5 +288,3 @@ class SyncManager:
             projects = self.api_client.get_all_projects()
             commands.SyncMultipleHandler(str(uuid.uuid4()), self.api_client, self).handle({'projects': projects})
 
-
-sync_lock = Lock()
@@ -1,19 +1,22 @@
-from os.path import join, isdir, isfile
+from os.path import join, isdir, isfile, basename
 
 import concurrent
 import logging
 import os
 import time
 from abc import ABC, abstractmethod
-from concurrent.futures.thread import ThreadPoolExecutor
 from enum import Enum
 from glob import glob
-from typing import Dict, List, Union
+from typing import Callable, Dict, List, Union
 
 from syncprojects import config
 from syncprojects.api import SyncAPI
-from syncprojects.storage import appdata
-from syncprojects.utils import hash_file, get_song_dir, report_error
+from syncprojects.hashing import hash_file, get_hash_service, new_fingerprint, get_io_throttle
+from syncprojects.metrics import HASH_CACHE_HITS, HASH_CACHE_MISSES, HASH_SECONDS, HASH_THROTTLED_SECONDS, \
+    song_labels
+from syncprojects.storage import appdata, SongData
+from syncprojects.tracing import span
+from syncprojects.utils import get_song_dir, report_error
 
 logger = logging.getLogger('syncprojects.sync.backends')
 
@@ -31,12 +34,75 @@ class SyncBackend(ABC):
     def __init__(self, api_client: SyncAPI, *args, **kwargs):
         self.api_client = api_client
         self.local_hash_cache = {}
+        # Optional SourceJournal; lets get_local_changes skip songs that haven't changed
+        self.journal = None
         self.logger = logging.getLogger(f'syncprojects.sync.backends.{self.__class__.__name__}')
 
+    @property
+    def fingerprint_algo(self) -> str:
+        """
+        Algorithm used for local_hash_cache. Backends that compare these hashes with other clients' must override
+        this with config.DEFAULT_HASH_ALGO's name.
+        """
+        return config.FINGERPRINT_ALGO
+
+    def get_local_hash(self, song: Dict, algo: str) -> str:
+        """
+        :param algo: Algorithm of the hash this will be compared with
+        :return: Hash of the song's project files, from the cache when it was computed with the same algorithm
+        """
+        if algo == self.fingerprint_algo:
+            return self.local_hash_cache.get(f"{song['project']}:{song['id']}")
+        self.logger.debug("Known hash uses %s, rehashing %s to compare", algo, song['name'])
+        try:
+            return self.hash_project_root_directory(join(appdata['source'], get_song_dir(song)), algo)
+        except FileNotFoundError:
+            return ""
+
+    def upgrade_song_data(self, project_song_data: Dict, song: Dict, song_data: SongData):
+        """
+        Replace the record of an unchanged song whose known hash is from another algorithm with one using the current
+        fingerprint, so it's only rehashed with the old algorithm once.
+        :param project_song_data: Where song_data came from
+        """
+        if song_data.hash_algo == self.fingerprint_algo or song['revision'] != song_data.revision:
+            return
+        if fingerprint := self.local_hash_cache.get(f"{song['project']}:{song['id']}"):
+            self.logger.debug("Replacing %s hash of %s with %s", song_data.hash_algo, song['name'],
+                              self.fingerprint_algo)
+            project_song_data[song['id']] = SongData(song['id'], song_data.revision, fingerprint, self.fingerprint_algo)
+
     @abstractmethod
-    def sync(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None):
+    def sync(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None,
+             on_ready: Callable[[Dict], None] = None):
+        """
+        :param on_ready: Backends which can make a song openable before its sync is done call this with the song at
+        that point
+        """
         pass
 
+    def plan(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None) -> Dict:
+        """
+        Work out what sync would do without transferring anything or prompting.
+        :return: {'status', 'songs': [{'song', 'id', 'verdict', 'transfers': [{'direction', 'files', 'bytes', 'eta'}]}]};
+        bytes and eta are None where they aren't known
+        """
+        raise NotImplementedError()
+
+    def get_verdicts(self, project: Dict, songs: List[Dict]) -> Dict[int, Verdict]:
+        """
+        :return: Song ID -> what sync would do with it (None for nothing), without listing or transferring files
+        """
+        raise NotImplementedError()
+
+    def prefetch(self, project: Dict, song: Dict, max_bytes: int, stop: Callable[[], bool] = None) -> int:
+        """
+        Download a song's remote changes ahead of time, for sync to move into place.
+        :param stop: Checked before each file; once it returns True, the rest are skipped
+        :return: Bytes downloaded
+        """
+        raise NotImplementedError()
+
     def sync_amps(self, project: Dict):
         try:
             for amp in self.get_local_neural_dsp_amps():
@@ -48,6 +114,9 @@ class SyncBackend(ABC):
             self.logger.error("Error syncing amps: %s", e)
             report_error(e)
 
+    def archive_song(self, project: Dict, song: Dict, prune: bool = False) -> Dict:
+        raise NotImplementedError()
+
     @abstractmethod
     def push_amp_settings(self, amp: str, project: str):
         pass
@@ -64,31 +133,51 @@ class SyncBackend(ABC):
                     yield entry.name
 
     @staticmethod
-    def hash_project_root_directory(dir_name):
-        hash_algo = config.DEFAULT_HASH_ALGO()
+    def hash_project_root_directory(dir_name, algo: str = None):
+        hash_algo = new_fingerprint(algo)
         if isdir(dir_name):
-            for file_name in glob(join(dir_name, config.PROJECT_GLOB)):
-                if isfile(file_name):
-                    logger.debug(f"Hashing {file_name}")
-                    hash_file(file_name, hash_algo)
+            with span('hash_song', cat="hash", song=basename(dir_name)):
+                for file_name in glob(join(dir_name, config.PROJECT_GLOB)):
+                    if isfile(file_name):
+                        logger.debug("Hashing %s", file_name)
+                        hash_file(file_name, hash_algo)
             hash_digest = hash_algo.hexdigest()
             return hash_digest
 
     def get_local_changes(self, songs: List[Dict]):
         self.logger.info("Checking local files for changes...")
         start = time.perf_counter()
-        with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
-            futures = {
-                executor.submit(self.hash_project_root_directory,
-                                join(appdata['source'], get_song_dir(s))): s
-                for s in
-                songs}
-            for results in concurrent.futures.as_completed(futures):
-                song = futures[results]
-                try:
-                    src_hash = results.result()
-                except FileNotFoundError:
-                    self.logger.debug(f"Didn't get hash for {song['name']}")
-                    src_hash = ""
-                self.local_hash_cache[f"{song['project']}:{song['id']}"] = src_hash
-        self.logger.debug("Completed in %ds", round(time.perf_counter() - start, 2))
+        throttle = get_io_throttle()
+        throttled = throttle.throttled_seconds
+        algo = self.fingerprint_algo
+        hash_service = get_hash_service()
+        futures = {}
+        for song in songs:
+            song_dir = get_song_dir(song)
+            if self.journal and (cached := self.journal.get(song_dir, algo)):
+                self.local_hash_cache[f"{song['project']}:{song['id']}"] = cached
+                HASH_CACHE_HITS.inc(**song_labels(song))
+                continue
+            HASH_CACHE_MISSES.inc(**song_labels(song))
+            generation = self.journal.generation(song_dir) if self.journal else 0
+            futures[hash_service.submit(self.hash_project_root_directory,
+                                        join(appdata['source'], song_dir), algo)] = song, generation
+        self.logger.debug("%d of %d songs clean in journal", len(songs) - len(futures), len(songs))
+        for results in concurrent.futures.as_completed(futures):
+            song, generation = futures[results]
+            try:
+                src_hash = results.result()
+            except FileNotFoundError:
+                self.logger.debug("Didn't get hash for %s", song['name'])
+                src_hash = ""
+            self.local_hash_cache[f"{song['project']}:{song['id']}"] = src_hash
+            if self.journal:
+                self.journal.record(get_song_dir(song), generation, algo, src_hash)
+        duration = time.perf_counter() - start
+        self.logger.debug("Completed in %ds", round(duration, 2))
+        if songs:
+            HASH_SECONDS.observe(duration, project=song_labels(songs[0])['project'])
+        if throttle.throttled_seconds > throttled:
+            self.logger.info("Hashing throttled for %.2fs while DAW running", throttle.throttled_seconds - throttled)
+            HASH_THROTTLED_SECONDS.inc(throttle.throttled_seconds - throttled,
+                                       project=song_labels(songs[0])['project'])
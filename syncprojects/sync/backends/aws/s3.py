@@ -1,23 +1,59 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from os.path import join, isdir
+from concurrent.futures import as_completed
+from os.path import join, isdir, isfile, dirname, getsize
 
+import json
 import logging
 import os
+import re
+import tempfile
 import time
-from typing import Dict, List, Callable
+from threading import Lock
+from typing import Dict, List, Callable, Union, Iterator, Tuple
+
+from botocore.exceptions import ClientError
 
 from syncprojects import config
 from syncprojects.api import SyncAPI
 from syncprojects.config import DEBUG
+from syncprojects.hashing import hash_file, HashService, get_hash_service
+from syncprojects.metrics import LOCAL_WALK_SECONDS, REMOTE_LIST_SECONDS, DIFF_SECONDS, TRANSFER_SECONDS, \
+    TRANSFER_BYTES, TRANSFER_FILES, TRANSFER_FAILURES, TRANSFER_MISSING_DIRS, TRANSFER_THROUGHPUT, TRANSFER_STAGED, \
+    song_labels
+from syncprojects.profiling import profiled, get_session
 from syncprojects.storage import appdata, get_songdata, get_song, SongData
 from syncprojects.sync import SyncBackend
 from syncprojects.sync.backends import Verdict
 from syncprojects.sync.backends.aws.auth import AWSAuth
+from syncprojects.sync.bundle import TRAILER_SIZE, BundleError, write_bundle, parse_trailer, parse_index
+from syncprojects.sync.compression import IDENTITY, CompressingReader, CompressionStats, probe_encoding, \
+    decompress_stream
+from syncprojects.sync.daw import get_project_file, get_referenced_files
+from syncprojects.sync.ignore import IgnoreRules, get_ignore_rules, get_song_ignore_rules
+from syncprojects.sync.manifest import Manifest, get_difference
+from syncprojects.sync.plan import UPLOAD, DOWNLOAD, get_transfer, record_throughput
+from syncprojects.sync.prefetch import get_staged, get_staged_path, clear_staging, is_staged_name
+from syncprojects.sync.scheduler import PriorityExecutor, BACKGROUND, get_transfer_executor, priority
+from syncprojects.tracing import span, bind
 from syncprojects.ui.message import MessageBoxUI
 from syncprojects.ui.tray import notify
-from syncprojects.utils import get_song_dir, report_error, hash_file, request_local_api
+from syncprojects.utils import get_song_dir, report_error, request_local_api
 
 AWS_REGION = 'us-east-1'
+# Per-song object recording which files were uploaded compressed, and their original hashes
+MANIFEST_KEY = ".syncprojects_manifest.json"
+# Hashes in the remote manifest are used as file names, so anything else is rejected
+MD5_HEX = re.compile(r'^[0-9a-f]{32}$')
+# Left in a song's prefix when its objects are pruned after archiving, so they can be restored from the bundle
+PRUNED_KEY = ".syncprojects_pruned"
+ENCODING_METADATA = "syncprojects-encoding"
+# Object at the root of the bucket declaring the object format that all of its clients understand. Without it, the
+# bucket is on version 1: every object holds the file's raw bytes.
+FORMAT_KEY = ".syncprojects_format.json"
+# Objects may be compressed. Clients from before this write them raw and download them as-is, so the bucket is only
+# moved to this version once they've all been updated.
+COMPRESSION_FORMAT = 2
+# The newest format this client can read; it refuses to sync a bucket on anything newer
+FORMAT_VERSION = COMPRESSION_FORMAT
 
 logger = logging.getLogger('syncprojects.sync.backends.aws.s3')
 
@@ -64,6 +100,11 @@ def handle_archive(song_name: str) -> Verdict:
         return None
 
 
+def get_bundle_key(project: Dict, song: Dict) -> str:
+    # Kept outside of the song's prefix so that listing the song doesn't include it
+    return f"{project['id']}/archive/{song['id']}.bundle"
+
+
 def diff_paths(src: Dict, dst: Dict) -> List:
     return src.keys() - dst.keys()
 
@@ -75,6 +116,19 @@ class S3SyncBackend(SyncBackend):
         self.client = self.auth.authenticate()
         self.bucket = bucket
         self.logger.debug(f"Using bucket {bucket}")
+        # remote_path -> {key: {'encoding', 'hash', 'size'}} as last read from the bucket
+        self.remote_encodings = {}
+        # remote_path -> {key: entry or None} for files uploaded during the current transfer
+        self.uploaded_encodings = {}
+        self.compression_stats = {}
+        self._encoding_lock = Lock()
+        # remote_path -> (bundle key, index) for archived songs being restored from a bundle
+        self.bundles = {}
+        # remote_paths whose objects were last seen pruned
+        self.pruned = set()
+        # remote_path -> {key: staged path} of prefetched files the current transfer can move into place
+        self.staged = {}
+        self.bucket_format = None
 
     # This seems pretty generic; maybe it could be promoted?
     def get_verdict(self, song_data: SongData, song: Dict) -> Verdict:
@@ -84,9 +138,8 @@ class S3SyncBackend(SyncBackend):
         :param song: Song information from the API
         :return: A Verdict enum selection for what to do
         """
-        self.logger.debug(
-            f"Local revision {song_data.revision}, remote revision {song['revision']}")
-        local_hash = self.local_hash_cache.get(f"{song['project']}:{song['id']}")
+        self.logger.debug("Local revision %d, remote revision %d", song_data.revision, song['revision'])
+        local_hash = self.get_local_hash(song, song_data.hash_algo)
         local_changed = local_hash != song_data.known_hash
         if song['revision'] == song_data.revision:
             self.logger.debug("Local revision same as remote, further checks needed")
@@ -108,9 +161,21 @@ class S3SyncBackend(SyncBackend):
             self.logger.info("Local revision newer")
             return Verdict.LOCAL
 
-    def get_remote_manifest(self, path: str) -> Dict:
-        manifest = {}
-        self.logger.debug(f"Generating remote manifest from bucket {self.bucket} {path=}")
+    def get_verdicts(self, project: Dict, songs: List[Dict]) -> Dict[int, Verdict]:
+        verdicts = {}
+        with get_songdata(str(project['id'])) as project_song_data:
+            for song in songs:
+                song_data = get_song(project_song_data, song['id'])
+                if not (verdict := self.get_verdict(song_data, song)):
+                    self.upgrade_song_data(project_song_data, song, song_data)
+                verdicts[song['id']] = verdict
+        return verdicts
+
+    def get_remote_manifest(self, path: str, rules: IgnoreRules = None) -> Manifest:
+        manifest = Manifest()
+        has_encodings = False
+        pruned = False
+        self.logger.debug("Generating remote manifest from bucket %s path=%r", self.bucket, path)
         continuation_token = ""
         while True:
             if continuation_token:
@@ -120,7 +185,15 @@ class S3SyncBackend(SyncBackend):
                 results = self.client.list_objects_v2(Bucket=self.bucket, Prefix=path)
             if 'Contents' in results:
                 logger.debug("Got %d results", len(results['Contents']))
-                manifest.update({obj['Key'].split(path)[1]: obj['ETag'][1:-1] for obj in results['Contents']})
+                for obj in results['Contents']:
+                    key = obj['Key'].split(path)[1]
+                    if key == MANIFEST_KEY:
+                        has_encodings = True
+                        continue
+                    if key == PRUNED_KEY:
+                        pruned = True
+                        continue
+                    manifest.add(key, obj['ETag'][1:-1], obj['Size'], obj['LastModified'].timestamp())
             else:
                 logger.warning("No results retrieved")
                 break
@@ -129,42 +202,464 @@ class S3SyncBackend(SyncBackend):
             else:
                 continuation_token = results['NextContinuationToken']
                 logger.debug("Results truncated, fetching more")
+        encodings = {}
+        if has_encodings:
+            encodings = self.get_remote_encodings(path)
+        for key, entry in encodings.items():
+            # ETags of compressed objects can't be compared to local hashes, so use the original file's hash.
+            # The size check guards against the object being replaced by a client that didn't update the manifest.
+            if key in manifest and manifest.size(key) == entry['size']:
+                if not MD5_HEX.match(str(entry.get('hash'))):
+                    self.logger.warning("Ignoring remote manifest entry for %s%s with a bad hash", path, key)
+                    continue
+                manifest[key] = entry['hash']
+        self.remote_encodings[path] = encodings
+        if pruned:
+            self.pruned.add(path)
+        else:
+            self.pruned.discard(path)
+        if rules:
+            rules.filter(manifest)
         return manifest
 
-    def get_local_manifest(self, path: str) -> Dict:
+    def get_bucket_format(self, refresh: bool = False) -> int:
+        """
+        Read the object format version of the bucket from its format marker.
+        :param refresh: Read the marker again rather than using the version last read
+        :return: The format version; 1 if the bucket has no marker
+        """
+        if self.bucket_format is not None and not refresh:
+            return self.bucket_format
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=FORMAT_KEY)
+            self.bucket_format = int(json.loads(obj['Body'].read())['version'])
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                # Not remembered, so it's tried again next time
+                self.logger.error("Couldn't read bucket format: %s", e)
+                return 1
+            self.bucket_format = 1
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.error("Invalid bucket format marker: %s", e)
+            return 1
+        self.logger.debug("Bucket format is %d", self.bucket_format)
+        return self.bucket_format
+
+    def get_remote_encodings(self, path: str) -> Dict:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=path + MANIFEST_KEY)
+            return json.loads(obj['Body'].read())
+        except Exception as e:
+            self.logger.error("Couldn't read remote manifest for %s: %s", path, e)
+            return {}
+
+    def put_remote_encodings(self, path: str):
+        with self._encoding_lock:
+            uploaded = self.uploaded_encodings.pop(path, {})
+        if not uploaded:
+            return
+        encodings = self.remote_encodings.get(path, {}).copy()
+        for key, entry in uploaded.items():
+            if entry:
+                encodings[key] = entry
+            else:
+                encodings.pop(key, None)
+        if encodings == self.remote_encodings.get(path, {}):
+            return
+        self.logger.debug("Writing remote manifest with %d encoded files to %s", len(encodings), path)
+        self.client.put_object(Bucket=self.bucket, Key=path + MANIFEST_KEY,
+                               Body=json.dumps(encodings).encode())
+        self.remote_encodings[path] = encodings
+
+    def get_local_manifest(self, path: str, rules: IgnoreRules = None) -> Manifest:
         path = join(appdata['source'], path)
-        self.logger.debug(f"Generating local manifest from {path}")
+        self.logger.debug("Generating local manifest from %s", path)
+        if rules is None:
+            rules = get_ignore_rules(path)
         start = time.perf_counter()
         if fast_walk_dir:
-            results = fast_walk_dir(path)
+            results = Manifest()
+            for key, (digest, size, mtime) in sorted(fast_walk_dir(path, rules.patterns).items()):
+                results.add(key, digest, size, mtime)
         else:
-            results = walk_dir(path)
+            results = walk_dir(path, rules=rules)
         duration = time.perf_counter() - start
-        self.logger.debug(
-            f"Got {len(results)} files from local manifest; {round(duration, 4)} seconds; {fast_walk_dir=}")
+        self.logger.debug("Got %d files from local manifest; %.4f seconds; fast_walk_dir=%s", len(results), duration,
+                          bool(fast_walk_dir))
 
         return results
 
-    def handle_upload(self, song: Dict, key: str, remote_path: str):
-        self.client.upload_file(join(appdata['source'], get_song_dir(song), key),
-                                self.bucket,
-                                remote_path + key)
+    def get_compression_stats(self, remote_path: str) -> CompressionStats:
+        with self._encoding_lock:
+            return self.compression_stats.setdefault(remote_path, CompressionStats())
 
-    def handle_download(self, song: Dict, key: str, remote_path: str):
+    def record_encoding(self, remote_path: str, key: str, entry: Dict = None):
+        with self._encoding_lock:
+            self.uploaded_encodings.setdefault(remote_path, {})[key] = entry
+
+    def handle_upload(self, song: Dict, key: str, remote_path: str):
+        path = join(appdata['source'], get_song_dir(song), key)
+        # Only once every client of the bucket can decompress the object
+        compress = appdata.get('compression') and self.get_bucket_format() >= COMPRESSION_FORMAT
+        encoding = probe_encoding(path) if compress else IDENTITY
+        if encoding == IDENTITY:
+            size = getsize(path)
+            self.client.upload_file(path,
+                                    self.bucket,
+                                    remote_path + key)
+            self.get_compression_stats(remote_path).add(size, size, 0.0)
+            self.record_encoding(remote_path, key)
+            return
+        with open(path, 'rb') as fp:
+            reader = CompressingReader(fp, encoding)
+            self.client.upload_fileobj(reader,
+                                       self.bucket,
+                                       remote_path + key,
+                                       ExtraArgs={'Metadata': {ENCODING_METADATA: encoding}})
+        self.get_compression_stats(remote_path).add(reader.original_bytes, reader.encoded_bytes, reader.seconds)
+        self.record_encoding(remote_path, key, {'encoding': encoding,
+                                                'hash': reader.hexdigest(),
+                                                'size': reader.encoded_bytes})
+
+    def download_encoded(self, key: str, remote_path: str, target: str, entry: Dict):
+        """
+        Download an object the remote manifest lists as compressed. It's only decompressed if it's still the object
+        the manifest describes, the same check get_remote_manifest makes; one replaced by a client that didn't update
+        the manifest is written as is.
+        """
+        obj = self.client.get_object(Bucket=self.bucket, Key=remote_path + key)
+        encoding = entry['encoding']
+        if obj['ContentLength'] != entry['size'] or obj.get('Metadata', {}).get(ENCODING_METADATA) != encoding:
+            self.logger.debug("%s%s doesn't match the remote manifest; downloading as is", remote_path, key)
+            encoding = IDENTITY
+        with open(target, 'wb') as fp:
+            if encoding == IDENTITY:
+                for chunk in obj['Body'].iter_chunks():
+                    fp.write(chunk)
+                self.get_compression_stats(remote_path).add(obj['ContentLength'], obj['ContentLength'], 0.0)
+                return
+            stats = decompress_stream(obj['Body'].iter_chunks(), fp, encoding)
+        self.get_compression_stats(remote_path).add(stats.original_bytes, stats.encoded_bytes, stats.seconds)
+
+    def download(self, song: Dict, key: str, remote_path: str, target: str):
+        entry = self.remote_encodings.get(remote_path, {}).get(key)
         fail_count = 0
         while fail_count < 2:
             try:
-                self.client.download_file(self.bucket,
-                                          remote_path + key,
-                                          join(appdata['source'], get_song_dir(song), *key.split('/'))
-                                          )
+                if entry and entry['encoding'] != IDENTITY:
+                    self.download_encoded(key, remote_path, target, entry)
+                else:
+                    self.client.download_file(self.bucket,
+                                              remote_path + key,
+                                              target
+                                              )
+                    size = getsize(target)
+                    self.get_compression_stats(remote_path).add(size, size, 0.0)
                 break
             except FileNotFoundError:
-                os.makedirs(join(appdata['source'], get_song_dir(song), *key.split('/')[:-1]), exist_ok=True)
+                os.makedirs(dirname(target), exist_ok=True)
                 fail_count += 1
+                TRANSFER_MISSING_DIRS.inc(**song_labels(song))
+
+    def handle_download(self, song: Dict, key: str, remote_path: str):
+        target = join(appdata['source'], get_song_dir(song), *key.split('/'))
+        if staged := self.staged.get(remote_path, {}).get(key):
+            os.makedirs(dirname(target), exist_ok=True)
+            try:
+                os.replace(staged, target)
+            except FileNotFoundError:
+                # Another key with the same content took it
+                pass
+            else:
+                TRANSFER_STAGED.inc(**song_labels(song))
+                return
+        self.download(song, key, remote_path, target)
 
-    def sync(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None) -> Dict:
+    def prefetch(self, project: Dict, song: Dict, max_bytes: int, stop: Callable[[], bool] = None) -> int:
+        """
+        Download the files of a song that differ from the server into its staging area, at background priority.
+        :param max_bytes: Only stage up to this much
+        :param stop: Checked before each file; once it returns True, the rest are skipped
+        :return: Bytes downloaded
+        """
+        if self.get_bucket_format() > FORMAT_VERSION:
+            self.logger.debug("Not prefetching %s from a bucket in a newer format", song['name'])
+            return 0
+        remote_path = f"{project['id']}/{song['id']}/"
+        song_dir = join(appdata['source'], get_song_dir(song))
+        rules = get_song_ignore_rules(song)
+        labels = song_labels(song)
+        with REMOTE_LIST_SECONDS.time(**labels), span('remote_list', cat="s3", **labels):
+            remote_manifest = self.get_remote_manifest(remote_path, rules)
+        # This runs every few minutes for every song behind the server, so don't hash the local copy: only files that
+        # are missing or a different size locally are staged. Mtimes can't be used, as a file we uploaded ourselves is
+        # older on the server than here. Same-size changes are left to sync, which does the exact diff.
+        local_sizes = {key: stat.st_size for _, key, stat in scan_dir(song_dir, rules)} if isdir(song_dir) else {}
+        keys = []
+        total = 0
+        for key in remote_manifest:
+            if key in local_sizes and local_sizes[key] == remote_manifest.size(key):
+                continue
+            if not is_staged_name(digest := remote_manifest[key]):
+                self.logger.warning("Not prefetching %s; unexpected digest %r", key, digest)
+                continue
+            if isfile(get_staged_path(song, digest)):
+                continue
+            if total + max(remote_manifest.size(key), 0) > max_bytes:
+                break
+            keys.append(key)
+            total += max(remote_manifest.size(key), 0)
+        if not keys:
+            return 0
+
+        skipped = []
+
+        def stage(stage_song: Dict, key: str, stage_remote_path: str):
+            if skipped or (stop and stop()):
+                skipped.append(key)
+                return
+            path = get_staged_path(stage_song, remote_manifest[key])
+            # Only complete files get the staged name
+            try:
+                self.download(stage_song, key, stage_remote_path, path + ".part")
+                os.replace(path + ".part", path)
+            except Exception:
+                try:
+                    os.remove(path + ".part")
+                except FileNotFoundError:
+                    pass
+                raise
+
+        with priority(BACKGROUND):
+            completed = do_action(stage, song, remote_manifest, {}, remote_path, keys) - len(skipped)
+        if skipped:
+            self.logger.info("Stopped prefetching %s for a command that's waiting for it", song['name'])
+        self.logger.info("Prefetched %d of %d files of %s", completed, len(keys), song['name'])
+        self.compression_stats.pop(remote_path, None)
+        return total - sum(max(remote_manifest.size(key), 0) for key in skipped)
+
+    def handle_bundle_download(self, song: Dict, key: str, remote_path: str):
+        bundle_key, index = self.bundles[remote_path]
+        entry = index['files'][key]
+        target = join(appdata['source'], get_song_dir(song), *key.split('/'))
+        os.makedirs(dirname(target), exist_ok=True)
+        with open(target, 'wb') as fp:
+            if not entry['length']:
+                return
+            obj = self.client.get_object(Bucket=self.bucket, Key=bundle_key,
+                                         Range=f"bytes={entry['offset']}-{entry['offset'] + entry['length'] - 1}")
+            if entry['encoding'] == IDENTITY:
+                for chunk in obj['Body'].iter_chunks():
+                    fp.write(chunk)
+                self.get_compression_stats(remote_path).add(entry['length'], entry['length'], 0.0)
+            else:
+                stats = decompress_stream(obj['Body'].iter_chunks(), fp, entry['encoding'])
+                self.get_compression_stats(remote_path).add(stats.original_bytes, stats.encoded_bytes, stats.seconds)
+
+    def get_bundle_index(self, bundle_key: str) -> Union[Dict, None]:
+        """
+        Fetch the index of an archive bundle with two ranged GETs: one for the trailer, then one for the index.
+        :param bundle_key: Key of the bundle object
+        :return: The index, or None if there's no bundle
+        """
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=bundle_key, Range=f"bytes=-{TRAILER_SIZE}")
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise e
+        offset, length = parse_trailer(obj['Body'].read())
+        obj = self.client.get_object(Bucket=self.bucket, Key=bundle_key, Range=f"bytes={offset}-{offset + length - 1}")
+        return parse_index(obj['Body'].read())
+
+    def archive_song(self, project: Dict, song: Dict, prune: bool = False) -> Dict:
+        song['project_name'] = project['name']
+        song_name = song['name']
+        if not song['archived']:
+            return {'song': song_name, 'result': 'error', 'msg': 'Song is not marked as archived'}
+        with get_songdata(str(project['id'])) as project_song_data:
+            song_data = get_song(project_song_data, song['id'])
+        self.get_local_changes([song])
+        if self.get_verdict(song_data, song):
+            return {'song': song_name, 'result': 'error', 'msg': 'Song must be synced before it can be archived'}
+        local_manifest = self.get_local_manifest(get_song_dir(song), get_song_ignore_rules(song))
+        if not local_manifest:
+            return {'song': song_name, 'result': 'error', 'msg': 'Song has no local files'}
+
+        bundle_key = get_bundle_key(project, song)
+        self.logger.info(f"Bundling {len(local_manifest)} files of {song_name} into {bundle_key}")
+        start = time.perf_counter()
+        with tempfile.TemporaryFile() as fp:
+            index = write_bundle(fp, join(appdata['source'], get_song_dir(song)), local_manifest, song['revision'])
+            fp.seek(0)
+            self.client.upload_fileobj(fp, self.bucket, bundle_key)
+        if self.get_bundle_index(bundle_key) != index:
+            return {'song': song_name, 'result': 'error', 'msg': 'Uploaded bundle failed verification'}
+        self.logger.info(f"Bundled {song_name} in {round(time.perf_counter() - start, 4)} seconds.")
+
+        pruned = 0
+        if prune:
+            remote_path = f"{project['id']}/{song['id']}/"
+            remote_manifest = self.get_remote_manifest(remote_path)
+            # Only delete objects the bundle has an identical copy of
+            keys = [key for key, tag in remote_manifest.items()
+                    if key in index['files'] and index['files'][key]['hash'] == tag]
+            if self.remote_encodings.get(remote_path):
+                keys.append(MANIFEST_KEY)
+            # Marked first, so objects are restored after un-archiving even if pruning is cut short
+            self.client.put_object(Bucket=self.bucket, Key=remote_path + PRUNED_KEY, Body=bundle_key.encode())
+            for n in range(0, len(keys), 1000):
+                self.client.delete_objects(Bucket=self.bucket, Delete={
+                    'Objects': [{'Key': remote_path + key} for key in keys[n:n + 1000]],
+                    'Quiet': True,
+                })
+            pruned = len(keys)
+            self.logger.info(f"Pruned {pruned} objects archived in bundle")
+        return {'song': song_name, 'id': song['id'], 'result': 'success', 'action': 'archive',
+                'files': len(index['files']), 'pruned': pruned}
+
+    def restore_song(self, project: Dict, song: Dict, remote_path: str) -> int:
+        """
+        Put back the objects of a song which were pruned when it was archived, from its bundle. Members are copied
+        as stored, so compressed ones stay compressed, and the remote manifest is rewritten to match.
+        :return: Number of objects restored
+        """
+        bundle_key = get_bundle_key(project, song)
+        index = self.get_bundle_index(bundle_key)
+        if not index:
+            raise BundleError(f"Objects of {song['name']} were pruned, but there is no bundle to restore them from")
+        self.logger.info("Restoring %d pruned objects of %s from %s", len(index['files']), song['name'], bundle_key)
+        for key, entry in sorted(index['files'].items()):
+            extra_args = {}
+            if entry['encoding'] != IDENTITY:
+                extra_args['Metadata'] = {ENCODING_METADATA: entry['encoding']}
+            if entry['length']:
+                obj = self.client.get_object(Bucket=self.bucket, Key=bundle_key,
+                                             Range=f"bytes={entry['offset']}-{entry['offset'] + entry['length'] - 1}")
+                self.client.upload_fileobj(obj['Body'], self.bucket, remote_path + key, ExtraArgs=extra_args)
+            else:
+                self.client.put_object(Bucket=self.bucket, Key=remote_path + key, Body=b"", **extra_args)
+            if entry['encoding'] == IDENTITY:
+                self.record_encoding(remote_path, key)
+            else:
+                self.record_encoding(remote_path, key, {'encoding': entry['encoding'], 'hash': entry['hash'],
+                                                        'size': entry['length']})
+        self.put_remote_encodings(remote_path)
+        self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': [{'Key': remote_path + PRUNED_KEY}],
+                                                               'Quiet': True})
+        self.pruned.discard(remote_path)
+        return len(index['files'])
+
+    def get_manifests(self, project: Dict, song: Dict, remote_path: str) -> Tuple[Manifest, Manifest, Tuple]:
+        """
+        :return: Remote and local manifests of a song, and (bundle key, index) if the remote side is an archive bundle
+        """
+        rules = get_song_ignore_rules(song)
+        labels = song_labels(song)
+        bundle = None
+        with REMOTE_LIST_SECONDS.time(**labels), span('remote_list', cat="s3", **labels):
+            if song['archived']:
+                bundle_key = get_bundle_key(project, song)
+                index = self.get_bundle_index(bundle_key)
+                if index and index['revision'] != song['revision']:
+                    self.logger.debug("Ignoring bundle of old revision %d", index['revision'])
+                elif index:
+                    bundle = bundle_key, index
+            if bundle:
+                self.logger.debug("Using archive bundle for %s instead of listing", song['name'])
+                remote_manifest = Manifest()
+                for key in sorted(bundle[1]['files']):
+                    entry = bundle[1]['files'][key]
+                    remote_manifest.add(key, entry['hash'], entry['size'])
+                rules.filter(remote_manifest)
+            else:
+                remote_manifest = self.get_remote_manifest(remote_path, rules)
+                if remote_path in self.pruned and not song['archived']:
+                    # Un-archived since it was pruned
+                    self.restore_song(project, song, remote_path)
+                    remote_manifest = self.get_remote_manifest(remote_path, rules)
+        with LOCAL_WALK_SECONDS.time(**labels), span('local_walk', **labels):
+            local_manifest = self.get_local_manifest(get_song_dir(song), rules)
+        return remote_manifest, local_manifest, bundle
+
+    def plan(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None) -> Dict:
         results = {'status': 'done', 'songs': []}
+        with get_songdata(str(project['id'])) as project_song_data:
+            for song in songs:
+                song['project_name'] = project['name']
+                song_name = song['name']
+                try:
+                    verdict = force_verdict or self.get_verdict(get_song(project_song_data, song['id']), song)
+                    if not verdict:
+                        results['songs'].append({'song': song_name, 'id': song['id'], 'verdict': None})
+                        continue
+                    remote_path = f"{project['id']}/{song['id']}/"
+                    remote_manifest, local_manifest, _ = self.get_manifests(project, song, remote_path)
+                    if not local_manifest:
+                        verdict = Verdict.REMOTE if remote_manifest else None
+                    planned = {'song': song_name, 'id': song['id'], 'verdict': verdict and verdict.value,
+                               'transfers': []}
+                    if verdict in (Verdict.LOCAL, Verdict.CONFLICT):
+                        if song['archived']:
+                            # Syncing would ask whether to overwrite local files instead
+                            planned['archived'] = True
+                        keys = diff_manifests(local_manifest, remote_manifest)
+                        planned['transfers'].append(get_transfer(UPLOAD, keys, local_manifest.total_size(keys)))
+                    if verdict in (Verdict.REMOTE, Verdict.CONFLICT):
+                        keys = diff_manifests(remote_manifest, local_manifest)
+                        planned['transfers'].append(get_transfer(DOWNLOAD, keys, remote_manifest.total_size(keys)))
+                    results['songs'].append(planned)
+                except Exception as e:
+                    results['songs'].append({'song': song_name, 'id': song['id'], 'result': 'error', 'msg': str(e)})
+                    self.logger.error("Error planning %s: %s.", song_name, e)
+                    if DEBUG:
+                        raise e
+                    report_error(e)
+        return results
+
+    def open_early(self, song: Dict, src: Manifest, dst: Manifest, remote_path: str, action: Callable,
+                   keys: List[str], on_ready: Callable[[Dict], None]) -> int:
+        """
+        Download the song's project file and the files it uses, hand the song to on_ready, then download the rest at
+        background priority. If the project file can't be downloaded, the song isn't handed over and the rest is
+        downloaded as usual.
+        :return: Number of files transferred
+        :raises OSError: If the project file couldn't be downloaded
+        """
+        completed = 0
+        first = []
+        if project_file := get_project_file(song, src):
+            if project_file in keys:
+                if not do_action(action, song, src, dst, remote_path, [project_file]):
+                    # Nothing to open, so just get the rest down as a normal sync would
+                    do_action(action, song, src, dst, remote_path, [key for key in keys if key != project_file])
+                    raise OSError(f"Couldn't download {project_file}")
+                completed += 1
+            first = get_referenced_files(join(appdata['source'], get_song_dir(song), *project_file.split('/')),
+                                         [key for key in keys if key != project_file])
+            self.logger.debug("%s uses %d of the %d changed files", project_file, len(first), len(keys))
+            completed += do_action(action, song, src, dst, remote_path, first)
+        on_ready(song)
+        first = set(first)
+        rest = [key for key in keys if key != project_file and key not in first]
+        if rest:
+            notify(f"Downloading {len(rest)} more files of \"{song['name']}\" in the background...")
+            with priority(BACKGROUND):
+                completed += do_action(action, song, src, dst, remote_path, rest)
+            notify(f"\"{song['name']}\" is fully downloaded.")
+        return completed
+
+    def sync(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None,
+             on_ready: Callable[[Dict], None] = None) -> Dict:
+        results = {'status': 'done', 'songs': []}
+        bucket_format = self.get_bucket_format(refresh=True)
+        if bucket_format > FORMAT_VERSION:
+            self.logger.error("Bucket format %d is newer than supported format %d; not syncing", bucket_format,
+                              FORMAT_VERSION)
+            MessageBoxUI.error("The server's files are in a newer format than this version of syncprojects "
+                               "understands. Please update syncprojects to sync.")
+            results['songs'] = [{'song': song['name'], 'result': 'error', 'msg': "Update required"} for song in songs]
+            return results
         with get_songdata(str(project['id'])) as project_song_data:
             for song in songs:
                 try:
@@ -175,22 +670,25 @@ class S3SyncBackend(SyncBackend):
                     # Break out the song name since this is used a lot
                     song_name = song['name']
 
-                    self.logger.debug(f"Working on {song_name}")
+                    self.logger.debug("Working on %s", song_name)
                     if force_verdict:
                         verdict = force_verdict
-                        self.logger.debug(f"Using pre-specified {verdict=}")
+                        self.logger.debug("Using pre-specified verdict=%s", verdict)
                     else:
                         verdict = self.get_verdict(song_data, song)
 
-                    self.logger.debug(f"Got initial {verdict=}")
+                    self.logger.debug("Got initial verdict=%s", verdict)
                     if not verdict:
-                        self.logger.info(f"No action for {song_name}")
+                        self.logger.info("No action for %s", song_name)
+                        self.upgrade_song_data(project_song_data, song, song_data)
                         results['songs'].append({'song': song_name, 'result': 'success', 'action': None})
                         continue
                     remote_path = f"{project['id']}/{song['id']}/"
-                    remote_manifest = self.get_remote_manifest(remote_path)
-                    local_manifest = self.get_local_manifest(get_song_dir(song))
-
+                    remote_manifest, local_manifest, bundle = self.get_manifests(project, song, remote_path)
+                    if bundle:
+                        self.bundles[remote_path] = bundle
+                    else:
+                        self.bundles.pop(remote_path, None)
                     if not local_manifest:
                         if not remote_manifest:
                             logger.info("Both manifests empty; doing nothing")
@@ -213,23 +711,55 @@ class S3SyncBackend(SyncBackend):
                         new_song_data = SongData(song_id=song['id'],
                                                  known_hash=self.local_hash_cache.get(
                                                      f"{song['project']}:{song['id']}"),
-                                                 revision=song['revision'] + 1)
+                                                 revision=song['revision'] + 1,
+                                                 hash_algo=self.fingerprint_algo)
                     elif verdict == Verdict.REMOTE:
                         src = remote_manifest
                         dst = local_manifest
-                        action = self.handle_download
+                        action = self.handle_bundle_download if bundle else self.handle_download
                         new_song_data = SongData(song_id=song['id'],
-                                                 revision=song['revision'])
+                                                 revision=song['revision'],
+                                                 hash_algo=self.fingerprint_algo)
                     else:
-                        self.logger.info(f"{song_name} skipped")
+                        self.logger.info("%s skipped", song_name)
                         results['songs'].append({'song': song_name, 'result': 'success', 'action': None})
                         continue
 
                     self.logger.info("Starting parallel file transfer...")
+                    labels = song_labels(song)
+                    direction = UPLOAD if verdict == Verdict.LOCAL else DOWNLOAD
+                    with DIFF_SECONDS.time(**labels), span('diff', **labels):
+                        keys = diff_manifests(src, dst)
                     start_time = time.perf_counter()
-                    completed = do_action(action, song, src, dst, remote_path)
+                    if action == self.handle_download:
+                        self.staged[remote_path] = get_staged(song, src, keys)
+                        if self.staged[remote_path]:
+                            self.logger.info("%d of %d files already prefetched", len(self.staged[remote_path]),
+                                             len(keys))
+                    with span('transfer', cat="s3", direction=direction, files=len(keys), **labels):
+                        if on_ready and verdict == Verdict.REMOTE:
+                            completed = self.open_early(song, src, dst, remote_path, action, keys, on_ready)
+                        else:
+                            completed = do_action(action, song, src, dst, remote_path, keys)
                     duration = time.perf_counter() - start_time
-                    self.logger.info(f"Updated {completed} files in {round(duration, 4)} seconds.")
+                    self.logger.info("Updated %d files in %.4f seconds.", completed, duration)
+                    # Counted as each file goes over the wire, before compression; prefetched files moved into place
+                    # aren't, as they weren't transferred in this time
+                    stats = self.compression_stats.pop(remote_path, None) or CompressionStats()
+                    transferred = stats.original_bytes
+                    TRANSFER_SECONDS.observe(duration, direction=direction, **labels)
+                    TRANSFER_FILES.inc(completed, direction=direction, **labels)
+                    TRANSFER_FAILURES.inc(len(keys) - completed, direction=direction, **labels)
+                    TRANSFER_BYTES.inc(transferred, direction=direction, **labels)
+                    if completed == len(keys):
+                        if duration > 0:
+                            TRANSFER_THROUGHPUT.set(transferred / duration, direction=direction, **labels)
+                        record_throughput(direction, transferred, duration)
+                    self.staged.pop(remote_path, None)
+                    if stats.encoded_bytes != stats.original_bytes:
+                        self.logger.info("Compression: %s", stats)
+                    if verdict == Verdict.LOCAL:
+                        self.put_remote_encodings(remote_path)
                 except Exception as e:
                     results['songs'].append({'song': song_name, 'result': 'error', 'msg': str(e)})
                     self.logger.error("Error syncing %s: %s.", song_name, e)
@@ -239,10 +769,12 @@ class S3SyncBackend(SyncBackend):
                         raise e
                     report_error(e)
                 else:
+                    # Whatever is left was for another revision, or has been superseded
+                    clear_staging(song)
                     if new_song_data:
                         if not new_song_data.known_hash:
                             new_song_data.known_hash = SyncBackend.hash_project_root_directory(
-                                join(appdata['source'], get_song_dir(song)))
+                                join(appdata['source'], get_song_dir(song)), self.fingerprint_algo)
                         project_song_data[song['id']] = new_song_data
                         project_song_data.commit()
                     results['songs'].append(
@@ -251,7 +783,7 @@ class S3SyncBackend(SyncBackend):
                          'revision': song_data.revision,
                          'action': verdict.value
                          })
-                    self.logger.info(f"Successfully synced {song_name}")
+                    self.logger.info("Successfully synced %s", song_name)
         return results
 
     def push_amp_settings(self, amp: str, project: Dict):
@@ -301,71 +833,99 @@ class S3SyncBackend(SyncBackend):
             report_error(e)
 
 
-def do_action(action: Callable, song: Dict, src: Dict, dst: Dict, remote_path: str) -> int:
+def diff_manifests(src: Dict, dst: Dict) -> List[str]:
+    if fast_get_difference:
+        return fast_get_difference(src, dst)
+    return get_difference(src, dst)
+
+
+def get_transfer_pool() -> PriorityExecutor:
+    """
+    One pool for every file transfer, so songs and projects synced at the same time share the configured number of
+    workers rather than each getting their own. Files of interactive commands (workon, workdone) go first.
+    """
+    return get_transfer_executor(appdata.get('workers', config.MAX_WORKERS), config.TRANSFER_BACKGROUND_SHARE)
+
+
+def traced_action(action: Callable) -> Callable:
+    """
+    Record a span per file, tagged with the current task even though it runs in a pool thread.
+    """
+
+    def run(song: Dict, key: str, remote_path: str):
+        with span(action.__name__, cat="s3", song=song['name'], key=key):
+            return action(song, key, remote_path)
+
+    return bind(run)
+
+
+@profiled('do_action')
+def do_action(action: Callable, song: Dict, src: Dict, dst: Dict, remote_path: str, keys: List[str] = None) -> int:
+    if keys is None:
+        keys = diff_manifests(src, dst)
     if os.getenv('THREADS_OFF') == '1':
         logger.debug("Not using threading!")
         results = []
-        if fast_get_difference:
-            for key in fast_get_difference(src, dst):
-                try:
-                    results.append(action(song, key, remote_path))
-                except Exception as e:
-                    logger.error(f"{action=} failed with exception: {e}")
-        else:
-            for key, tag in src.items():
-                if key not in dst or tag != dst[key]:
-                    try:
-                        results.append(action(song, key, remote_path))
-                    except Exception as e:
-                        logger.error(f"{action=} failed with exception: {e}")
+        for key in keys:
+            try:
+                results.append(action(song, key, remote_path))
+            except Exception as e:
+                logger.error("action=%s failed with exception: %s", action, e)
         return len(results)
     else:
-        workers = appdata.get('workers', config.MAX_WORKERS)
-        logger.debug("Using %d threads", workers)
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            futures = []
-            if fast_get_difference:
-                for key in fast_get_difference(src, dst):
-                    futures.append(executor.submit(action, song, key, remote_path))
+        if session := get_session():
+            action = session.wrap(action)
+        action = traced_action(action)
+        executor = get_transfer_pool()
+        futures = []
+        for key in keys:
+            futures.append(executor.submit(action, song, key, remote_path))
+        done = 0
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("action=%s failed with exception: %s", action, e)
             else:
-                for key, tag in src.items():
-                    if key not in dst or tag != dst[key]:
-                        futures.append(executor.submit(action, song, key, remote_path))
-            done = 0
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    logger.error(f"{action=} failed with exception: {e}")
-                else:
-                    done += 1
-            if done != len(futures):
-                # noinspection PyBroadException
-                try:
-                    request_local_api('logs')
-                except Exception:
-                    pass
-            return done
+                done += 1
+        if done != len(futures):
+            # noinspection PyBroadException
+            try:
+                request_local_api('logs')
+            except Exception:
+                pass
+        return done
 
 
-def walk_dir(root: str, base: str = "", executor: ThreadPoolExecutor = None) -> Dict[str, str]:
-    top = False
-    if not executor:
-        if not isdir(root):
-            return {}
-        executor = ThreadPoolExecutor(max_workers=config.MAX_WORKERS)
-        top = True
-    futures = {}
+def scan_dir(root: str, rules: IgnoreRules, base: str = "") -> Iterator[Tuple[str, str, os.stat_result]]:
+    """
+    :return: (local path, manifest key, stat) of each file to be synced under root
+    """
     for entry in os.scandir(root):
-        path = join(root, entry)
-        if isdir(path):
-            futures.update(walk_dir(path, join(base, entry.name), executor))
+        key = f"{base}/{entry.name}" if base else entry.name
+        is_dir = entry.is_dir()
+        if rules.matches(key, entry.name, is_dir):
             continue
-        if not entry.name.endswith('.peak') and '\\' not in entry.name:
-            futures[executor.submit(hash_file, path)] = join(base, entry.name).replace("\\", "/")
-    if top:
-        manifest = {}
-        for future in as_completed(futures):
-            manifest[futures[future]] = future.result()
-        return manifest
-    return futures
+        if is_dir:
+            yield from scan_dir(entry.path, rules, key)
+        elif '\\' not in entry.name:
+            yield entry.path, key, entry.stat()
+
+
+def walk_dir(root: str, hash_service: HashService = None, rules: IgnoreRules = None) -> Manifest:
+    if not isdir(root):
+        return Manifest()
+    if not hash_service:
+        hash_service = get_hash_service()
+    if rules is None:
+        rules = get_ignore_rules(root)
+    futures = {hash_service.submit(hash_file, path): (key, stat) for path, key, stat in scan_dir(root, rules)}
+    results = {}
+    for future in as_completed(futures):
+        key, stat = futures[future]
+        results[key] = future.result(), stat
+    manifest = Manifest()
+    for key in sorted(results):
+        digest, stat = results[key]
+        manifest.add(key, digest, stat.st_size, stat.st_mtime)
+    return manifest
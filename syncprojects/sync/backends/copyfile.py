@@ -4,7 +4,7 @@ from os.path import isdir, join
 import os
 import sys
 import traceback
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 from syncprojects.storage import HashStore, appdata
 from syncprojects.sync import SyncBackend, Verdict
@@ -16,6 +16,9 @@ from syncprojects.utils import get_latest_change, fmt_error, current_user
 
 
 class ShareDriveSyncBackend(SyncBackend):
+    # Hashes are stored on the share drive and compared between clients
+    fingerprint_algo = "md5"
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.local_hs = HashStore(str(get_datadir("syncprojects") / "hashes"))
@@ -37,7 +40,7 @@ class ShareDriveSyncBackend(SyncBackend):
         if appdata['legacy_mode'] or not dst_hash:
             self.logger.info("Checking with the slow/old method just in case we missed it...")
             try:
-                dst_hash = self.hash_project_root_directory(join(dest, dir_name))
+                dst_hash = self.hash_project_root_directory(join(dest, dir_name), self.fingerprint_algo)
             except FileNotFoundError:
                 dst_hash = ""
         self.logger.debug(f"remote_hash is {dst_hash}")
@@ -57,7 +60,8 @@ class ShareDriveSyncBackend(SyncBackend):
         elif dst_hash and (not src_hash or dst_hash != known_hash):
             return Verdict.REMOTE
 
-    def sync(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None) -> Dict:
+    def sync(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None,
+             on_ready: Callable[[Dict], None] = None) -> Dict:
         project = project['name']
         remote_stores = {}
 
@@ -1,6 +1,6 @@
 import os
 import random
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 from syncprojects.sync import SyncBackend, Verdict
 
@@ -10,7 +10,8 @@ class RandomNoOpSyncBackend(SyncBackend):
     A SyncManager that doesn't actually do anything, but produces random output.
     """
 
-    def sync(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None):
+    def sync(self, project: Dict, songs: List[Dict], force_verdict: Verdict = None,
+             on_ready: Callable[[Dict], None] = None):
         result = {'status': 'done', 'songs': []}
         for song in songs:
             song_name = song['name']
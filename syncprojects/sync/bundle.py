@@ -0,0 +1,77 @@
+import json
+import logging
+import struct
+import zlib
+from os.path import join
+from typing import BinaryIO, Dict, Tuple
+
+from syncprojects.sync.compression import IDENTITY, CompressingReader, probe_encoding
+
+logger = logging.getLogger('syncprojects.sync.bundle')
+
+# A bundle is every file of a song revision concatenated (each member compressed on its own so it can be fetched
+# and extracted independently), followed by a zlib-compressed JSON index and a fixed-size trailer pointing at it:
+#   [member]...[index][MAGIC, index offset, index length]
+# Each member's 'hash' in the index is its MD5 from the local manifest, of the original bytes. That's what remote
+# manifests hold too (ETags of plain objects, original hashes of compressed ones), so the two can be compared.
+MAGIC = b'SPBUNDL1'
+TRAILER = struct.Struct('<8sQQ')
+TRAILER_SIZE = TRAILER.size
+
+
+class BundleError(Exception):
+    pass
+
+
+def write_bundle(fp: BinaryIO, root: str, manifest: Dict[str, str], revision: int) -> Dict:
+    """
+    Write a bundle of the files in manifest, which must be relative to root.
+    :param fp: Writable file to stream the bundle into
+    :param root: Local song directory
+    :param manifest: Local manifest of the song
+    :param revision: Song revision the bundle represents
+    :return: The bundle index
+    """
+    index = {'revision': revision, 'files': {}}
+    offset = 0
+    for key, digest in sorted(manifest.items()):
+        path = join(root, *key.split('/'))
+        encoding = probe_encoding(path)
+        with open(path, 'rb') as src:
+            if encoding == IDENTITY:
+                size = 0
+                while data := src.read(1024 * 1024):
+                    fp.write(data)
+                    size += len(data)
+                length = size
+            else:
+                reader = CompressingReader(src, encoding)
+                while data := reader.read(1024 * 1024):
+                    fp.write(data)
+                size = reader.original_bytes
+                length = reader.encoded_bytes
+        index['files'][key] = {'offset': offset, 'length': length, 'size': size, 'hash': digest,
+                               'encoding': encoding}
+        offset += length
+    encoded_index = zlib.compress(json.dumps(index).encode())
+    fp.write(encoded_index)
+    fp.write(TRAILER.pack(MAGIC, offset, len(encoded_index)))
+    logger.debug("Wrote bundle of %d files, %d bytes", len(index['files']), offset + len(encoded_index))
+    return index
+
+
+def parse_trailer(data: bytes) -> Tuple[int, int]:
+    """
+    :param data: The last TRAILER_SIZE bytes of a bundle
+    :return: Offset and length of the bundle index
+    """
+    if len(data) != TRAILER_SIZE:
+        raise BundleError("Truncated bundle trailer")
+    magic, offset, length = TRAILER.unpack(data)
+    if magic != MAGIC:
+        raise BundleError("Not a syncprojects bundle")
+    return offset, length
+
+
+def parse_index(data: bytes) -> Dict:
+    return json.loads(zlib.decompress(data))
@@ -0,0 +1,78 @@
+import logging
+from contextlib import contextmanager
+from threading import Condition
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+logger = logging.getLogger('syncprojects.sync.claims')
+
+
+class ClaimBusy(Exception):
+    """
+    Raised by a non-blocking claim when another command holds part of it.
+    """
+
+
+class Claims:
+    """
+    Keeps commands running at the same time off each other's files. A command claims a whole project or some of its
+    songs, and waits while any of them are claimed by another command. Everything is claimed at once, so two commands
+    can't each hold part of what the other is waiting for.
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+        self._projects: Set[int] = set()
+        self._songs: Dict[int, Set[int]] = {}
+        # What blocked claims are waiting for, as (project ID, song IDs or None for the whole project)
+        self._waiting: List[Tuple[int, Union[Set[int], None]]] = []
+
+    def _conflicts(self, project_id: int, song_ids: Set[int] = None) -> bool:
+        if project_id in self._projects:
+            return True
+        claimed = self._songs.get(project_id, set())
+        return bool(claimed) if song_ids is None else bool(claimed & song_ids)
+
+    def waited_on(self, project_id: int, song_ids: Iterable[int] = None) -> bool:
+        """
+        :return: Whether another command is waiting to claim any of the project (or these songs of it), so that
+        background work holding it can give way
+        """
+        song_ids = None if song_ids is None else set(song_ids)
+        with self._condition:
+            return any(waiting_project == project_id and (waiting_songs is None or song_ids is None or
+                                                          bool(waiting_songs & song_ids))
+                       for waiting_project, waiting_songs in self._waiting)
+
+    @contextmanager
+    def claim(self, project_id: int, song_ids: Iterable[int] = None, blocking: bool = True):
+        """
+        :param song_ids: Only claim these songs of the project; by default the whole project is claimed
+        :param blocking: If False, raise ClaimBusy rather than waiting
+        """
+        song_ids = None if song_ids is None else set(song_ids)
+        with self._condition:
+            if self._conflicts(project_id, song_ids):
+                if not blocking:
+                    raise ClaimBusy(project_id)
+                logger.debug("Waiting for another command to finish with project %s", project_id)
+                waiter = (project_id, song_ids)
+                self._waiting.append(waiter)
+                try:
+                    self._condition.wait_for(lambda: not self._conflicts(project_id, song_ids))
+                finally:
+                    self._waiting.remove(waiter)
+            if song_ids is None:
+                self._projects.add(project_id)
+            else:
+                self._songs.setdefault(project_id, set()).update(song_ids)
+        try:
+            yield
+        finally:
+            with self._condition:
+                if song_ids is None:
+                    self._projects.discard(project_id)
+                else:
+                    self._songs[project_id] -= song_ids
+                    if not self._songs[project_id]:
+                        del self._songs[project_id]
+                self._condition.notify_all()
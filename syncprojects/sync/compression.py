@@ -0,0 +1,177 @@
+import io
+import logging
+import lzma
+import time
+import zlib
+from os.path import splitext, getsize
+from threading import Lock
+from typing import BinaryIO, Iterable
+
+from syncprojects import config
+
+logger = logging.getLogger('syncprojects.sync.compression')
+
+IDENTITY = "identity"
+ZLIB = "zlib"
+LZMA = "lzma"
+
+# How much of a file is test-compressed to decide whether the whole file is worth compressing
+SAMPLE_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+MIN_SIZE = 4096
+# Compressed size of the sample relative to its original size must be below this
+RATIO_THRESHOLD = 0.85
+
+# Structured project data compresses far better with lzma, and these files are small enough for the extra CPU time
+LZMA_EXTENSIONS = {'.cpr', '.xml', '.vstpreset', '.fxp', '.fxb', '.mid', '.midi', '.txt', '.json'}
+# Already-compressed formats; don't bother probing
+SKIP_EXTENSIONS = {'.mp3', '.ogg', '.flac', '.m4a', '.aac', '.opus', '.zip', '.7z', '.gz', '.xz', '.png', '.jpg',
+                   '.jpeg'}
+
+
+def probe_encoding(path: str) -> str:
+    """
+    Pick an encoding for a file by compressing a sample from its start and middle.
+    :param path: Local path of the file to be uploaded
+    :return: IDENTITY if the file isn't worth compressing, otherwise ZLIB or LZMA
+    """
+    ext = splitext(path)[1].lower()
+    if ext in SKIP_EXTENSIONS:
+        return IDENTITY
+    size = getsize(path)
+    if size < MIN_SIZE:
+        return IDENTITY
+    with open(path, 'rb') as fp:
+        sample = fp.read(SAMPLE_SIZE)
+        if size > SAMPLE_SIZE * 2:
+            fp.seek(size // 2)
+            sample += fp.read(SAMPLE_SIZE)
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+    logger.debug("Sample compression ratio for %s is %.2f", path, ratio)
+    if ratio > RATIO_THRESHOLD:
+        return IDENTITY
+    if ext in LZMA_EXTENSIONS:
+        return LZMA
+    return ZLIB
+
+
+def get_compressor(encoding: str):
+    if encoding == ZLIB:
+        return zlib.compressobj(6)
+    elif encoding == LZMA:
+        return lzma.LZMACompressor(preset=6)
+    raise ValueError(f"Unknown encoding {encoding!r}")
+
+
+def get_decompressor(encoding: str):
+    if encoding == ZLIB:
+        return zlib.decompressobj()
+    elif encoding == LZMA:
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unknown encoding {encoding!r}")
+
+
+class CompressionStats:
+    """
+    Thread-safe running totals of bytes in/out and time spent (de)compressing for one transfer. Files sent as they are
+    count too, with the same size in and out.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.original_bytes = 0
+        self.encoded_bytes = 0
+        self.seconds = 0.0
+        self._lock = Lock()
+
+    def add(self, original_bytes: int, encoded_bytes: int, seconds: float):
+        with self._lock:
+            self.files += 1
+            self.original_bytes += original_bytes
+            self.encoded_bytes += encoded_bytes
+            self.seconds += seconds
+
+    @property
+    def ratio(self) -> float:
+        if not self.original_bytes:
+            return 1.0
+        return self.encoded_bytes / self.original_bytes
+
+    def __str__(self):
+        return (f"{self.files} files, {self.original_bytes} -> {self.encoded_bytes} bytes "
+                f"(ratio {self.ratio:.2f}) in {self.seconds:.2f} seconds")
+
+
+class CompressingReader(io.RawIOBase):
+    """
+    File-like object which compresses the wrapped file as it is read, so the compressed copy never has to exist in
+    full on disk or in memory. Also hashes the original bytes, since that's what the local manifest compares against.
+    """
+
+    def __init__(self, fp: BinaryIO, encoding: str):
+        self.fp = fp
+        self.encoding = encoding
+        self.compressor = get_compressor(encoding)
+        self.hash_inst = config.DEFAULT_HASH_ALGO()
+        self.original_bytes = 0
+        self.encoded_bytes = 0
+        self.seconds = 0.0
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self, size: int):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self.fp.read(CHUNK_SIZE)
+            start = time.perf_counter()
+            if data:
+                self.hash_inst.update(data)
+                self.original_bytes += len(data)
+                self._buffer += self.compressor.compress(data)
+            else:
+                self._buffer += self.compressor.flush()
+                self._eof = True
+            self.seconds += time.perf_counter() - start
+
+    def read(self, size: int = -1) -> bytes:
+        self._fill(size)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.encoded_bytes += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def hexdigest(self) -> str:
+        return self.hash_inst.hexdigest()
+
+
+def decompress_stream(chunks: Iterable[bytes], out: BinaryIO, encoding: str) -> CompressionStats:
+    """
+    Decompress an iterable of encoded chunks (e.g. a streaming S3 body) into a writable file.
+    :return: Stats for this one file
+    """
+    stats = CompressionStats()
+    decompressor = get_decompressor(encoding)
+    encoded = original = 0
+    seconds = 0.0
+    for chunk in chunks:
+        start = time.perf_counter()
+        data = decompressor.decompress(chunk)
+        seconds += time.perf_counter() - start
+        encoded += len(chunk)
+        original += len(data)
+        out.write(data)
+    if encoding == ZLIB:
+        data = decompressor.flush()
+        original += len(data)
+        out.write(data)
+    stats.add(original, encoded, seconds)
+    return stats
@@ -0,0 +1,52 @@
+import logging
+import re
+from typing import Dict, Iterable, List, Union
+
+from syncprojects.sync.manifest import Manifest
+
+# TODO: DAW agnostic?
+PROJECT_EXTENSION = ".cpr"
+# Runs of printable characters, as single bytes or UTF-16LE, long enough to be a file name
+ASCII_STRINGS = re.compile(rb'[\x20-\x7e]{4,}')
+UTF16_STRINGS = re.compile(rb'(?:[\x20-\x7e]\x00){4,}')
+
+logger = logging.getLogger('syncprojects.sync.daw')
+
+
+def get_project_file(song: Dict, manifest: Manifest) -> Union[str, None]:
+    """
+    Work out which project file of a song will be opened, from its manifest: the song's configured project file, or
+    else the most recently modified one at the top of the song.
+    :return: Key of the project file, or None if there isn't one
+    """
+    if (project_file := song.get('project_file')) and project_file in manifest:
+        return project_file
+    candidates = [key for key in manifest if '/' not in key and key.lower().endswith(PROJECT_EXTENSION)]
+    if not candidates:
+        return None
+    return max(candidates, key=manifest.mtime)
+
+
+def get_referenced_files(project_path: str, keys: Iterable[str]) -> List[str]:
+    """
+    Find which of keys a DAW project refers to. Project files are binary, but the paths of the audio they use are
+    in there as plain strings, so any key whose file name shows up is taken to be used.
+    :param project_path: Local path of the project file
+    """
+    by_name = {}
+    for key in keys:
+        by_name.setdefault(key.rsplit('/', 1)[-1], []).append(key)
+    try:
+        with open(project_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logger.warning("Couldn't read project file %s: %s", project_path, e)
+        return []
+    strings = [match.decode('ascii') for match in ASCII_STRINGS.findall(data)]
+    strings.extend(match.decode('utf-16-le') for match in UTF16_STRINGS.findall(data))
+    referenced = []
+    for string in strings:
+        name = re.split(r'[/\\]', string)[-1]
+        if name in by_name:
+            referenced.extend(by_name.pop(name))
+    return referenced
@@ -0,0 +1,137 @@
+import logging
+import re
+from os.path import join, isfile
+from typing import Dict, Iterable, List
+
+from syncprojects import config
+
+logger = logging.getLogger('syncprojects.sync.ignore')
+
+IGNORE_FILE = ".syncignore"
+
+# Semantics, which src/lib.rs implements identically for the Rust walker:
+# * One pattern per line; blank lines and lines starting with '#' are skipped, surrounding whitespace is stripped
+# * Matching is case-insensitive
+# * A trailing '/' only matches directories; an ignored directory excludes everything below it
+# * A pattern containing '/' is matched against the whole path relative to the song directory, otherwise against the
+#   name of each file and directory; this holds for a project's .syncignore too
+# * '*' matches anything except '/', '?' matches one character except '/', '**' matches anything
+
+
+def translate(pattern: str) -> str:
+    regex = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+            continue
+        c = pattern[i]
+        if c == '*':
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return ''.join(regex)
+
+
+class IgnoreRules:
+    def __init__(self, patterns: Iterable[str]):
+        # Kept as given, to pass on to the Rust walker
+        self.patterns: List[str] = []
+        self._rules = []
+        for line in patterns:
+            self.patterns.append(line)
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            line = line.lstrip('/')
+            if not line:
+                continue
+            self._rules.append((re.compile(translate(line.lower()), re.DOTALL), anchored, dir_only))
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def matches(self, rel_path: str, name: str, is_dir: bool) -> bool:
+        """
+        :param rel_path: '/'-separated path relative to the song directory
+        :param name: Last component of rel_path
+        :param is_dir: Whether rel_path is a directory
+        """
+        rel_path = rel_path.lower()
+        name = name.lower()
+        for regex, anchored, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(rel_path if anchored else name):
+                return True
+        return False
+
+    def is_ignored(self, path: str) -> bool:
+        """
+        Check a file path, including whether any of its parent directories are ignored.
+        :param path: '/'-separated path relative to the song directory
+        """
+        if not self._rules:
+            return False
+        parts = path.split('/')
+        for n in range(1, len(parts) + 1):
+            if self.matches('/'.join(parts[:n]), parts[n - 1], n < len(parts)):
+                return True
+        return False
+
+    def filter(self, manifest):
+        """
+        Remove ignored paths from a manifest in place.
+        """
+        if self._rules:
+            for key in [key for key in manifest if self.is_ignored(key)]:
+                del manifest[key]
+        return manifest
+
+
+def read_ignore_file(directory: str) -> List[str]:
+    """
+    :return: Lines of the .syncignore in directory, or none if it hasn't got one
+    """
+    ignore_file = join(directory, IGNORE_FILE)
+    if not isfile(ignore_file):
+        return []
+    try:
+        with open(ignore_file, encoding='utf-8') as f:
+            return f.read().splitlines()
+    except (OSError, UnicodeDecodeError) as e:
+        logger.error("Couldn't read %s: %s", ignore_file, e)
+        return []
+
+
+def get_ignore_rules(song_path: str, project_path: str = None) -> IgnoreRules:
+    """
+    Global ignore patterns, then the project's .syncignore and the song's own on top, for those that have one.
+    Patterns are all matched relative to the song directory.
+    :param song_path: Local song directory
+    :param project_path: Local project directory
+    """
+    from syncprojects.storage import appdata
+    patterns = list(config.DEFAULT_IGNORE_PATTERNS) + list(appdata.get('ignore_patterns', []))
+    if project_path:
+        patterns.extend(read_ignore_file(project_path))
+    patterns.extend(read_ignore_file(song_path))
+    return IgnoreRules(patterns)
+
+
+def get_song_ignore_rules(song: Dict) -> IgnoreRules:
+    """
+    Ignore rules for a song's local directory. Projects only have a directory, and so a .syncignore, with nested
+    folders.
+    """
+    from syncprojects.storage import appdata
+    from syncprojects.utils import get_song_dir
+    project_path = join(appdata['source'], song['project_name']) if appdata.get('nested_folders') else None
+    return get_ignore_rules(join(appdata['source'], get_song_dir(song)), project_path)
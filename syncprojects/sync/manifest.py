@@ -0,0 +1,205 @@
+import sys
+from array import array
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Mapping, Tuple, Union
+
+DIGEST_SIZE = 16
+EMPTY_DIGEST = bytes(DIGEST_SIZE)
+# Entries compared per slice when diffing manifests in the same order
+DIFF_BLOCK = 512
+
+
+class Manifest(MutableMapping):
+    """
+    Compact path -> hex digest mapping for the files of a song, with sizes and mtimes where known.
+
+    Directory prefixes are stored once, digests are kept as 16 raw bytes each in one contiguous buffer, and sizes and
+    mtimes in typed arrays. Digests that aren't 16-byte hex (e.g. multipart ETags) are kept as strings on the side.
+    Behaves like the Dict[str, str] manifests it replaces.
+    """
+
+    def __init__(self, entries: Mapping[str, str] = None):
+        self._dirs: List[str] = []
+        self._dir_ids: Dict[str, int] = {}
+        # Per directory: file name -> entry number
+        self._files: List[Dict[str, int]] = []
+        self._entry_dirs = array('I')
+        self._names: List[str] = []
+        self._digests = bytearray()
+        self._sizes = array('q')
+        self._mtimes = array('d')
+        self._other_digests: Dict[int, str] = {}
+        self._len = 0
+        if entries:
+            for path in sorted(entries):
+                self.add(path, entries[path])
+
+    @staticmethod
+    def split(path: str) -> Tuple[str, str]:
+        directory, _, name = path.rpartition('/')
+        return directory, name
+
+    def _lookup(self, path: str) -> int:
+        directory, name = self.split(path)
+        try:
+            return self._files[self._dir_ids[directory]][name]
+        except KeyError:
+            raise KeyError(path) from None
+
+    def _set_digest(self, i: int, digest: str):
+        try:
+            raw = bytes.fromhex(digest) if len(digest) == DIGEST_SIZE * 2 else None
+        except ValueError:
+            raw = None
+        if raw:
+            self._digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE] = raw
+            self._other_digests.pop(i, None)
+        else:
+            self._digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE] = EMPTY_DIGEST
+            self._other_digests[i] = digest
+
+    def add(self, path: str, digest: str, size: int = -1, mtime: float = 0.0):
+        """
+        Add or replace an entry. Adding in sorted path order makes diffs between manifests of the same tree faster.
+        """
+        if path in self:
+            i = self._lookup(path)
+            self._set_digest(i, digest)
+            self._sizes[i] = size
+            self._mtimes[i] = mtime
+            return
+        directory, name = self.split(path)
+        if (dir_id := self._dir_ids.get(directory)) is None:
+            dir_id = self._dir_ids[directory] = len(self._dirs)
+            self._dirs.append(sys.intern(directory))
+            self._files.append({})
+        i = len(self._names)
+        self._files[dir_id][name] = i
+        self._entry_dirs.append(dir_id)
+        self._names.append(name)
+        self._digests += EMPTY_DIGEST
+        self._sizes.append(size)
+        self._mtimes.append(mtime)
+        self._set_digest(i, digest)
+        self._len += 1
+
+    def _path(self, i: int) -> str:
+        directory = self._dirs[self._entry_dirs[i]]
+        return f"{directory}/{self._names[i]}" if directory else self._names[i]
+
+    def _live(self, i: int) -> bool:
+        return self._files[self._entry_dirs[i]].get(self._names[i]) == i
+
+    def _digest(self, i: int) -> str:
+        if i in self._other_digests:
+            return self._other_digests[i]
+        return self._digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE].hex()
+
+    def __getitem__(self, path: str) -> str:
+        return self._digest(self._lookup(path))
+
+    def __setitem__(self, path: str, digest: str):
+        if path in self:
+            self._set_digest(self._lookup(path), digest)
+        else:
+            self.add(path, digest)
+
+    def __delitem__(self, path: str):
+        # Leaves a tombstone in the arrays; the name no longer maps to the entry
+        directory, name = self.split(path)
+        self._lookup(path)
+        del self._files[self._dir_ids[directory]][name]
+        self._len -= 1
+
+    def __contains__(self, path) -> bool:
+        if not isinstance(path, str):
+            return False
+        directory, name = self.split(path)
+        dir_id = self._dir_ids.get(directory)
+        return dir_id is not None and name in self._files[dir_id]
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self._names)):
+            if self._live(i):
+                yield self._path(i)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __repr__(self):
+        return f"<Manifest of {self._len} files in {len(self._dirs)} directories>"
+
+    def items(self):
+        return [(self._path(i), self._digest(i)) for i in range(len(self._names)) if self._live(i)]
+
+    def size(self, path: str) -> int:
+        """
+        :return: Size in bytes, or -1 if not known
+        """
+        return self._sizes[self._lookup(path)]
+
+    def mtime(self, path: str) -> float:
+        return self._mtimes[self._lookup(path)]
+
+    def total_size(self, paths: List[str] = None) -> Union[int, None]:
+        """
+        :return: Sum of the sizes of paths (or every file), or None if any of them isn't known
+        """
+        if paths is None:
+            sizes = [self._sizes[i] for i in range(len(self._names)) if self._live(i)]
+        else:
+            sizes = [self.size(path) for path in paths]
+        if any(size < 0 for size in sizes):
+            return None
+        return sum(sizes)
+
+    def _align(self, other: 'Manifest') -> array:
+        """
+        :return: For each entry of self, the number of the entry with the same path in other, or -1
+        """
+        aligned = array('q', [-1]) * len(self._names)
+        for dir_id, files in enumerate(self._files):
+            other_dir = other._dir_ids.get(self._dirs[dir_id])
+            if other_dir is None:
+                continue
+            other_files = other._files[other_dir]
+            for name, i in files.items():
+                aligned[i] = other_files.get(name, -1)
+        return aligned
+
+    def _has_other_digests(self, start: int, end: int) -> bool:
+        return any(start <= i < end for i in self._other_digests)
+
+    def diff(self, other: 'Manifest') -> List[str]:
+        """
+        Paths in self that are missing from other or have a different digest. Where both manifests hold the same
+        paths in the same order, digests are compared a block of entries at a time.
+        """
+        aligned = self._align(other)
+        ours = memoryview(self._digests)
+        theirs = memoryview(other._digests)
+        results = []
+        count = len(self._names)
+        for start in range(0, count, DIFF_BLOCK):
+            end = min(start + DIFF_BLOCK, count)
+            same_order = (aligned[start] == start and aligned[end - 1] == end - 1
+                          and end <= len(other._names) and aligned[start:end] == array('q', range(start, end)))
+            if (same_order and not self._has_other_digests(start, end) and not other._has_other_digests(start, end)
+                    and ours[start * DIGEST_SIZE:end * DIGEST_SIZE] == theirs[start * DIGEST_SIZE:end * DIGEST_SIZE]):
+                continue
+            for i in range(start, end):
+                if not self._live(i):
+                    continue
+                j = aligned[i]
+                if j < 0 or self._digest(i) != other._digest(j):
+                    results.append(self._path(i))
+        return results
+
+
+def get_difference(src: Mapping[str, str], dst: Mapping[str, str]) -> List[str]:
+    """
+    :return: Keys in src that are missing from dst or have a different value
+    """
+    if isinstance(src, Manifest) and isinstance(dst, Manifest):
+        return src.diff(dst)
+    return [key for key, tag in src.items() if key not in dst or tag != dst[key]]
@@ -0,0 +1,78 @@
+import logging
+from threading import Lock
+from typing import Dict, List, Union
+
+from syncprojects.storage import appdata
+
+logger = logging.getLogger('syncprojects.sync.plan')
+
+UPLOAD = "upload"
+DOWNLOAD = "download"
+
+# Transfers smaller than this are dominated by per-request latency, so they'd skew the estimate
+MIN_SAMPLE_BYTES = 1024 * 1024
+# Weight of the newest sample in the moving average of throughput
+SMOOTHING = 0.3
+
+_throughput_lock = Lock()
+
+
+def record_throughput(direction: str, size: int, seconds: float):
+    """
+    Fold a completed transfer into the historical throughput for its direction.
+    :param direction: UPLOAD or DOWNLOAD
+    :param size: Bytes transferred (before compression)
+    :param seconds: Wall time of the whole transfer
+    """
+    if size < MIN_SAMPLE_BYTES or seconds <= 0:
+        return
+    rate = size / seconds
+    with _throughput_lock:
+        throughput = appdata.get('throughput', {})
+        if previous := throughput.get(direction):
+            rate = SMOOTHING * rate + (1 - SMOOTHING) * previous
+        throughput[direction] = rate
+        appdata['throughput'] = throughput
+    logger.debug("%s throughput now %.0f bytes/s", direction, rate)
+
+
+def get_throughput(direction: str) -> Union[float, None]:
+    """
+    :return: Average bytes per second of past transfers, or None if there haven't been any large enough to measure
+    """
+    return appdata.get('throughput', {}).get(direction)
+
+
+def estimate_seconds(direction: str, size: Union[int, None]) -> Union[float, None]:
+    """
+    :param size: Bytes to transfer, or None if not known
+    :return: None if there's no estimate, because the size or past throughput isn't known
+    """
+    if size is None:
+        return None
+    if not size:
+        return 0.0
+    if not (rate := get_throughput(direction)):
+        return None
+    return round(size / rate, 1)
+
+
+def get_transfer(direction: str, keys: List[str], size: Union[int, None]) -> Dict:
+    return {'direction': direction, 'files': len(keys), 'bytes': size, 'eta': estimate_seconds(direction, size)}
+
+
+def summarize(songs: List[Dict]) -> Dict:
+    """
+    Total up the transfers of planned songs. Both directions of a conflict are counted, since either could be chosen.
+    :return: {direction: {'files', 'bytes', 'eta'}}; bytes and eta are None if any transfer's size isn't known
+    """
+    totals = {}
+    for song in songs:
+        for transfer in song.get('transfers', []):
+            total = totals.setdefault(transfer['direction'], {'files': 0, 'bytes': 0})
+            total['files'] += transfer['files']
+            if total['bytes'] is not None:
+                total['bytes'] = None if transfer['bytes'] is None else total['bytes'] + transfer['bytes']
+    for direction, total in totals.items():
+        total['eta'] = estimate_seconds(direction, total['bytes'])
+    return totals
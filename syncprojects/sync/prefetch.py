@@ -0,0 +1,113 @@
+import logging
+import os
+import re
+import shutil
+from os.path import join, isfile
+from threading import Thread
+from time import sleep
+from typing import Dict, Iterable
+
+from syncprojects import config
+from syncprojects.storage import appdata, get_songdata
+from syncprojects.sync.manifest import Manifest
+from syncprojects.utils import report_error
+
+logger = logging.getLogger('syncprojects.sync.prefetch')
+
+# Kept under the sync folder so staged files are on the same drive as their destination and can be moved in place
+STAGING_DIR = ".syncprojects_staging"
+# MD5 hex digests, and the ETags of multipart uploads
+STAGED_NAME = re.compile(r'^[0-9a-f]{32}(-[0-9]+)?$')
+
+
+def get_staging_dir(song: Dict) -> str:
+    return join(appdata['source'], STAGING_DIR, str(song['project']), str(song['id']))
+
+
+def is_staged_name(digest: str) -> bool:
+    return bool(STAGED_NAME.match(digest))
+
+
+def get_staged_path(song: Dict, digest: str) -> str:
+    """
+    Staged files are named after the digest of the remote file, so an outdated one is never used.
+    :raises ValueError: If digest isn't one, and so might not be safe to use as a file name
+    """
+    if not is_staged_name(digest):
+        raise ValueError(f"Bad digest {digest!r}")
+    return join(get_staging_dir(song), digest)
+
+
+def get_staged(song: Dict, manifest: Manifest, keys: Iterable[str]) -> Dict[str, str]:
+    """
+    :return: Staged path of each of keys which has been prefetched at the version in manifest
+    """
+    return {key: path for key in keys
+            if is_staged_name(digest := manifest[key]) and isfile(path := get_staged_path(song, digest))}
+
+
+def clear_staging(song: Dict):
+    shutil.rmtree(get_staging_dir(song), ignore_errors=True)
+
+
+def clear_partial() -> int:
+    """
+    Remove partial downloads left in the staging area by a prefetch that was cut short, e.g. by the app exiting.
+    :return: Number of files removed
+    """
+    removed = 0
+    for root, _, files in os.walk(join(appdata['source'], STAGING_DIR)):
+        for name in files:
+            if name.endswith(".part"):
+                try:
+                    os.remove(join(root, name))
+                except OSError as e:
+                    logger.debug("Couldn't remove %s: %s", name, e)
+                else:
+                    removed += 1
+    return removed
+
+
+class Prefetcher(Thread):
+    """
+    Periodically downloads newer revisions of songs into the staging area at background priority, so a later sync
+    only has to move them into place.
+    """
+
+    def __init__(self, sync_manager):
+        super().__init__(daemon=True)
+        self.logger = logging.getLogger('syncprojects.sync.prefetch.Prefetcher')
+        self.sync_manager = sync_manager
+
+    def run(self):
+        self.logger.debug("Starting prefetch thread...")
+        if removed := clear_partial():
+            self.logger.debug("Removed %d partial prefetches", removed)
+        while True:
+            sleep(config.PREFETCH_INTERVAL)
+            if not appdata.get('prefetch', True):
+                continue
+            try:
+                self.prefetch()
+            except Exception as e:
+                self.logger.error("Prefetch failed: %s", e)
+                report_error(e)
+
+    def prefetch(self):
+        budget = config.PREFETCH_MAX_BYTES
+        for project in self.sync_manager.api_client.get_all_projects():
+            if not project.get('sync_enabled', True):
+                continue
+            with get_songdata(str(project['id'])) as project_song_data:
+                revisions = {song['id']: project_song_data[song['id']].revision if song['id'] in project_song_data
+                             else 0 for song in project['songs']}
+            for song in project['songs']:
+                # Only songs someone else has pushed since our last sync
+                if not song['sync_enabled'] or song['archived'] or song['revision'] <= revisions[song['id']]:
+                    continue
+                song['project_name'] = project['name']
+                self.logger.debug("Prefetching revision %d of %s", song['revision'], song['name'])
+                budget -= self.sync_manager.prefetch(project, song, budget)
+                if budget <= 0:
+                    self.logger.info("Prefetch size limit reached")
+                    return
@@ -0,0 +1,188 @@
+import functools
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Union
+
+# Lower runs first
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+
+COMMAND_PRIORITIES = {
+    'auth': INTERACTIVE,
+    'shutdown': INTERACTIVE,
+    'tasks': INTERACTIVE,
+    'workon': INTERACTIVE,
+    'workdone': INTERACTIVE,
+    'settings': INTERACTIVE,
+    'profiling': INTERACTIVE,
+}
+
+logger = logging.getLogger('syncprojects.sync.scheduler')
+
+_local = threading.local()
+
+
+def get_priority() -> int:
+    return getattr(_local, 'priority', NORMAL)
+
+
+@contextmanager
+def priority(level: int):
+    """
+    Work submitted to a PriorityExecutor by this thread runs at level until the block exits.
+    """
+    previous = get_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def bind(func: Callable) -> Callable:
+    """
+    Carry the current priority over to whichever thread ends up calling func.
+    """
+    level = get_priority()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with priority(level):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def get_command_priority(msg_type: str) -> int:
+    return COMMAND_PRIORITIES.get(msg_type, NORMAL)
+
+
+class PriorityExecutor:
+    """
+    Thread pool which starts the most urgent work first. With a share set, work below INTERACTIVE is limited to that
+    many threads while any INTERACTIVE work is waiting or running, so it slows down rather than competing, and picks
+    back up once the interactive work is done.
+    """
+
+    def __init__(self, max_workers: int, name: str, share: int = None):
+        self.max_workers = max_workers
+        self.name = name
+        self.share = share
+        self._condition = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._thread_ids = itertools.count()
+        self._threads = set()
+        self._idle = 0
+        self._running = {}
+        self._interactive = 0
+        self._shutdown = False
+
+    def resize(self, max_workers: int):
+        with self._condition:
+            if max_workers != self.max_workers:
+                logger.debug("Resizing %s pool to %d threads", self.name, max_workers)
+            self.max_workers = max_workers
+            # Extra threads exit once they're done with what they're running
+            self._condition.notify_all()
+
+    def submit(self, fn: Callable, *args, level: int = None, **kwargs) -> Future:
+        """
+        :param level: Priority to run at; by default the submitting thread's
+        """
+        level = get_priority() if level is None else level
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            heapq.heappush(self._queue, (level, next(self._counter), future, fn, args, kwargs))
+            if level == INTERACTIVE:
+                self._interactive += 1
+            if self._idle:
+                self._condition.notify_all()
+            if len(self._queue) > self._idle and len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, name=f"{self.name}_{next(self._thread_ids)}",
+                                          daemon=True)
+                self._threads.add(thread)
+                thread.start()
+        return future
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        """
+        Stop accepting work; threads exit once the queue is empty. Same arguments as Executor.shutdown.
+        :param cancel_futures: Cancel work that hasn't started rather than running it first
+        """
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for level, _, future, *_ in self._queue:
+                    future.cancel()
+                    if level == INTERACTIVE:
+                        self._interactive -= 1
+                self._queue.clear()
+            threads = list(self._threads)
+            self._condition.notify_all()
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _runnable(self) -> bool:
+        if not self._queue:
+            return False
+        level = self._queue[0][0]
+        if self.share is None or level == INTERACTIVE or not self._interactive:
+            return True
+        return sum(count for running, count in self._running.items() if running > INTERACTIVE) < self.share
+
+    def _work(self):
+        thread = threading.current_thread()
+        while True:
+            with self._condition:
+                self._idle += 1
+                while not self._runnable() and len(self._threads) <= self.max_workers and \
+                        not (self._shutdown and not self._queue):
+                    self._condition.wait()
+                self._idle -= 1
+                if len(self._threads) > self.max_workers or not self._queue:
+                    self._threads.discard(thread)
+                    self._condition.notify_all()
+                    return
+                level, _, future, fn, args, kwargs = heapq.heappop(self._queue)
+                self._running[level] = self._running.get(level, 0) + 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        with priority(level):
+                            result = fn(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._condition:
+                    self._running[level] -= 1
+                    if level == INTERACTIVE:
+                        self._interactive -= 1
+                    self._condition.notify_all()
+
+
+_transfer_executor: Union[PriorityExecutor, None] = None
+_transfer_executor_lock = threading.Lock()
+
+
+def get_transfer_executor(workers: int, share: int) -> PriorityExecutor:
+    """
+    The one pool all file transfers go through, resized to workers.
+    """
+    global _transfer_executor
+    with _transfer_executor_lock:
+        if not _transfer_executor:
+            _transfer_executor = PriorityExecutor(workers, 'transfer', share)
+        else:
+            _transfer_executor.resize(workers)
+        return _transfer_executor
@@ -1,4 +1,4 @@
-from multiprocessing import Queue, Process
+from multiprocessing import Queue, Process, Pipe
 from os.path import isdir, join
 
 import logging
@@ -8,23 +8,30 @@ import traceback
 from logging.handlers import RotatingFileHandler
 from multiprocessing.spawn import freeze_support
 
+import requests
+
 import syncprojects.ui.tray as tray
-from syncprojects import config as config
+from syncprojects import config as config, tracing
 from syncprojects.api import SyncAPI, login_prompt
 from syncprojects.config import ACCESS_ID, SECRET_KEY, DEBUG, BUCKET_NAME, AUDIO_BUCKET_NAME, SENTRY_URL
+from syncprojects.log import start_async_logging
+from syncprojects.metrics import registry
 from syncprojects.server import start_server
+from syncprojects.server.query import QueryServer
 from syncprojects.storage import appdata
 from syncprojects.sync import SyncManager
 from syncprojects.sync.backends.aws import NoAuthenticationCredentialsError
 from syncprojects.sync.backends.aws.auth import StaticAuth
 from syncprojects.sync.backends.aws.s3 import S3SyncBackend
 from syncprojects.sync.backends.noop import RandomNoOpSyncBackend
+from syncprojects.sync.prefetch import Prefetcher
 from syncprojects.system import open_app_in_browser, test_mode
 from syncprojects.ui.message import MessageBoxUI
 from syncprojects.ui.settings_menu import SettingsUI
 from syncprojects.utils import prompt_to_exit, parse_args, logger, check_update, UpdateThread, check_already_running, \
     commit_settings, init_sentry, handle_checkouts
 from syncprojects.watcher import S3AudioSyncHandler, Watcher
+from syncprojects.watcher.journal import SourceJournalWatcher
 
 __version__ = '2.4.30'
 
@@ -77,9 +84,14 @@ def main():
 
     # Start local Flask server
     logger.debug("Starting web API server process...")
-    web_process = Process(target=start_server, args=(main_queue, server_queue),
+    query_conn, server_query_conn = Pipe()
+    web_process = Process(target=start_server, args=(main_queue, server_queue, server_query_conn),
                           kwargs=dict(debug=config.DEBUG, use_reloader=False), daemon=True)
     web_process.start()
+    query_server = QueryServer(query_conn)
+    query_server.register('metrics', registry.render)
+    query_server.register('trace', tracing.export)
+    query_server.start()
 
     # init API client
     api_client = SyncAPI(appdata.get('refresh'), appdata.get('access'), appdata.get('username'), main_queue,
@@ -140,15 +152,27 @@ def main():
             context['watcher'] = watcher
             watcher.start()
 
+        journal_watcher = SourceJournalWatcher(appdata['source'])
+        context['journal'] = journal_watcher
+        journal_watcher.start()
+
         sync = SyncManager(api_client, backend, context=context, args=args)
         tray.tray_icon.notify("Syncprojects has started")
 
         handle_checkouts(api_client)
 
+        if not test_mode():
+            Prefetcher(sync).start()
+
         if parsed_args.tui:
             sync.run_tui()
         else:
             sync.run_service()
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        logger.critical(f"Couldn't reach the API: {e}")
+        MessageBoxUI.error("Failed to connect to the Syncprojects API! Check your internet connection and try again, "
+                           "or contact support if the error persists.\n\nExiting...")
+        sys.exit(1)
     except Exception as e:
         logger.critical(f"Fatal error!\n{str(e)} {str(traceback.format_exc())}")
         MessageBoxUI.error("Syncprojects encountered a fatal error and must exit. Please contact support.")
@@ -168,7 +192,6 @@ if __name__ == '__main__':
         ch.setLevel(logging.DEBUG)
     else:
         ch.setLevel(logging.INFO)
-    logger.addHandler(ch)
     if not appdata.get('telemetry_file') or appdata.get('nonpersist_telemetry_file'):
         appdata['telemetry_file'] = join(tempfile.gettempdir(), 'syncprojects.log')
         appdata['nonpersist_telemetry_file'] = True
@@ -177,7 +200,8 @@ if __name__ == '__main__':
     fh = RotatingFileHandler(appdata['telemetry_file'], maxBytes=1024 * 100, backupCount=3)
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(formatter)
-    logger.addHandler(fh)
+    # Handlers are written to from a background thread so transfers don't wait on formatting and disk writes
+    start_async_logging(logger, [ch, fh])
     logger.info(f"Logging debug output to {appdata['telemetry_file']}")
 
     logger.info("[v{}]".format(__version__))
@@ -3,6 +3,7 @@ import os
 import pathlib
 import platform
 import subprocess
+import threading
 import webbrowser
 from os import readlink, symlink
 
@@ -66,6 +67,50 @@ def process_running(regex):
             return process
 
 
+def disk_is_rotational(path: str) -> bool:
+    """
+    Best-effort check of whether path lives on a spinning disk. Only detectable on Linux; assumes SSD elsewhere.
+    """
+    if not is_linux():
+        return False
+    try:
+        dev = os.stat(path).st_dev
+        block = pathlib.Path(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}").resolve()
+        # Partitions don't have a queue of their own; their parent disk does
+        for candidate in (block, block.parent):
+            rotational = candidate / "queue" / "rotational"
+            if rotational.is_file():
+                return rotational.read_text().strip() == "1"
+    except OSError:
+        pass
+    return False
+
+
+def set_thread_io_priority(low: bool) -> bool:
+    """
+    Set the I/O priority of the calling thread only, leaving the rest of the process (transfers, the UI) alone.
+    :param low: Idle/background priority if True, otherwise back to normal
+    :return: Whether the platform supported it
+    """
+    try:
+        if is_linux():
+            # ioprio_set() given a thread id applies to just that thread
+            psutil.Process(threading.get_native_id()).ionice(
+                psutil.IOPRIO_CLASS_IDLE if low else psutil.IOPRIO_CLASS_BE)
+        elif is_windows():
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            # THREAD_MODE_BACKGROUND_BEGIN/END lower I/O and memory priority as well as CPU priority
+            if not kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 0x00010000 if low else 0x00020000):
+                raise ctypes.WinError()
+        else:
+            return False
+    except (psutil.Error, OSError) as e:
+        logger.debug("Couldn't set I/O priority: %s", e)
+        return False
+    return True
+
+
 def handle_link(src_name, dst_name, verbose, dry_run):
     link_dest = readlink(src_name)
     if verbose >= 1:
@@ -0,0 +1,85 @@
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Union
+
+# Oldest spans are dropped beyond this, so tracing can stay on all the time
+MAX_EVENTS = 20000
+
+_events = deque(maxlen=MAX_EVENTS)
+_thread_names = {}
+_local = threading.local()
+
+
+def get_task_id() -> Union[str, None]:
+    return getattr(_local, 'task_id', None)
+
+
+@contextmanager
+def task(task_id: str):
+    """
+    Tag spans recorded by this thread with task_id until the block exits.
+    """
+    previous = get_task_id()
+    _local.task_id = task_id
+    try:
+        yield
+    finally:
+        _local.task_id = previous
+
+
+def bind(func: Callable) -> Callable:
+    """
+    Carry the current task over to whichever thread ends up calling func, e.g. a thread pool worker.
+    """
+    task_id = get_task_id()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with task(task_id):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def span(name: str, cat: str = "sync", **args):
+    """
+    Record the block as a complete ("X") event of the Chrome trace format.
+    :param args: Shown with the span in the trace viewer, e.g. song=...
+    """
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        thread = threading.current_thread()
+        _thread_names[thread.ident] = thread.name
+        if task_id := get_task_id():
+            args['task_id'] = task_id
+        _events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': start // 1000, 'dur': (end - start) // 1000,
+                        'pid': os.getpid(), 'tid': thread.ident, 'args': args})
+
+
+def get_events(task_id: str = None) -> List[Dict]:
+    events = list(_events)
+    if task_id:
+        events = [event for event in events if event['args'].get('task_id') == task_id]
+    return events
+
+
+def export(task_id: str = None) -> Dict:
+    """
+    :param task_id: Only include spans of this task
+    :return: Chrome trace JSON, which can be loaded into chrome://tracing or ui.perfetto.dev
+    """
+    events = get_events(task_id)
+    pid = os.getpid()
+    metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'syncprojects'}}]
+    for tid in {event['tid'] for event in events}:
+        metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                         'args': {'name': _thread_names.get(tid, str(tid))}})
+    return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
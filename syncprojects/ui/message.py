@@ -1,5 +1,8 @@
 import logging
+import threading
 import tkinter as tk
+from threading import Lock
+from typing import Any, Callable, Union
 from tkinter.messagebox import showinfo, showerror, showwarning, askyesnocancel, askyesno
 
 WARNING = "warning"
@@ -16,6 +19,21 @@ LEVELS = {
     YESNOCANCEL: askyesnocancel,
 }
 
+# Projects sync in parallel, but only one dialog may be up at a time
+_dialog_lock = Lock()
+# Tk must only be used from the main thread (macOS crashes otherwise); while set, dialogs asked for by other threads
+# are handed to this to be shown there
+_main_thread_runner: Union[Callable[[Callable[[], Any]], Any], None] = None
+
+
+def set_main_thread_runner(runner: Union[Callable[[Callable[[], Any]], Any], None]):
+    """
+    :param runner: Calls the function it's given on the main thread and returns its result, or None to show dialogs
+    from whichever thread asks
+    """
+    global _main_thread_runner
+    _main_thread_runner = runner
+
 
 class MessageBoxUI:
     def __init__(self):
@@ -33,22 +51,29 @@ class MessageBoxUI:
         self.window.destroy()
         return result
 
+    @staticmethod
+    def prompt(message: str, title: str, level: str):
+        if (runner := _main_thread_runner) and threading.current_thread() is not threading.main_thread():
+            return runner(lambda: MessageBoxUI.prompt(message, title, level))
+        with _dialog_lock:
+            return MessageBoxUI().show(message, title, level)
+
     @staticmethod
     def info(message: str, title: str = ""):
-        return MessageBoxUI().show(message, title, INFO)
+        return MessageBoxUI.prompt(message, title, INFO)
 
     @staticmethod
     def warning(message: str, title: str = ""):
-        return MessageBoxUI().show(message, title, WARNING)
+        return MessageBoxUI.prompt(message, title, WARNING)
 
     @staticmethod
     def error(message: str, title: str = ""):
-        return MessageBoxUI().show(message, title, ERROR)
+        return MessageBoxUI.prompt(message, title, ERROR)
 
     @staticmethod
     def yesno(message: str, title: str = ""):
-        return MessageBoxUI().show(message, title, YESNO)
+        return MessageBoxUI.prompt(message, title, YESNO)
 
     @staticmethod
     def yesnocancel(message: str, title: str = ""):
-        return MessageBoxUI().show(message, title, YESNOCANCEL)
+        return MessageBoxUI.prompt(message, title, YESNOCANCEL)
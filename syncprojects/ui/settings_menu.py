@@ -18,10 +18,30 @@ class SettingsUI:
         self.audio_sync_source_button = None
         self.nested_check = tk.BooleanVar()
         self.nested_check.set(appdata.get('nested_folders', False))
+        self.compression_check = tk.BooleanVar()
+        self.compression_check.set(appdata.get('compression', False))
+        self.low_priority_io_check = tk.BooleanVar()
+        self.low_priority_io_check.set(appdata.get('low_priority_io', True))
+        self.profiling_check = tk.BooleanVar()
+        self.profiling_check.set(appdata.get('profiling', False))
+        self.open_early_check = tk.BooleanVar()
+        self.open_early_check.set(appdata.get('open_early', False))
+        self.prefetch_check = tk.BooleanVar()
+        self.prefetch_check.set(appdata.get('prefetch', True))
+        self.song_locking_check = tk.BooleanVar()
+        self.song_locking_check.set(appdata.get('song_locking', False))
         # Dest variables
         self.sync_source_dir = appdata.get('source')
         self.audio_sync_source_dir = appdata.get('audio_sync_dir')
         self.nested = False
+        self.compression = False
+        self.low_priority_io = True
+        self.profiling = False
+        self.open_early = False
+        self.prefetch = True
+        self.song_locking = False
+        self.io_throttle_field = None
+        self.io_throttle_rate = appdata.get('io_throttle_rate', config.IO_THROTTLE_RATE)
         self.workers_field = None
         self.workers = appdata.get('workers', config.MAX_WORKERS)
         self.logger = logging.getLogger('syncprojects.ui.first_start.SetupUI')
@@ -78,6 +98,30 @@ class SettingsUI:
         self.workers_field.insert(END, appdata.get('workers', config.MAX_WORKERS))
         label_c.pack()
         self.workers_field.pack()
+        compression_check = tk.Checkbutton(master=frame_c, text='Compress project files before uploading',
+                                           variable=self.compression_check, onvalue=True, offvalue=False)
+        compression_check.pack()
+        low_priority_io_check = tk.Checkbutton(master=frame_c, text='Reduce disk usage while the DAW is running',
+                                               variable=self.low_priority_io_check, onvalue=True, offvalue=False)
+        low_priority_io_check.pack()
+        label_io_throttle = tk.Label(master=frame_c, text="Maximum file checking speed while the DAW is running "
+                                                          "(MB/s):")
+        self.io_throttle_field = tk.Entry(master=frame_c)
+        self.io_throttle_field.insert(END, self.io_throttle_rate // (1024 * 1024))
+        label_io_throttle.pack()
+        self.io_throttle_field.pack()
+        profiling_check = tk.Checkbutton(master=frame_c, text='Record performance profiles (sent with logs)',
+                                         variable=self.profiling_check, onvalue=True, offvalue=False)
+        profiling_check.pack()
+        open_early_check = tk.Checkbutton(master=frame_c, text='Open songs in the DAW before all audio is downloaded',
+                                          variable=self.open_early_check, onvalue=True, offvalue=False)
+        open_early_check.pack()
+        prefetch_check = tk.Checkbutton(master=frame_c, text="Download bandmates' changes in the background",
+                                        variable=self.prefetch_check, onvalue=True, offvalue=False)
+        prefetch_check.pack()
+        song_locking_check = tk.Checkbutton(master=frame_c, text="Only lock the songs being synced, not whole projects",
+                                            variable=self.song_locking_check, onvalue=True, offvalue=False)
+        song_locking_check.pack()
         frame_c.pack()
 
         save_button = tk.Button(master=frame_d, text="Save", command=self.quit)
@@ -90,6 +134,12 @@ class SettingsUI:
 
     def quit(self):
         self.nested = self.nested_check.get()
+        self.compression = self.compression_check.get()
+        self.low_priority_io = self.low_priority_io_check.get()
+        self.profiling = self.profiling_check.get()
+        self.open_early = self.open_early_check.get()
+        self.prefetch = self.prefetch_check.get()
+        self.song_locking = self.song_locking_check.get()
         self.logger.debug("Quit button pressed.")
         if not self.sync_source_dir or not self.audio_sync_source_dir:
             showwarning(master=self.window, title="Missing Information!",
@@ -102,12 +152,13 @@ class SettingsUI:
         else:
             try:
                 self.workers = int(self.workers_field.get())
-                if self.workers <= 0:
+                self.io_throttle_rate = int(self.io_throttle_field.get()) * 1024 * 1024
+                if self.workers <= 0 or self.io_throttle_rate <= 0:
                     raise ValueError()
             except ValueError:
-                self.logger.debug("Workers not a valid number.")
+                self.logger.debug("Workers or I/O rate not a valid number.")
                 showwarning(master=self.window, title="Invalid number!",
-                            message="Please ensure a valid, positive number is used for the workers field.")
+                            message="Please ensure valid, positive numbers are used for the workers and speed fields.")
             else:
                 self.logger.debug("Quit button pressed. Exiting")
                 self.window.destroy()
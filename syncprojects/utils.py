@@ -170,19 +170,6 @@ def update(new_version: Dict):
         subprocess.Popen(args)
 
 
-def hash_file(file_path, hash_inst=None, block_size=4096) -> str:
-    if not hash_inst:
-        hash_inst = config.DEFAULT_HASH_ALGO()
-    with open(file_path, 'rb') as fp:
-        while True:
-            data = fp.read(block_size)
-            if data:
-                hash_inst.update(data)
-            else:
-                break
-    return hash_inst.hexdigest()
-
-
 def validate_changelog(changelog_file):
     r = re.compile(r'^-- [a-zA-Z0-9_-]+: ([0-9]{2}:){2}[0-9]{2} ([0-9]{2}-){2}[0-9]{4} --$')
     with open(changelog_file) as f:
@@ -365,11 +352,18 @@ def commit_settings(settings):
         appdata['audio_sync_dir'] = settings.audio_sync_source_dir
     appdata['workers'] = settings.workers
     appdata['nested_folders'] = settings.nested
+    appdata['compression'] = settings.compression
+    appdata['low_priority_io'] = settings.low_priority_io
+    appdata['io_throttle_rate'] = settings.io_throttle_rate
+    appdata['profiling'] = settings.profiling
+    appdata['open_early'] = settings.open_early
+    appdata['prefetch'] = settings.prefetch
+    appdata['song_locking'] = settings.song_locking
 
 
 def create_project_dirs(api_client, base_dir):
     logger.debug("Creating dirs in %s", base_dir)
-    projects = api_client.get_all_projects()
+    projects = api_client.get_all_projects(with_songs=False)
     for project in projects:
         try:
             os.makedirs(join(base_dir, project['name']), exist_ok=True)
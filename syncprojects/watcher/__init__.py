@@ -10,10 +10,13 @@ from watchdog.events import FileSystemEventHandler, FileSystemEvent, FileSystemM
 from watchdog.observers import Observer
 
 from syncprojects.api import SyncAPI
+from syncprojects.config import FINGERPRINT_ALGO
+from syncprojects.hashing import fingerprint_file
+from syncprojects.profiling import profiled
 from syncprojects.storage import get_audiodata
 from syncprojects.sync.backends.aws.auth import AWSAuth
 from syncprojects.ui.tray import notify
-from syncprojects.utils import create_project_dirs, hash_file, report_error
+from syncprojects.utils import create_project_dirs, report_error
 
 logger = logging.getLogger('syncprojects.watcher')
 WAIT_SECONDS = 10
@@ -54,11 +57,14 @@ class AudioSyncHandler(FileSystemEventHandler):
     def file_changed(self, path: str) -> bool:
         known = self.get_known_hash(path)
         if not known:
-            logger.debug("New file; %s not seen before")
-        return hash_file(path) != known
+            logger.debug("New file; %s not seen before", path)
+            return True
+        # Stored as "algo:digest"; bare digests were stored before the algorithm was recorded and are md5
+        algo, _, digest = known.rpartition(':')
+        return fingerprint_file(path, algo or "md5") != digest
 
     def update_known_hash(self, path: str):
-        self.store[path] = hash_file(path)
+        self.store[path] = f"{FINGERPRINT_ALGO}:{fingerprint_file(path, FINGERPRINT_ALGO)}"
 
     def should_push(self, path: str) -> bool:
         result = False
@@ -79,8 +85,8 @@ class AudioSyncHandler(FileSystemEventHandler):
             else:
                 logger.debug("File size of %s is 0", path)
         except FileNotFoundError:
-            logger.debug(f"{path=} doesn't exist")
-        logger.debug(f"should_push {path=} {result=}")
+            logger.debug("path=%r doesn't exist", path)
+        logger.debug("should_push path=%r result=%s", path, result)
         return result
 
     def on_any_event(self, event: FileSystemEvent):
@@ -89,6 +95,7 @@ class AudioSyncHandler(FileSystemEventHandler):
         if not event.is_directory:
             logger.debug("File %s %s.", event.src_path, event.event_type)
 
+    @profiled('watcher.on_moved')
     def on_moved(self, event: FileSystemMovedEvent):
         if not event.is_directory and self.should_push(event.dest_path):
             wait_for_write(event.dest_path)
@@ -108,10 +115,12 @@ class AudioSyncHandler(FileSystemEventHandler):
         self.update_known_hash(path)
         self.notify(path)
 
+    @profiled('watcher.on_created')
     def on_created(self, event: FileSystemEvent):
         if not event.is_directory and self.should_push(event.src_path):
             self._handle_push(event.src_path)
 
+    @profiled('watcher.on_modified')
     def on_modified(self, event: FileSystemEvent):
         if not event.is_directory and self.should_push(event.src_path):
             self._handle_push(event.src_path)
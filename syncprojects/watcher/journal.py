@@ -0,0 +1,171 @@
+import logging
+import os
+from fnmatch import fnmatch
+from glob import glob
+from os.path import join, relpath, basename, isabs
+from threading import Thread, Lock
+from typing import Union, Tuple
+
+from watchdog.events import FileSystemEventHandler, FileSystemEvent, FileSystemMovedEvent
+from watchdog.observers import Observer
+
+from syncprojects import config
+from syncprojects.storage import appdata, get_journaldata
+from syncprojects.utils import report_error
+
+logger = logging.getLogger('syncprojects.watcher.journal')
+
+
+def get_signature(song_path: str) -> Tuple:
+    """
+    Cheap stand-in for hashing: name, size and mtime of each project file, as hash_project_root_directory would see
+    them.
+    """
+    signature = []
+    for file_name in sorted(glob(join(song_path, config.PROJECT_GLOB))):
+        stat = os.stat(file_name)
+        signature.append((basename(file_name), stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+class SourceJournal(FileSystemEventHandler):
+    """
+    Tracks which song directories have had project files change since they were last hashed, so that clean songs
+    can reuse their cached fingerprint. Entries are persisted as song_dir -> (algo, hash, signature); a song is dirty
+    when it has no entry. Only trusted while the observer is running.
+    """
+
+    def __init__(self):
+        self.source_dir = None
+        self.store = get_journaldata()
+        self.active = False
+        # Bumped for every change, so a hash computed while the song was being modified isn't recorded as clean
+        self.generations = {}
+        self._lock = Lock()
+
+    def get_song_dir(self, path: str, is_directory: bool = False) -> Union[str, None]:
+        """
+        :return: The song directory a path affects the fingerprint of, or None if it doesn't affect one
+        """
+        parts = relpath(path, self.source_dir).split(os.sep)
+        depth = 2 if appdata.get('nested_folders') else 1
+        if parts[0] in (os.curdir, os.pardir) or len(parts) < depth:
+            return None
+        if len(parts) == depth:
+            # The song directory itself was created, moved or deleted
+            return join(*parts) if is_directory else None
+        if len(parts) == depth + 1 and not is_directory and fnmatch(parts[-1], config.PROJECT_GLOB):
+            return join(*parts[:depth])
+        return None
+
+    def mark_dirty(self, song_dir: str):
+        with self._lock:
+            self.generations[song_dir] = self.generations.get(song_dir, 0) + 1
+            if song_dir in self.store:
+                logger.debug("Song %s is now dirty", song_dir)
+                del self.store[song_dir]
+
+    def on_any_event(self, event: FileSystemEvent):
+        paths = [event.src_path]
+        if isinstance(event, FileSystemMovedEvent):
+            paths.append(event.dest_path)
+        for path in paths:
+            if song_dir := self.get_song_dir(path, event.is_directory):
+                self.mark_dirty(song_dir)
+
+    def generation(self, song_dir: str) -> int:
+        with self._lock:
+            return self.generations.get(song_dir, 0)
+
+    def get(self, song_dir: str, algo: str) -> Union[str, None]:
+        """
+        :return: The cached fingerprint of a clean song, else None
+        """
+        if not self.active:
+            return None
+        entry = self.store.get(song_dir)
+        if entry and entry[0] == algo:
+            return entry[1]
+        return None
+
+    def record(self, song_dir: str, generation: int, algo: str, digest: str):
+        """
+        Cache a song's fingerprint, unless it changed since generation was taken.
+        """
+        if not self.active or not digest:
+            return
+        try:
+            signature = get_signature(join(self.source_dir, song_dir))
+        except OSError:
+            return
+        with self._lock:
+            if self.generations.get(song_dir, 0) == generation:
+                self.store[song_dir] = (algo, digest, signature)
+
+    def reconcile(self):
+        """
+        Changes made while nothing was watching weren't journaled; drop every entry whose project files don't look
+        the way they did when it was hashed.
+        """
+        dropped = 0
+        for song_dir, entry in list(self.store.items()):
+            try:
+                unchanged = get_signature(join(self.source_dir, song_dir)) == entry[2]
+            except (OSError, IndexError):
+                unchanged = False
+            if not unchanged:
+                del self.store[song_dir]
+                dropped += 1
+        logger.debug("Journal reconciled; %d of %d songs dirty since last run", dropped, dropped + len(self.store))
+
+    def invalidate(self):
+        logger.info("Invalidating change journal; all songs will be rehashed")
+        with self._lock:
+            for song_dir in list(self.store.keys()):
+                self.generations[song_dir] = self.generations.get(song_dir, 0) + 1
+            self.store.clear()
+
+
+class SourceJournalWatcher(Thread):
+    def __init__(self, source_dir: str, journal: SourceJournal = None):
+        super().__init__(daemon=True)
+        self.observer = Observer()
+        self.source_dir = source_dir
+        self.journal = journal or SourceJournal()
+        self.start_watch()
+
+    def start_watch(self):
+        if not isabs(self.source_dir):
+            self.source_dir = os.path.abspath(self.source_dir)
+        self.journal.source_dir = self.source_dir
+        self.observer.schedule(self.journal, self.source_dir, recursive=True)
+
+    def stop_watch(self):
+        self.journal.active = False
+        self.observer.unschedule_all()
+
+    def change_watch(self, new_watch_dir: str):
+        logger.debug("Restarting journal with new path %s...", new_watch_dir)
+        self.stop_watch()
+        self.journal.invalidate()
+        self.source_dir = new_watch_dir
+        self.start_watch()
+        self.journal.active = self.observer.is_alive()
+
+    def run(self):
+        logger.info("Starting change journal in %s", self.source_dir)
+        self.observer.start()
+        # Events from here on are journaled, so anything that happened before can be checked once
+        self.journal.reconcile()
+        self.journal.active = True
+        try:
+            while self.observer.is_alive():
+                self.observer.join(1)
+        except Exception as e:
+            logger.error("Journal observer died with error: %s", e)
+            report_error(e)
+        finally:
+            self.journal.active = False
+            self.observer.stop()
+            self.observer.join()
+            logger.warning("Journal observer shut down; songs will be hashed on every sync")
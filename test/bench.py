@@ -3,6 +3,7 @@ from typing import Dict, List
 import time
 
 from syncprojects.sync.backends.aws.s3 import walk_dir
+from syncprojects.sync.ignore import get_ignore_rules
 from syncprojects.system import is_windows, is_linux
 # noinspection PyUnresolvedReferences
 from syncprojects_fast import get_difference as fast_get_difference
@@ -16,6 +17,8 @@ if is_windows():
 elif is_linux():
     TARGET_DIR = "/home/keane/Documents/Divided"
 
+RULES = get_ignore_rules(TARGET_DIR)
+
 
 def do_bench(func, *args, **kwargs):
     start = time.perf_counter()
@@ -28,20 +31,20 @@ def get_difference(src: Dict, dst: Dict) -> List:
     results = []
     for key, val in src.items():
         if key not in dst or val != dst[key]:
-            if not key.endswith('.peak'):
-                results.append(key.replace('\\', '/'))
+            results.append(key)
     return results
 
 
 print("Python bench of walk_dir")
-py_time = do_bench(walk_dir, TARGET_DIR)
+py_time = do_bench(walk_dir, TARGET_DIR, rules=RULES)
 print("Did Python in", py_time)
-py_result = walk_dir(TARGET_DIR)
+# Compact manifest; the Rust functions take plain dicts
+py_result = dict(walk_dir(TARGET_DIR, rules=RULES).items())
 
 print("Rust bench of walk_dir")
-rust_time = do_bench(fast_walk_dir, TARGET_DIR)
+rust_time = do_bench(fast_walk_dir, TARGET_DIR, RULES.patterns)
 print("Did Rust in", rust_time)
-rust_result = fast_walk_dir(TARGET_DIR)
+rust_result = fast_walk_dir(TARGET_DIR, RULES.patterns)
 print("{:.2f}% improvement".format(100 - 100 * rust_time / py_time))
 
 assert (py_result == rust_result)
@@ -0,0 +1,58 @@
+import os
+import tempfile
+from os.path import join
+
+import time
+
+from syncprojects import config
+from syncprojects.hashing import hash_file
+
+COUNT = 5
+# (size in bytes, number of files)
+FILE_SETS = (
+    (64 * 1024, 500),
+    (4 * 1024 * 1024, 25),
+    (256 * 1024 * 1024, 2),
+)
+
+
+def legacy_hash_file(file_path, hash_inst=None, block_size=4096) -> str:
+    # The implementation hash_file replaced, for comparison
+    if not hash_inst:
+        hash_inst = config.DEFAULT_HASH_ALGO()
+    with open(file_path, 'rb') as fp:
+        while True:
+            data = fp.read(block_size)
+            if data:
+                hash_inst.update(data)
+            else:
+                break
+    return hash_inst.hexdigest()
+
+
+def do_bench(func, paths):
+    start = time.perf_counter()
+    for _ in range(COUNT):
+        for path in paths:
+            func(path)
+    return (time.perf_counter() - start) / COUNT
+
+
+with tempfile.TemporaryDirectory() as target_dir:
+    for size, count in FILE_SETS:
+        paths = []
+        for n in range(count):
+            path = join(target_dir, f"{size}-{n}.bin")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size))
+            paths.append(path)
+        print(f"{count} files of {size} bytes")
+        # Warm the page cache so both runs measure hashing rather than the disk
+        do_bench(legacy_hash_file, paths)
+        legacy_time = do_bench(legacy_hash_file, paths)
+        print("Legacy hash_file in", legacy_time)
+        new_time = do_bench(hash_file, paths)
+        print("hash_file in", new_time)
+        print("{:.2f}% improvement".format(100 - 100 * new_time / legacy_time))
+        for path in paths:
+            assert (legacy_hash_file(path) == hash_file(path))
@@ -0,0 +1,107 @@
+import os
+import tempfile
+from hashlib import md5
+
+import pytest
+
+# Importing syncprojects creates its data directory under the home directory and starts the tray backend; keep the
+# tests away from the real ones. This has to happen before any syncprojects import.
+os.environ['HOME'] = tempfile.mkdtemp(prefix="syncprojects-test-")
+os.environ.setdefault('PYSTRAY_BACKEND', 'dummy')
+
+
+class FakeBody:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self) -> bytes:
+        return self.data
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        for offset in range(0, len(self.data), chunk_size):
+            yield self.data[offset:offset + chunk_size]
+
+
+class FakeS3Client:
+    """
+    Just enough of a boto3 S3 client for the backend: objects are kept in memory as {key: (data, metadata)}.
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None):
+        self.objects[Key] = (bytes(Body), Metadata or {})
+
+    def upload_fileobj(self, fp, bucket, key, ExtraArgs=None):
+        self.put_object(bucket, key, fp.read(), (ExtraArgs or {}).get('Metadata'))
+
+    def upload_file(self, path, bucket, key):
+        with open(path, 'rb') as fp:
+            self.put_object(bucket, key, fp.read())
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        from datetime import datetime, timezone
+        contents = [{'Key': key, 'ETag': f'"{md5(data).hexdigest()}"', 'Size': len(data),
+                     'LastModified': datetime.fromtimestamp(0, timezone.utc)}
+                    for key, (data, _) in sorted(self.objects.items()) if key.startswith(Prefix)]
+        results = {'IsTruncated': False}
+        if contents:
+            results['Contents'] = contents
+        return results
+
+    def download_file(self, bucket, key, target):
+        with open(target, 'wb') as fp:
+            fp.write(self.objects[key][0])
+
+    def get_object(self, Bucket, Key, Range=None):
+        from botocore.exceptions import ClientError
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        data, metadata = self.objects[Key]
+        if Range:
+            start, end = Range[len("bytes="):].split('-')
+            if not start:
+                data = data[-int(end):]
+            else:
+                data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': FakeBody(data), 'ContentLength': len(data), 'Metadata': metadata}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.objects.pop(obj['Key'], None)
+        return {}
+
+
+class FakeAuth:
+    def __init__(self, client):
+        self.client = client
+
+    def authenticate(self):
+        return self.client
+
+
+@pytest.fixture
+def s3_client():
+    return FakeS3Client()
+
+
+@pytest.fixture
+def s3_backend(s3_client, tmp_path, monkeypatch):
+    from syncprojects.storage import appdata
+    from syncprojects.sync.backends.aws import s3
+    from syncprojects.sync.backends.aws.s3 import S3SyncBackend
+    monkeypatch.setitem(appdata, 'source', str(tmp_path))
+    # No desktop notifications, dialogs or log uploads
+    monkeypatch.setattr(s3, 'notify', lambda msg: None)
+    monkeypatch.setattr(s3, 'report_error', lambda e: None)
+    monkeypatch.setattr(s3, 'request_local_api', lambda *args, **kwargs: None)
+    monkeypatch.setattr(s3.MessageBoxUI, 'error', staticmethod(lambda *args, **kwargs: None))
+    return S3SyncBackend(None, FakeAuth(s3_client), "bucket")
+
+
+@pytest.fixture
+def sync_manager(s3_client, s3_backend):
+    from syncprojects.sync import SyncManager
+    from syncprojects.sync.backends.aws.s3 import S3SyncBackend
+    return SyncManager(None, S3SyncBackend, args=[FakeAuth(s3_client), "bucket"])
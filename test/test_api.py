@@ -0,0 +1,255 @@
+import threading
+from queue import Queue
+
+import pytest
+import requests
+
+from syncprojects import api, config
+from syncprojects.api import SyncAPI
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api.webbrowser, 'open', lambda url: None)
+    client = SyncAPI("refresh", "access", "user", Queue(), Queue())
+    # Logging in looks up the username
+    monkeypatch.setattr(client, '_request', lambda path, *args, **kwargs: {'username': "user"})
+    return client
+
+
+def test_web_login_times_out(client, monkeypatch):
+    monkeypatch.setattr(config, 'LOGIN_TIMEOUT', 0.1)
+    client.queue_thread = -1
+    assert client.web_login() is False
+
+
+def test_web_login_from_service(client):
+    client.queue_thread = -1
+    threading.Timer(0.1, client.handle_auth_msg, ({'refresh': "new refresh", 'access': "new access"},)).start()
+    assert client.web_login() is True
+    assert client.access_token == "new access"
+
+
+def test_web_login_reads_queue(client):
+    client.recv_queue.put({'msg_type': 'sync', 'data': {}})
+    client.recv_queue.put({'msg_type': 'auth', 'data': {'refresh': "new refresh", 'access': "new access"}})
+    assert client.web_login() is True
+    assert client.refresh_token == "new refresh"
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+
+def test_failed_login_fails_request(monkeypatch):
+    client = SyncAPI("refresh", "access", "user", Queue(), Queue())
+    monkeypatch.setattr(client, '_send', lambda *args, **kwargs: FakeResponse(401))
+    monkeypatch.setattr(api, 'login_prompt', lambda sync_api: False)
+    with pytest.raises(api.HTTPError):
+        client.get_project(1)
+
+
+class FakeSession:
+    """
+    Answers requests with responder(method, path, kwargs), which returns a FakeResponse or raises.
+    """
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.calls = []
+
+    def request(self, method, url, timeout=None, data=None, **kwargs):
+        path = url[len(api.API_BASE_URL):]
+        self.calls.append((method, path, kwargs))
+        return self.responder(method, path, kwargs)
+
+
+def responses(*sequence):
+    sequence = list(sequence)
+
+    def responder(method, path, kwargs):
+        response = sequence.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    return responder
+
+
+@pytest.fixture
+def api_client(monkeypatch):
+    monkeypatch.setattr(api.time, 'sleep', lambda seconds: None)
+    return SyncAPI("refresh", "access", "user", Queue(), Queue())
+
+
+def test_idempotent_request_retried(api_client):
+    api_client.session = FakeSession(responses(FakeResponse(503), requests.exceptions.ConnectionError(),
+                                               FakeResponse(200, {'id': 1})))
+    assert api_client.get_project(1) == {'id': 1}
+    assert len(api_client.session.calls) == 3
+
+
+def test_post_not_retried(api_client):
+    api_client.session = FakeSession(responses(FakeResponse(503), FakeResponse(200, {})))
+    assert api_client._send("locks/", 'POST').status_code == 503
+    assert len(api_client.session.calls) == 1
+
+
+def test_retries_exhausted(api_client):
+    api_client.session = FakeSession(responses(*[requests.exceptions.Timeout()] * (config.API_RETRIES + 1)))
+    with pytest.raises(requests.exceptions.Timeout):
+        api_client._send("projects/", 'GET')
+    api_client.session = FakeSession(responses(*[FakeResponse(429)] * (config.API_RETRIES + 1)))
+    assert api_client._send("projects/", 'GET').status_code == 429
+
+
+def test_backoff():
+    for attempt in range(10):
+        assert 0 <= api.get_backoff(attempt) <= config.API_BACKOFF_MAX
+    assert api.get_backoff(0, "3") >= 3
+    assert api.get_backoff(0, str(config.API_BACKOFF_MAX * 10)) == config.API_BACKOFF_MAX
+    assert api.get_backoff(0, "Wed, 21 Oct 2015 07:28:00 GMT") <= config.API_BACKOFF_BASE
+
+
+def test_timeout():
+    assert api.get_timeout("logs/") == (config.API_CONNECT_TIMEOUT, api.ENDPOINT_READ_TIMEOUTS['logs/'])
+    assert api.get_timeout("projects/") == (config.API_CONNECT_TIMEOUT, config.API_READ_TIMEOUT)
+
+
+def test_cached_response(api_client):
+    api_client.session = FakeSession(responses(FakeResponse(200, {'id': 1, 'songs': []}, {'ETag': '"v1"'})))
+    project = api_client.get_project(1)
+    project['songs'].append({'id': 2})
+    # Served from the cache, unaffected by the caller's changes
+    assert api_client.get_project(1) == {'id': 1, 'songs': []}
+    assert len(api_client.session.calls) == 1
+
+
+def test_cache_revalidated(api_client, monkeypatch):
+    monkeypatch.setattr(api_client.cache, 'ttl', 0)
+    api_client.session = FakeSession(responses(FakeResponse(200, {'id': 1}, {'ETag': '"v1"'}), FakeResponse(304),
+                                               FakeResponse(200, {'id': 1, 'name': "new"}, {'ETag': '"v2"'})))
+    assert api_client.get_project(1) == {'id': 1}
+    assert api_client.get_project(1) == {'id': 1}
+    assert api_client.get_project(1) == {'id': 1, 'name': "new"}
+    headers = [kwargs['headers'] for _, _, kwargs in api_client.session.calls]
+    assert 'If-None-Match' not in headers[0]
+    assert headers[1]['If-None-Match'] == '"v1"'
+
+
+def test_uncached_and_invalidated(api_client):
+    api_client.session = FakeSession(lambda method, path, kwargs: FakeResponse(200, {'path': path}))
+    api_client.get_project(1)
+    api_client.get_project(1, cache=False)
+    api_client.get_song(2)
+    api_client.get_song(3)
+    assert len(api_client.session.calls) == 4
+    api_client.invalidate_project(1, [2])
+    api_client.get_project(1)
+    api_client.get_song(2)
+    api_client.get_song(3)
+    assert [path for _, path, _ in api_client.session.calls[4:]] == ["projects/1/", "songs/2/"]
+
+
+def paginated(count: int, page_size: int, style: str):
+    items = [{'id': n} for n in range(count)]
+
+    def responder(method, path, kwargs):
+        params = kwargs.get('params') or {}
+        if style == 'page':
+            start = (int(params.get('page', 1)) - 1) * page_size
+            next_params = f"page={start // page_size + 2}"
+        elif style == 'offset':
+            start = int(params.get('offset', 0))
+            next_params = f"limit={page_size}&offset={start + page_size}"
+        else:
+            start = int(params.get('cursor', 0))
+            next_params = f"cursor={start + page_size}"
+        body = {'count': count, 'results': items[start:start + page_size],
+                'next': f"{api.API_BASE_URL}{path}?{next_params}" if start + page_size < count else None}
+        return FakeResponse(200, body)
+
+    return responder
+
+
+@pytest.mark.parametrize('style', ['page', 'offset', 'cursor'])
+def test_all_pages(api_client, style):
+    api_client.session = FakeSession(paginated(25, 10, style))
+    assert api_client._get_all_pages("projects/") == [{'id': n} for n in range(25)]
+    assert len(api_client.session.calls) == 3
+
+
+def test_single_page(api_client):
+    api_client.session = FakeSession(paginated(5, 10, 'page'))
+    assert api_client._get_all_pages("projects/") == [{'id': n} for n in range(5)]
+    assert len(api_client.session.calls) == 1
+
+
+SONGS = [{'id': 2, 'project': 1, 'name': "A"}, {'id': 3, 'project': 1, 'name': "B"}]
+
+
+def test_lock_many_batched(api_client):
+    api_client.session = FakeSession(lambda method, path, kwargs: FakeResponse(
+        200, {'results': [{'song': item['song']} for item in kwargs['json']['items']]}))
+    assert api_client.lock_many(SONGS) == [{'song': 2}, {'song': 3}]
+    [(method, path, kwargs)] = api_client.session.calls
+    assert (method, path) == ('POST', "locks/")
+    assert kwargs['json'] == {'lock': True, 'reason': "sync",
+                              'items': [{'project': 1, 'song': 2}, {'project': 1, 'song': 3}]}
+    assert api_client.batch_locks is True
+
+
+def test_lock_many_fallback(api_client):
+    def responder(method, path, kwargs):
+        if path == "locks/":
+            return FakeResponse(404, {'detail': "Not found."})
+        return FakeResponse(200, {'song': kwargs['json']['song'], 'method': method})
+
+    api_client.session = FakeSession(responder)
+    assert api_client.unlock_many(SONGS) == [{'song': 2, 'method': 'DELETE'}, {'song': 3, 'method': 'DELETE'}]
+    assert api_client.batch_locks is False
+    # Not retried before falling back
+    assert [path for _, path, _ in api_client.session.calls].count("locks/") == 1
+    # Not tried again once the server is known not to have it
+    calls = len(api_client.session.calls)
+    api_client.lock_many(SONGS[:1])
+    assert [path for _, path, _ in api_client.session.calls[calls:]] == ["projects/1/lock/"]
+
+
+def test_lock_many_error_keeps_batching(api_client):
+    def responder(method, path, kwargs):
+        if path == "locks/":
+            return FakeResponse(400, {'detail': "Bad request."})
+        return FakeResponse(200, {'song': kwargs['json']['song']})
+
+    api_client.session = FakeSession(responder)
+    api_client.batch_locks = True
+    assert api_client.lock_many(SONGS) == [{'song': 2}, {'song': 3}]
+    assert api_client.batch_locks is True
+
+
+def test_lock_many_invalidates_cache(api_client):
+    api_client.cache.store(api_client.cache.key("songs/2/"), None, {'id': 2, 'is_locked': False})
+    api_client.session = FakeSession(lambda method, path, kwargs: FakeResponse(200, {'results': [{}, {}]}))
+    api_client.lock_many(SONGS)
+    assert api_client.cache.get(api_client.cache.key("songs/2/")) is None
+
+
+def test_unreachable_api_raises(api_client):
+    api_client.session = FakeSession(responses(*[requests.exceptions.ConnectionError()] * (config.API_RETRIES + 1)))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        api_client.get_project(1)
+
+
+def test_failing_api_raises(api_client):
+    api_client.session = FakeSession(lambda method, path, kwargs: FakeResponse(503))
+    with pytest.raises(api.HTTPError):
+        api_client.get_project(1)
+    assert api_client._request("projects/1/", no_fail=True) == {}
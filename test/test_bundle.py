@@ -0,0 +1,113 @@
+import io
+import os
+
+import pytest
+
+from syncprojects.storage import appdata
+from syncprojects.sync.backends.aws.s3 import MANIFEST_KEY, PRUNED_KEY, get_bundle_key, walk_dir
+from syncprojects.sync.bundle import TRAILER_SIZE, BundleError, parse_index, parse_trailer, write_bundle
+from syncprojects.utils import get_song_dir
+
+FILES = {
+    "Song.cpr": b"project " * 2000,
+    "Audio/take.wav": os.urandom(20000),
+    "Audio/empty.wav": b"",
+}
+
+
+def make_song_dir(root) -> str:
+    for key, data in FILES.items():
+        path = os.path.join(root, *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return str(root)
+
+
+def read_member(bundle: bytes, entry: dict) -> bytes:
+    from syncprojects.sync.compression import IDENTITY, decompress_stream
+    data = bundle[entry['offset']:entry['offset'] + entry['length']]
+    if entry['encoding'] == IDENTITY:
+        return data
+    out = io.BytesIO()
+    decompress_stream([data], out, entry['encoding'])
+    return out.getvalue()
+
+
+def test_round_trip(tmp_path):
+    root = make_song_dir(tmp_path)
+    manifest = walk_dir(root)
+    fp = io.BytesIO()
+    index = write_bundle(fp, root, manifest, 7)
+    bundle = fp.getvalue()
+    offset, length = parse_trailer(bundle[-TRAILER_SIZE:])
+    assert parse_index(bundle[offset:offset + length]) == index
+    assert index['revision'] == 7
+    for key, data in FILES.items():
+        entry = index['files'][key]
+        assert entry['size'] == len(data)
+        assert entry['hash'] == manifest[key]
+        assert read_member(bundle, entry) == data
+    # The project file compresses well
+    assert index['files']["Song.cpr"]['length'] < len(FILES["Song.cpr"])
+
+
+def test_bad_trailer():
+    with pytest.raises(BundleError):
+        parse_trailer(b"short")
+    with pytest.raises(BundleError):
+        parse_trailer(b"\x00" * TRAILER_SIZE)
+
+
+@pytest.fixture
+def archived(s3_backend, s3_client, tmp_path, monkeypatch):
+    from syncprojects.sync.backends.aws.s3 import FORMAT_KEY
+    monkeypatch.setitem(appdata, 'compression', True)
+    s3_client.put_object("bucket", FORMAT_KEY, b'{"version": 2}')
+    project = {'id': 1, 'name': "Project"}
+    song = {'id': 2, 'project': 1, 'name': "Song", 'project_name': "Project", 'archived': True, 'revision': 3}
+    make_song_dir(tmp_path / get_song_dir(song))
+    for key in FILES:
+        s3_backend.handle_upload(song, key, "1/2/")
+    s3_backend.put_remote_encodings("1/2/")
+    monkeypatch.setattr(s3_backend, 'get_local_changes', lambda songs: None)
+    monkeypatch.setattr(s3_backend, 'get_verdict', lambda song_data, song: None)
+    return project, song
+
+
+def test_archive_and_prune(archived, s3_backend, s3_client):
+    project, song = archived
+    result = s3_backend.archive_song(project, song, prune=True)
+    assert result['result'] == 'success'
+    assert result['pruned'] == len(FILES) + 1
+    assert get_bundle_key(project, song) in s3_client.objects
+    assert {key for key in s3_client.objects if key.startswith("1/2/")} == {"1/2/" + PRUNED_KEY}
+
+
+def test_archived_song_read_from_bundle(archived, s3_backend):
+    project, song = archived
+    s3_backend.archive_song(project, song, prune=True)
+    remote_manifest, local_manifest, bundle = s3_backend.get_manifests(project, song, "1/2/")
+    assert bundle
+    assert dict(remote_manifest) == dict(local_manifest)
+
+
+def test_unarchived_song_restored(archived, s3_backend, s3_client):
+    project, song = archived
+    before = dict(s3_backend.get_remote_manifest("1/2/"))
+    s3_backend.archive_song(project, song, prune=True)
+    song['archived'] = False
+    remote_manifest, local_manifest, bundle = s3_backend.get_manifests(project, song, "1/2/")
+    assert not bundle
+    assert dict(remote_manifest) == before == dict(local_manifest)
+    assert "1/2/" + PRUNED_KEY not in s3_client.objects
+    assert "1/2/" + MANIFEST_KEY in s3_client.objects
+
+
+def test_restore_without_bundle(archived, s3_backend, s3_client):
+    project, song = archived
+    s3_backend.archive_song(project, song, prune=True)
+    del s3_client.objects[get_bundle_key(project, song)]
+    song['archived'] = False
+    with pytest.raises(BundleError):
+        s3_backend.get_manifests(project, song, "1/2/")
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from syncprojects.sync.claims import ClaimBusy, Claims
+
+
+def hold(claims, *args):
+    """
+    Claim in another thread until the returned event is set.
+    """
+    claimed = threading.Event()
+    release = threading.Event()
+
+    def run():
+        with claims.claim(*args):
+            claimed.set()
+            release.wait()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    claimed.wait()
+    return release, thread
+
+
+def test_songs_of_a_project_claimed_separately():
+    claims = Claims()
+    release, thread = hold(claims, 1, [1, 2])
+    with claims.claim(1, [3], blocking=False):
+        pass
+    with claims.claim(2, blocking=False):
+        pass
+    release.set()
+    thread.join()
+
+
+@pytest.mark.parametrize('held, wanted', [
+    ((1, [1, 2]), (1, [2, 3])),
+    ((1, [1]), (1, None)),
+    ((1, None), (1, [1])),
+    ((1, None), (1, None)),
+])
+def test_conflicting_claims(held, wanted):
+    claims = Claims()
+    release, thread = hold(claims, *held)
+    with pytest.raises(ClaimBusy):
+        with claims.claim(*wanted, blocking=False):
+            pass
+    release.set()
+    thread.join()
+    with claims.claim(*wanted, blocking=False):
+        pass
+
+
+def test_claim_waits_for_release():
+    claims = Claims()
+    release, thread = hold(claims, 1, None)
+    acquired = threading.Event()
+
+    def wait():
+        with claims.claim(1, [1]):
+            acquired.set()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    assert not acquired.wait(0.2)
+    release.set()
+    assert acquired.wait(5)
+    thread.join()
+    waiter.join()
+
+
+def test_released_on_error():
+    claims = Claims()
+    with pytest.raises(ValueError):
+        with claims.claim(1, [1]):
+            raise ValueError()
+    with claims.claim(1, blocking=False):
+        pass
+
+
+def test_waited_on():
+    claims = Claims()
+    release, holder = hold(claims, 1, [2])
+    assert not claims.waited_on(1, [2])
+    waiter = threading.Thread(target=lambda: claims.claim(1, [2, 3]).__enter__())
+    waiter.start()
+    while not claims.waited_on(1, [2]):
+        threading.Event().wait(0.01)
+    assert claims.waited_on(1, [3])
+    assert claims.waited_on(1)
+    assert not claims.waited_on(1, [4])
+    assert not claims.waited_on(2)
+    release.set()
+    holder.join()
+    waiter.join()
+    assert not claims.waited_on(1)
@@ -0,0 +1,255 @@
+import threading
+from copy import deepcopy
+from queue import Queue
+
+import pytest
+from requests import HTTPError
+
+from syncprojects import commands
+from syncprojects.commands import SyncMultipleHandler
+from syncprojects.storage import appdata
+from syncprojects.sync import SyncManager
+from syncprojects.sync.backends import Verdict
+from syncprojects.sync.claims import Claims
+
+
+def make_project(project_id: int, song_ids=(1,)) -> dict:
+    return {'id': project_id, 'name': f"Project {project_id}", 'sync_enabled': True,
+            'songs': [{'id': project_id * 100 + song_id, 'project': project_id, 'name': f"Song {song_id}",
+                       'revision': 1, 'sync_enabled': True, 'is_locked': False, 'archived': False}
+                      for song_id in song_ids]}
+
+
+class FakeAPI:
+    def __init__(self, projects):
+        self.projects = {project['id']: project for project in projects}
+        self.send_queue = Queue()
+        self.locked = set()
+        self.max_locked = 0
+        self.fail_lock = set()
+        self.fetches = []
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def get_project(self, project_id: int, cache: bool = True):
+        self.fetches.append((project_id, cache))
+        return deepcopy(self.projects[project_id])
+
+    def get_projects(self, project_ids, cache: bool = True):
+        return [self.get_project(project_id, cache) for project_id in project_ids]
+
+    @staticmethod
+    def key(obj):
+        return ('song', obj['id']) if 'project' in obj else ('project', obj['id'])
+
+    def lock(self, obj, reason: str = "sync", **kwargs):
+        if obj['id'] in self.fail_lock:
+            raise HTTPError("500")
+        with self._lock:
+            self.locked.add(self.key(obj))
+            self.max_locked = max(self.max_locked, len(self.locked))
+        return {'id': obj['id']}
+
+    def unlock(self, obj, **kwargs):
+        with self._lock:
+            self.locked.discard(self.key(obj))
+
+    def lock_many(self, objs, reason: str = "sync", **kwargs):
+        self.batches.append([self.key(obj) for obj in objs])
+        return [self.lock(obj) for obj in objs]
+
+    def unlock_many(self, objs, **kwargs):
+        self.batches.append([self.key(obj) for obj in objs])
+        for obj in objs:
+            self.unlock(obj)
+
+    def messages(self):
+        messages = []
+        while not self.send_queue.empty():
+            messages.append(self.send_queue.get())
+        return messages
+
+
+class FakeSyncManager:
+    def __init__(self, api):
+        self.api = api
+        self.tasks = set()
+        self.claims = Claims()
+        self.synced = []
+        self.projects = []
+        self.amps = []
+        self.fail = set()
+        self.hashed = []
+        self.verdicts = None
+
+    def claim(self, project_id, song_ids=None, blocking=True):
+        return self.claims.claim(project_id, song_ids, blocking)
+
+    def invalidate_journal(self):
+        pass
+
+    get_syncable_songs = staticmethod(SyncManager.get_syncable_songs)
+
+    def sync(self, project, force_verdict=None, on_ready=None, hashed=False):
+        self.hashed.append(hashed)
+        if project['id'] in self.fail:
+            raise RuntimeError("sync failed")
+        self.synced.append((project['id'], len(self.api.locked)))
+        self.projects.append(project)
+        return {'status': 'done', 'songs': [{'song': song['name'], 'id': song['id'], 'result': 'success',
+                                             'action': 'remote'} for song in project['songs']]}
+
+    def sync_amps(self, project):
+        self.amps.append(project['id'])
+
+    def pre_plan(self, project):
+        if self.verdicts is None:
+            raise NotImplementedError()
+        return self.verdicts
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setitem(appdata, 'song_locking', False)
+    monkeypatch.setitem(appdata, 'project_workers', 2)
+    monkeypatch.setattr(commands, 'notify', lambda msg: None)
+    api = FakeAPI([make_project(project_id) for project_id in range(1, 7)])
+    return SyncMultipleHandler("task", api, FakeSyncManager(api))
+
+
+def test_projects_locked_per_worker(handler):
+    handler.exec({'projects': list(range(1, 7))})
+    api = handler.api_client
+    assert sorted(project_id for project_id, _ in handler.sync_manager.synced) == list(range(1, 7))
+    # Never more projects locked than there are workers
+    assert api.max_locked <= 2
+    assert not api.locked
+    assert api.messages()[-1]['status'] == 'complete'
+    # Locked and unlocked a worker's worth at a time
+    assert [len(batch) for batch in api.batches] == [2] * 6
+    assert api.batches[0] == [('project', 1), ('project', 2)]
+
+
+def test_lock_error_skips_only_that_project(handler):
+    handler.api_client.fail_lock = {3}
+    handler.exec({'projects': list(range(1, 7))})
+    assert sorted(project_id for project_id, _ in handler.sync_manager.synced) == [1, 2, 4, 5, 6]
+    errors = [m for m in handler.api_client.messages() if m['status'] == 'error']
+    assert len(errors) == 1 and "Project 3" in errors[0]['msg']
+
+
+def test_failed_sync_unlocks(handler):
+    handler.sync_manager.fail = {2}
+    with pytest.raises(RuntimeError):
+        handler.exec({'projects': [1, 2]})
+    assert not handler.api_client.locked
+
+
+def test_sync_uses_data_fetched_after_lock(handler):
+    api = handler.api_client
+    stale = make_project(1)
+    api.projects[1]['songs'][0]['revision'] = 2
+    handler.exec({'projects': [stale]})
+    assert handler.sync_manager.projects[0]['songs'][0]['revision'] == 2
+    assert (1, False) in api.fetches
+
+
+def test_song_sync_refetches_after_lock(handler):
+    api = handler.api_client
+    api.projects[1]['songs'][0]['revision'] = 2
+    api.projects[1]['songs'][0]['is_locked'] = True
+    handler.lock_and_sync_songs([{'project': 1, 'song': 101}])
+    song = handler.sync_manager.projects[0]['songs'][0]
+    # Locked by us
+    assert (song['revision'], song['is_locked']) == (2, False)
+    assert (1, False) in api.fetches
+
+
+@pytest.fixture
+def song_locking(handler, monkeypatch):
+    monkeypatch.setitem(appdata, 'song_locking', True)
+    project = handler.api_client.projects[1] = make_project(1, (1, 2, 3, 4))
+    project['songs'][1]['sync_enabled'] = False
+    project['songs'][2]['is_locked'] = True
+    handler.sync_manager.verdicts = {101: Verdict.REMOTE, 104: None}
+    return handler
+
+
+def test_song_locking_syncs_changed_songs(song_locking):
+    handler = song_locking
+    handler.exec({'projects': [1]})
+    assert [song['id'] for song in handler.sync_manager.projects[0]['songs']] == [101]
+    # Hashed by the pre-plan already
+    assert handler.sync_manager.hashed == [True]
+    assert handler.sync_manager.amps == [1]
+    assert not handler.api_client.locked
+
+
+def test_song_locking_reports_skipped_songs(song_locking):
+    handler = song_locking
+    handler.exec({'projects': [1]})
+    completed = [m for m in handler.api_client.messages() if m['status'] == 'progress'][0]['completed']
+    assert {(song['song'], song['result'], song['action']) for song in completed['songs']} == {
+        ("Song 1", 'success', 'remote'), ("Song 2", 'success', 'disabled'), ("Song 3", 'error', 'locked')}
+
+
+def test_song_locking_nothing_to_sync(song_locking):
+    handler = song_locking
+    handler.sync_manager.verdicts = {}
+    handler.exec({'projects': [1]})
+    assert handler.sync_manager.projects == []
+    # Requested with the project all the same
+    assert handler.sync_manager.amps == [1]
+    completed = [m for m in handler.api_client.messages() if m['status'] == 'progress'][0]['completed']
+    assert len(completed['songs']) == 2
+
+
+def test_song_locking_amps_when_songs_locked_elsewhere(song_locking):
+    handler = song_locking
+    handler.api_client.lock_many = lambda objs, **kwargs: [
+        {'status': 'locked', 'locked_by': "other", 'since': "now"} for _ in objs]
+    handler.exec({'projects': [1]})
+    assert handler.sync_manager.projects == []
+    assert handler.sync_manager.amps == [1]
+
+
+def test_song_locking_amps_wait_for_project_claim(song_locking):
+    handler = song_locking
+    claimed = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with handler.sync_manager.claim(1, [104]):
+            claimed.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    claimed.wait()
+    runner = threading.Thread(target=handler.exec, args=({'projects': [1]},))
+    runner.start()
+    runner.join(0.5)
+    # Song 1 synced alongside the other command, but amp settings wait for the whole project
+    assert handler.sync_manager.projects and handler.sync_manager.amps == []
+    release.set()
+    runner.join()
+    holder.join()
+    assert handler.sync_manager.amps == [1]
+
+
+def test_log_report_within_cap(handler, tmp_path, monkeypatch):
+    import io
+    from zipfile import ZipFile
+    from syncprojects import config
+    log_file = tmp_path / "syncprojects.log"
+    log_file.write_bytes(b"old\n" * 100 + b"new\n" * 10)
+    (tmp_path / "syncprojects.log.1").write_bytes(b"rotated\n")
+    monkeypatch.setitem(appdata, 'telemetry_file', str(log_file))
+    monkeypatch.setattr(config, 'LOG_UPLOAD_MAX_BYTES', 40)
+    uploads = []
+    handler.api_client.report_logs = lambda body: uploads.append(b"".join(body()))
+    commands.LogReportHandler("task", handler.api_client, handler.sync_manager).handle({})
+    with ZipFile(io.BytesIO(uploads[0])) as z:
+        # Too big on its own, so only its end is sent and there's no space for the rest
+        assert z.namelist() == ["syncprojects.log"]
+        assert z.read("syncprojects.log") == b"new\n" * 10
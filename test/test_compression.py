@@ -0,0 +1,148 @@
+import io
+import os
+
+import pytest
+
+from syncprojects.sync.compression import IDENTITY, LZMA, ZLIB, CompressingReader, decompress_stream, \
+    get_compressor, get_decompressor, probe_encoding
+from syncprojects.sync.backends.aws.s3 import ENCODING_METADATA
+
+COMPRESSIBLE = b"syncprojects " * 10000
+
+
+def test_probe_skips_small_and_compressed(tmp_path):
+    small = tmp_path / "small.wav"
+    small.write_bytes(COMPRESSIBLE[:100])
+    mp3 = tmp_path / "take.mp3"
+    mp3.write_bytes(COMPRESSIBLE)
+    assert probe_encoding(str(small)) == IDENTITY
+    assert probe_encoding(str(mp3)) == IDENTITY
+
+
+def test_probe_picks_encoding(tmp_path):
+    wav = tmp_path / "take.wav"
+    wav.write_bytes(COMPRESSIBLE)
+    cpr = tmp_path / "song.cpr"
+    cpr.write_bytes(COMPRESSIBLE)
+    noise = tmp_path / "noise.wav"
+    noise.write_bytes(os.urandom(200000))
+    assert probe_encoding(str(wav)) == ZLIB
+    assert probe_encoding(str(cpr)) == LZMA
+    assert probe_encoding(str(noise)) == IDENTITY
+
+
+@pytest.mark.parametrize('encoding', [ZLIB, LZMA])
+def test_round_trip(encoding):
+    reader = CompressingReader(io.BytesIO(COMPRESSIBLE), encoding)
+    encoded = reader.read()
+    assert reader.original_bytes == len(COMPRESSIBLE)
+    assert reader.encoded_bytes == len(encoded) < len(COMPRESSIBLE)
+    out = io.BytesIO()
+    stats = decompress_stream((encoded[i:i + 1000] for i in range(0, len(encoded), 1000)), out, encoding)
+    assert out.getvalue() == COMPRESSIBLE
+    assert stats.original_bytes == len(COMPRESSIBLE)
+    assert stats.encoded_bytes == len(encoded)
+
+
+def test_reader_hashes_original():
+    from syncprojects import config
+    reader = CompressingReader(io.BytesIO(COMPRESSIBLE), ZLIB)
+    while reader.read(4096):
+        pass
+    assert reader.hexdigest() == config.DEFAULT_HASH_ALGO(COMPRESSIBLE).hexdigest()
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        get_compressor("brotli")
+    with pytest.raises(ValueError):
+        get_decompressor("brotli")
+
+
+def upload_compressed(s3_client, key: str) -> bytes:
+    encoded = CompressingReader(io.BytesIO(COMPRESSIBLE), ZLIB).read()
+    s3_client.put_object("bucket", key, encoded, {ENCODING_METADATA: ZLIB})
+    return encoded
+
+
+def test_download_decompresses(s3_backend, s3_client, tmp_path):
+    encoded = upload_compressed(s3_client, "1/2/take.wav")
+    s3_backend.remote_encodings["1/2/"] = {'take.wav': {'encoding': ZLIB, 'hash': "", 'size': len(encoded)}}
+    target = tmp_path / "take.wav"
+    s3_backend.download({'name': "song", 'project': 1}, "take.wav", "1/2/", str(target))
+    assert target.read_bytes() == COMPRESSIBLE
+
+
+def test_download_replaced_object_raw(s3_backend, s3_client, tmp_path):
+    # Overwritten by a client that doesn't know about compression, leaving a stale manifest entry
+    encoded = upload_compressed(s3_client, "1/2/take.wav")
+    s3_client.put_object("bucket", "1/2/take.wav", b"plain")
+    s3_backend.remote_encodings["1/2/"] = {'take.wav': {'encoding': ZLIB, 'hash': "", 'size': len(encoded)}}
+    target = tmp_path / "take.wav"
+    s3_backend.download({'name': "song", 'project': 1}, "take.wav", "1/2/", str(target))
+    assert target.read_bytes() == b"plain"
+
+
+def test_download_same_size_without_metadata_raw(s3_backend, s3_client, tmp_path):
+    encoded = upload_compressed(s3_client, "1/2/take.wav")
+    s3_client.put_object("bucket", "1/2/take.wav", encoded)
+    s3_backend.remote_encodings["1/2/"] = {'take.wav': {'encoding': ZLIB, 'hash': "", 'size': len(encoded)}}
+    target = tmp_path / "take.wav"
+    s3_backend.download({'name': "song", 'project': 1}, "take.wav", "1/2/", str(target))
+    assert target.read_bytes() == encoded
+
+
+def test_remote_manifest_uses_original_hash(s3_backend, s3_client):
+    import json
+    from hashlib import md5
+    from syncprojects.sync.backends.aws.s3 import MANIFEST_KEY
+    original = md5(COMPRESSIBLE).hexdigest()
+    encoded = upload_compressed(s3_client, "1/2/take.wav")
+    upload_compressed(s3_client, "1/2/other.wav")
+    upload_compressed(s3_client, "1/2/crafted.wav")
+    s3_client.put_object("bucket", "1/2/other.wav", b"replaced")
+    entries = {key: {'encoding': ZLIB, 'hash': original, 'size': len(encoded)} for key in ("take.wav", "other.wav")}
+    # Used as a file name when prefetching
+    entries["crafted.wav"] = {'encoding': ZLIB, 'hash': "../../../outside", 'size': len(encoded)}
+    s3_client.put_object("bucket", "1/2/" + MANIFEST_KEY, json.dumps(entries).encode())
+    manifest = s3_backend.get_remote_manifest("1/2/")
+    assert set(manifest) == {"take.wav", "other.wav", "crafted.wav"}
+    assert manifest["take.wav"] == original
+    assert manifest["other.wav"] != original
+    assert manifest["crafted.wav"] == md5(encoded).hexdigest()
+
+
+SONG = {'id': 2, 'project': 1, 'name': "Song", 'directory_name': "Song", 'archived': False, 'sync_enabled': True,
+        'is_locked': False, 'revision': 1, 'project_name': "Project"}
+
+
+@pytest.fixture
+def song_dir(s3_backend, tmp_path, monkeypatch):
+    from syncprojects.storage import appdata
+    monkeypatch.setitem(appdata, 'compression', True)
+    (tmp_path / "Song").mkdir()
+    (tmp_path / "Song" / "take.wav").write_bytes(COMPRESSIBLE)
+    return tmp_path / "Song"
+
+
+def test_upload_raw_until_bucket_format(s3_backend, s3_client, song_dir):
+    from syncprojects.sync.backends.aws.s3 import FORMAT_KEY, COMPRESSION_FORMAT
+    # Clients without compression share the bucket until it's marked
+    s3_backend.handle_upload(SONG, "take.wav", "1/2/")
+    assert s3_client.objects["1/2/take.wav"] == (COMPRESSIBLE, {})
+    s3_client.put_object("bucket", FORMAT_KEY, f'{{"version": {COMPRESSION_FORMAT}}}'.encode())
+    assert s3_backend.get_bucket_format(refresh=True) == COMPRESSION_FORMAT
+    s3_backend.handle_upload(SONG, "take.wav", "1/2/")
+    assert s3_client.objects["1/2/take.wav"][1] == {ENCODING_METADATA: ZLIB}
+
+
+def test_newer_bucket_format_refused(s3_backend, s3_client, song_dir, monkeypatch):
+    from syncprojects.sync.backends import Verdict
+    from syncprojects.sync.backends.aws.s3 import FORMAT_KEY, FORMAT_VERSION
+    monkeypatch.setenv('THREADS_OFF', '1')
+    s3_client.put_object("bucket", FORMAT_KEY, f'{{"version": {FORMAT_VERSION + 1}}}'.encode())
+    project = {'id': 1, 'name': "Project", 'songs': [dict(SONG)]}
+    results = s3_backend.sync(project, project['songs'], Verdict.LOCAL)
+    assert [song['result'] for song in results['songs']] == ['error']
+    assert "1/2/take.wav" not in s3_client.objects
+    assert s3_backend.prefetch(project, SONG, 1 << 20) == 0
@@ -0,0 +1,179 @@
+import hashlib
+import os
+
+import pytest
+
+from syncprojects import config
+from syncprojects.hashing import hash_file, fingerprint_file
+
+
+def write_random(path, size: int) -> bytes:
+    data = os.urandom(size)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def test_hash_small_file(tmp_path):
+    path = tmp_path / "small.bin"
+    data = write_random(path, 100 * 1024 + 7)
+    assert hash_file(str(path)) == hashlib.md5(data).hexdigest()
+
+
+def test_hash_empty_file(tmp_path):
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    assert hash_file(str(path)) == hashlib.md5().hexdigest()
+
+
+def test_hash_mmapped_file(tmp_path):
+    # Above the mmap threshold and not a whole number of chunks
+    path = tmp_path / "large.bin"
+    data = write_random(path, config.HASH_MMAP_THRESHOLD + config.HASH_MMAP_CHUNK // 2 + 3)
+    assert hash_file(str(path)) == hashlib.md5(data).hexdigest()
+
+
+def test_hash_block_size_override(tmp_path):
+    path = tmp_path / "blocks.bin"
+    data = write_random(path, 10000)
+    assert hash_file(str(path), block_size=4096) == hashlib.md5(data).hexdigest()
+
+
+def test_fingerprint_is_stable(tmp_path):
+    path = tmp_path / "audio.wav"
+    write_random(path, 5000)
+    assert fingerprint_file(str(path)) == fingerprint_file(str(path))
+
+
+def test_throttle_lowers_only_reading_thread(monkeypatch):
+    from syncprojects import hashing
+    calls = []
+    monkeypatch.setattr(hashing, 'set_thread_io_priority', calls.append)
+    throttle = hashing.IOThrottle()
+    monkeypatch.setattr(throttle, 'check', lambda: True)
+    throttle.rate = 10 ** 9
+    throttle.consume(1)
+    throttle.consume(1)
+    monkeypatch.setattr(throttle, 'check', lambda: False)
+    throttle.consume(1)
+    assert calls == [True, False]
+
+
+def test_throttle_accounts_waits(monkeypatch):
+    from syncprojects import hashing
+    monkeypatch.setattr(hashing, 'set_thread_io_priority', lambda low: True)
+    monkeypatch.setattr(hashing, 'sleep', lambda seconds: None)
+    throttle = hashing.IOThrottle()
+    monkeypatch.setattr(throttle, 'check', lambda: True)
+    throttle.rate = 1000
+    throttle.consume(3000)
+    assert throttle.throttled_seconds > 0
+    assert throttle.throttled_bytes == 3000
+
+
+def test_block_size_rounded_to_filesystem_blocks(monkeypatch):
+    from syncprojects.hashing import get_block_size
+    monkeypatch.setattr(config, 'HASH_BLOCK_SIZE', 1000000)
+    assert get_block_size(os.stat_result((0,) * 10)) % 4096 == 0
+    stat = os.stat(__file__)
+    if getattr(stat, 'st_blksize', 0):
+        assert get_block_size(stat) % stat.st_blksize == 0
+
+
+def test_buffer_reused_per_thread():
+    import threading
+    from syncprojects.hashing import get_buffer
+    first = get_buffer(1024)
+    assert len(first) == 1024
+    assert get_buffer(512).obj is first.obj
+    other = []
+    thread = threading.Thread(target=lambda: other.append(get_buffer(1024).obj))
+    thread.start()
+    thread.join()
+    assert other[0] is not first.obj
+
+
+def test_mmap_failure_falls_back_to_reading(tmp_path, monkeypatch):
+    from syncprojects import hashing
+
+    def refuse(*args, **kwargs):
+        raise OSError("no mmap here")
+
+    monkeypatch.setattr(hashing.mmap, 'mmap', refuse)
+    monkeypatch.setattr(config, 'HASH_MMAP_THRESHOLD', 1024)
+    path = tmp_path / "file.bin"
+    data = write_random(path, 5000)
+    assert hash_file(str(path)) == hashlib.md5(data).hexdigest()
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_hash_service(tmp_path, processes):
+    from syncprojects.hashing import HashService
+    path = tmp_path / "file.bin"
+    data = write_random(path, 10000)
+    service = HashService(2, processes)
+    try:
+        assert service.submit(hash_file, str(path)).result(30) == hashlib.md5(data).hexdigest()
+    finally:
+        service.shutdown()
+    assert service._executor is None
+
+
+def test_hash_workers_for_disk(monkeypatch):
+    from syncprojects import hashing
+    monkeypatch.setattr(hashing, 'disk_is_rotational', lambda path: True)
+    assert hashing.get_hash_workers(".") == config.HASH_WORKERS_HDD
+    monkeypatch.setattr(hashing, 'disk_is_rotational', lambda path: False)
+    assert 1 <= hashing.get_hash_workers(".") <= config.HASH_WORKERS_MAX
+
+
+def test_fingerprint_algorithms(tmp_path):
+    from syncprojects.hashing import HASH_ALGOS
+    path = tmp_path / "audio.wav"
+    data = write_random(path, 5000)
+    assert fingerprint_file(str(path), 'md5') == hashlib.md5(data).hexdigest()
+    blake = fingerprint_file(str(path), 'blake2b')
+    assert blake == hashlib.blake2b(data, digest_size=16).hexdigest()
+    # Same length as md5, so it fits wherever an md5 hash was stored
+    assert len(blake) == 32
+    assert set(HASH_ALGOS) >= {'md5', config.FINGERPRINT_ALGO}
+
+
+def test_local_hash_rehashed_for_other_algo(s3_backend, tmp_path):
+    from syncprojects.utils import get_song_dir
+    song = {'id': 2, 'project': 1, 'name': "Song", 'project_name': "Project"}
+    song_dir = tmp_path / get_song_dir(song)
+    song_dir.mkdir(parents=True)
+    (song_dir / "Song.cpr").write_bytes(b"project")
+    s3_backend.local_hash_cache["1:2"] = "cached"
+    assert s3_backend.get_local_hash(song, s3_backend.fingerprint_algo) == "cached"
+    other = 'md5' if s3_backend.fingerprint_algo != 'md5' else 'blake2b'
+    assert s3_backend.get_local_hash(song, other) == s3_backend.hash_project_root_directory(str(song_dir), other)
+
+
+def test_legacy_md5_record_replaced_once(s3_backend, tmp_path, monkeypatch):
+    from syncprojects.storage import SongData, get_songdata
+    from syncprojects.utils import get_song_dir
+    if s3_backend.fingerprint_algo == 'md5':
+        pytest.skip("Fingerprint is md5")
+    song = {'id': 2, 'project': 901, 'name': "Song", 'project_name': "Project", 'revision': 3, 'is_locked': False,
+            'sync_enabled': True, 'archived': False}
+    song_dir = tmp_path / get_song_dir(song)
+    song_dir.mkdir(parents=True)
+    (song_dir / "Song.cpr").write_bytes(b"project")
+    with get_songdata("901") as project_song_data:
+        project_song_data[2] = SongData(2, 3, hashlib.md5(b"project").hexdigest(), 'md5')
+    s3_backend.get_local_changes([song])
+    results = s3_backend.sync({'id': 901, 'name': "Project"}, [song])
+    assert results['songs'] == [{'song': "Song", 'result': 'success', 'action': None}]
+    with get_songdata("901") as project_song_data:
+        song_data = project_song_data[2]
+    assert song_data.hash_algo == s3_backend.fingerprint_algo
+    assert song_data.known_hash == s3_backend.hash_project_root_directory(str(song_dir), s3_backend.fingerprint_algo)
+    assert song_data.revision == 3
+
+    # Now compared with the fingerprint, without rehashing
+    rehashed = []
+    monkeypatch.setattr(s3_backend, 'hash_project_root_directory', lambda *args: rehashed.append(args))
+    assert s3_backend.get_verdicts({'id': 901, 'name': "Project"}, [song]) == {2: None}
+    assert rehashed == []
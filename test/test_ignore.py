@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from syncprojects import config
+from syncprojects.storage import appdata
+from syncprojects.sync.ignore import IGNORE_FILE, IgnoreRules, get_ignore_rules
+from syncprojects.sync.manifest import Manifest
+
+VECTORS = os.path.join(os.path.dirname(__file__), "ignore_vectors.txt")
+
+
+def load_vectors():
+    with open(VECTORS, encoding='utf-8') as f:
+        patterns, cases = f.read().split("\n---\n")
+    cases = [line.split(' ', 2) for line in cases.splitlines() if line and not line.startswith('#')]
+    return patterns.splitlines(), cases
+
+
+PATTERNS, CASES = load_vectors()
+
+
+@pytest.mark.parametrize('expected, kind, path', CASES)
+def test_shared_vectors(expected, kind, path):
+    # The same cases are run against the Rust walker's matcher in src/lib.rs
+    rules = IgnoreRules(PATTERNS)
+    assert rules.matches(path, path.rsplit('/', 1)[-1], kind == "dir") == (expected == "ignored")
+
+
+def test_ignored_parent_excludes_children():
+    rules = IgnoreRules(["Auto Saves/", "*.peak"])
+    assert rules.is_ignored("Auto Saves/Song-01.bak")
+    assert rules.is_ignored("Sub/Auto Saves/x.cpr")
+    assert not rules.is_ignored("Auto Saves")
+    assert not rules.is_ignored("Audio/Kick.wav")
+
+
+def test_filter():
+    manifest = Manifest()
+    for key in ("Song.cpr", "Audio/Kick.wav", "Audio/Kick.wav.peak", "Auto Saves/Song-01.bak"):
+        manifest.add(key, "hash", 1)
+    IgnoreRules(["*.peak", "Auto Saves/"]).filter(manifest)
+    assert sorted(manifest) == ["Audio/Kick.wav", "Song.cpr"]
+
+
+def test_empty_rules():
+    rules = IgnoreRules(["", "# comment", "/"])
+    assert not rules
+    assert not rules.is_ignored("anything")
+
+
+def test_get_ignore_rules(tmp_path, monkeypatch):
+    monkeypatch.setitem(appdata, 'ignore_patterns', ["*.bak"])
+    (tmp_path / IGNORE_FILE).write_text("Bounces/\n", encoding='utf-8')
+    rules = get_ignore_rules(str(tmp_path))
+    assert rules.patterns == list(config.DEFAULT_IGNORE_PATTERNS) + ["*.bak", "Bounces/"]
+    assert rules.is_ignored("Bounces/mix.wav")
+    assert rules.is_ignored("Song.bak")
+
+
+def test_project_ignore_file(tmp_path, monkeypatch):
+    from syncprojects.sync.ignore import get_song_ignore_rules
+    monkeypatch.setitem(appdata, 'ignore_patterns', [])
+    monkeypatch.setitem(appdata, 'source', str(tmp_path))
+    monkeypatch.setitem(appdata, 'nested_folders', True)
+    song = {'name': "Song", 'project_name': "Project"}
+    (tmp_path / "Project" / "Song").mkdir(parents=True)
+    (tmp_path / "Project" / IGNORE_FILE).write_text("Bounces/\n", encoding='utf-8')
+    (tmp_path / "Project" / "Song" / IGNORE_FILE).write_text("*.bak\n", encoding='utf-8')
+    rules = get_song_ignore_rules(song)
+    # Song rules on top of the project's
+    assert rules.patterns == list(config.DEFAULT_IGNORE_PATTERNS) + ["Bounces/", "*.bak"]
+    assert rules.is_ignored("Bounces/mix.wav")
+    assert rules.is_ignored("Song.bak")
+    # No project directory to hold one without nested folders
+    monkeypatch.setitem(appdata, 'nested_folders', False)
+    (tmp_path / "Song").mkdir()
+    assert get_song_ignore_rules(song).patterns == list(config.DEFAULT_IGNORE_PATTERNS)
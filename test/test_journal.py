@@ -0,0 +1,100 @@
+import os
+
+import pytest
+from watchdog.events import FileModifiedEvent, FileMovedEvent, DirCreatedEvent
+
+from syncprojects.watcher.journal import SourceJournal, get_signature
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = SourceJournal()
+    journal.store.clear()
+    journal.source_dir = str(tmp_path)
+    journal.active = True
+    return journal
+
+
+def make_song(tmp_path, name="Song", data=b"project"):
+    song_dir = tmp_path / name
+    song_dir.mkdir(exist_ok=True)
+    (song_dir / f"{name}.cpr").write_bytes(data)
+    return song_dir
+
+
+def test_get_song_dir(journal, tmp_path):
+    assert journal.get_song_dir(str(tmp_path / "Song" / "Song.cpr")) == "Song"
+    assert journal.get_song_dir(str(tmp_path / "Song"), is_directory=True) == "Song"
+    # Audio and top level files don't change the fingerprint
+    assert journal.get_song_dir(str(tmp_path / "Song" / "Audio" / "take.wav")) is None
+    assert journal.get_song_dir(str(tmp_path / "Song" / "notes.txt")) is None
+    assert journal.get_song_dir(str(tmp_path / "Song")) is None
+    assert journal.get_song_dir(str(tmp_path.parent / "elsewhere.cpr")) is None
+
+
+def test_record_and_get(journal, tmp_path):
+    make_song(tmp_path)
+    journal.record("Song", journal.generation("Song"), 'md5', "abc")
+    assert journal.get("Song", 'md5') == "abc"
+    assert journal.get("Song", 'blake2b') is None
+    journal.active = False
+    assert journal.get("Song", 'md5') is None
+
+
+def test_event_marks_dirty(journal, tmp_path):
+    make_song(tmp_path)
+    journal.record("Song", journal.generation("Song"), 'md5', "abc")
+    journal.on_any_event(FileModifiedEvent(str(tmp_path / "Song" / "Song.cpr")))
+    assert journal.get("Song", 'md5') is None
+
+    make_song(tmp_path, "Other")
+    journal.record("Other", journal.generation("Other"), 'md5', "def")
+    journal.on_any_event(FileMovedEvent(str(tmp_path / "Renamed.cpr"), str(tmp_path / "Other" / "Other.cpr")))
+    assert journal.get("Other", 'md5') is None
+
+    make_song(tmp_path, "New")
+    journal.record("New", journal.generation("New"), 'md5', "ghi")
+    journal.on_any_event(DirCreatedEvent(str(tmp_path / "New")))
+    assert journal.get("New", 'md5') is None
+
+
+def test_change_during_hash_not_recorded(journal, tmp_path):
+    make_song(tmp_path)
+    generation = journal.generation("Song")
+    journal.mark_dirty("Song")
+    journal.record("Song", generation, 'md5', "stale")
+    assert journal.get("Song", 'md5') is None
+
+
+def test_reconcile(journal, tmp_path):
+    make_song(tmp_path)
+    make_song(tmp_path, "Other")
+    journal.record("Song", journal.generation("Song"), 'md5', "abc")
+    journal.record("Other", journal.generation("Other"), 'md5', "def")
+    # Changed while nothing was watching
+    changed = tmp_path / "Other" / "Other.cpr"
+    changed.write_bytes(b"changed project")
+    stat = changed.stat()
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    journal.reconcile()
+    assert journal.get("Song", 'md5') == "abc"
+    assert journal.get("Other", 'md5') is None
+
+
+def test_invalidate(journal, tmp_path):
+    make_song(tmp_path)
+    generation = journal.generation("Song")
+    journal.record("Song", generation, 'md5', "abc")
+    journal.invalidate()
+    assert journal.get("Song", 'md5') is None
+    # A hash started before the invalidation isn't trusted either
+    journal.record("Song", generation, 'md5', "abc")
+    assert journal.get("Song", 'md5') is None
+
+
+def test_signature(tmp_path):
+    song_dir = make_song(tmp_path)
+    (song_dir / "Song.bak").write_bytes(b"backup")
+    signature = get_signature(str(song_dir))
+    assert [name for name, *_ in signature] == ["Song.cpr"]
+    assert signature[0][1] == len(b"project")
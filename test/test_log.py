@@ -0,0 +1,86 @@
+import io
+import logging
+import os
+from zipfile import ZipFile
+
+from syncprojects.log import LazyQueueHandler, start_async_logging, get_rotated_logs, trim_to_size, iter_zip
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+def make_record(msg, *args) -> logging.LogRecord:
+    return logging.LogRecord('test', logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_immutable_args_formatted_later():
+    record = LazyQueueHandler(None).prepare(make_record("%s of %d", "one", 2))
+    assert record.msg == "%s of %d"
+    assert record.args == ("one", 2)
+
+
+def test_mutable_args_formatted_now():
+    songs = ["A"]
+    record = LazyQueueHandler(None).prepare(make_record("Songs: %s", songs))
+    songs.append("B")
+    assert record.msg == "Songs: ['A']"
+    assert record.args is None
+
+
+def test_async_logging():
+    target = logging.getLogger('syncprojects.test.log')
+    target.propagate = False
+    handler = ListHandler()
+    listener = start_async_logging(target, [handler])
+    try:
+        songs = ["A"]
+        target.warning("Syncing %s in %s", songs, "Project")
+        songs.append("B")
+        target.warning("Done")
+    finally:
+        listener.stop()
+        target.handlers.clear()
+    assert handler.messages == ["Syncing ['A'] in Project", "Done"]
+
+
+def test_get_rotated_logs(tmp_path):
+    log_file = tmp_path / "syncprojects.log"
+    for path in (log_file, tmp_path / "syncprojects.log.1", tmp_path / "syncprojects.log.3",
+                 tmp_path / "syncprojects.log.4"):
+        path.write_text("log")
+    assert get_rotated_logs(str(log_file)) == [str(log_file), f"{log_file}.1", f"{log_file}.3"]
+
+
+def test_trim_to_size(tmp_path):
+    paths = []
+    for n, size in enumerate((40, 30, 50)):
+        path = tmp_path / f"{n}.log"
+        path.write_bytes(b"x" * size)
+        os.utime(path, (100 - n, 100 - n))
+        paths.append(str(path))
+    assert trim_to_size(paths, 75) == paths[:2]
+    assert trim_to_size(reversed(paths), 100) == paths[:2]
+    assert trim_to_size(paths, 10) == []
+
+
+def test_iter_zip(tmp_path):
+    contents = {"a.log": os.urandom(10000), "b.log": b"b" * 5000}
+    entries = []
+    for name, data in contents.items():
+        (tmp_path / name).write_bytes(data)
+        entries.append((str(tmp_path / name), f"logs/{name}", None))
+    entries.append((str(tmp_path / "rotated.log"), "logs/rotated.log", None))
+    entries.append((str(tmp_path / "a.log"), "logs/tail.log", 3000))
+    chunks = list(iter_zip(entries, 1024))
+    assert len(chunks) > 1
+    with ZipFile(io.BytesIO(b"".join(chunks))) as z:
+        assert z.namelist() == ["logs/a.log", "logs/b.log", "logs/tail.log"]
+        for name, data in contents.items():
+            assert z.read(f"logs/{name}") == data
+        assert z.read("logs/tail.log") == contents["a.log"][-3000:]
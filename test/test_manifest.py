@@ -0,0 +1,99 @@
+from hashlib import md5
+
+from syncprojects.sync.manifest import Manifest, get_difference, DIFF_BLOCK
+
+
+def digest(value) -> str:
+    return md5(str(value).encode()).hexdigest()
+
+
+def test_behaves_like_dict():
+    entries = {"Song.cpr": digest(1), "Audio/take.wav": digest(2), "Audio/Edits/cut.wav": digest(3)}
+    manifest = Manifest(entries)
+    assert len(manifest) == 3
+    assert dict(manifest.items()) == entries
+    assert set(manifest) == set(entries)
+    assert manifest["Audio/take.wav"] == digest(2)
+    assert "Audio/missing.wav" not in manifest
+    assert 1 not in manifest
+
+    manifest["Audio/take.wav"] = digest(4)
+    manifest["Audio/new.wav"] = digest(5)
+    del manifest["Song.cpr"]
+    assert len(manifest) == 3
+    assert "Song.cpr" not in manifest
+    assert dict(manifest) == {"Audio/take.wav": digest(4), "Audio/new.wav": digest(5),
+                              "Audio/Edits/cut.wav": digest(3)}
+
+
+def test_other_digests():
+    # Multipart ETags aren't plain hex digests
+    etag = digest(1) + "-3"
+    manifest = Manifest({"big.wav": etag, "odd.wav": "z" * 32})
+    assert manifest["big.wav"] == etag
+    assert manifest["odd.wav"] == "z" * 32
+    manifest["big.wav"] = digest(2)
+    assert manifest["big.wav"] == digest(2)
+
+
+def test_sizes_and_mtimes():
+    manifest = Manifest()
+    manifest.add("a.wav", digest(1), 100, 5.0)
+    manifest.add("b.wav", digest(2))
+    manifest.add("c.wav", digest(3), 50, 6.0)
+    assert manifest.size("a.wav") == 100
+    assert manifest.size("b.wav") == -1
+    assert manifest.mtime("c.wav") == 6.0
+    assert manifest.total_size(["a.wav", "c.wav"]) == 150
+    # Unknown rather than undercounted
+    assert manifest.total_size() is None
+    assert manifest.total_size(["a.wav", "b.wav"]) is None
+    manifest.add("a.wav", digest(4), 10, 7.0)
+    assert manifest.size("a.wav") == 10
+    assert manifest["a.wav"] == digest(4)
+
+
+def test_diff():
+    entries = {f"Audio/{i:05}.wav": digest(i) for i in range(DIFF_BLOCK * 3)}
+    src = Manifest(entries)
+    assert src.diff(Manifest(entries)) == []
+    changed = dict(entries)
+    changed["Audio/00010.wav"] = digest("changed")
+    del changed[f"Audio/{DIFF_BLOCK * 2:05}.wav"]
+    changed["Audio/extra.wav"] = digest("extra")
+    assert sorted(src.diff(Manifest(changed))) == ["Audio/00010.wav", f"Audio/{DIFF_BLOCK * 2:05}.wav"]
+    assert get_difference(src, Manifest(changed)) == src.diff(Manifest(changed))
+
+
+def test_diff_matches_dicts():
+    src = {"Song.cpr": digest(1), "Audio/a.wav": digest(2), "Audio/b.wav": digest(3) + "-2", "Audio/c.wav": digest(4)}
+    dst = {"Song.cpr": digest(1), "Audio/a.wav": digest(5), "Audio/b.wav": digest(3) + "-2"}
+    expected = sorted(get_difference(src, dst))
+    assert expected == ["Audio/a.wav", "Audio/c.wav"]
+    assert sorted(get_difference(Manifest(src), Manifest(dst))) == expected
+    assert sorted(get_difference(Manifest(src), dst)) == expected
+
+
+def test_diff_skips_deleted():
+    src = Manifest({"a.wav": digest(1), "b.wav": digest(2)})
+    del src["b.wav"]
+    assert src.diff(Manifest()) == ["a.wav"]
+
+
+def test_local_manifest_from_fast_walker(s3_backend, tmp_path, monkeypatch):
+    from syncprojects.sync.backends.aws import s3
+    (tmp_path / "Song").mkdir()
+    (tmp_path / "Song" / "Song.cpr").write_bytes(b"project")
+    walked = []
+
+    def fast_walk_dir(path, patterns):
+        walked.append(path)
+        return {"Song.cpr": (digest(1), 7, 5.0), "Audio/take.wav": (digest(2), 1000, 6.0)}
+
+    monkeypatch.setattr(s3, 'fast_walk_dir', fast_walk_dir)
+    manifest = s3_backend.get_local_manifest("Song")
+    assert walked == [str(tmp_path / "Song")]
+    assert dict(manifest) == {"Song.cpr": digest(1), "Audio/take.wav": digest(2)}
+    assert manifest.size("Audio/take.wav") == 1000
+    assert manifest.mtime("Song.cpr") == 5.0
+    assert manifest.total_size() == 1007
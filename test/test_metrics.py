@@ -0,0 +1,91 @@
+from syncprojects.metrics import Registry, endpoint_label, song_labels, format_labels
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    counter = registry.counter('files_total', "Files")
+    counter.inc(song="A")
+    counter.inc(2, song="A")
+    counter.inc(song="B")
+    assert registry.counter('files_total', "Files") is counter
+    registry.gauge('rate', "Rate").set(1.5)
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP files_total Files", "# TYPE files_total counter"]
+    assert 'files_total{song="A"} 3' in lines
+    assert 'files_total{song="B"} 1' in lines
+    assert "# TYPE rate gauge" in lines
+    assert "rate 1.5" in lines
+
+
+def test_histogram():
+    registry = Registry()
+    histogram = registry.histogram('seconds', "Duration", buckets=(1.0, 5.0))
+    histogram.observe(0.5)
+    histogram.observe(2.0)
+    histogram.observe(10.0)
+    with histogram.time(kind="timed"):
+        pass
+    lines = registry.render().splitlines()
+    assert "# TYPE seconds histogram" in lines
+    assert 'seconds_bucket{le="1.0"} 1' in lines
+    assert 'seconds_bucket{le="5.0"} 2' in lines
+    assert 'seconds_bucket{le="+Inf"} 3' in lines
+    assert "seconds_sum 12.5" in lines
+    assert "seconds_count 3" in lines
+    assert 'seconds_count{kind="timed"} 1' in lines
+
+
+def test_labels():
+    assert format_labels(()) == ""
+    assert format_labels((('song', 'Say "hi"\n'),), {'le': "1.0"}) == '{song="Say \\"hi\\"\\n",le="1.0"}'
+    assert song_labels({'name': "Song", 'project_name': "Project"}) == {'project': "Project", 'song': "Song"}
+    assert endpoint_label("/api/v1/projects/12/songs/345/") == "/api/v:id/projects/:id/songs/:id/"
+
+
+SONG = {'id': 2, 'project': 1, 'name': "Song", 'directory_name': "Song", 'archived': False, 'sync_enabled': True,
+        'is_locked': False, 'revision': 1, 'project_name': "Project"}
+
+
+def counter_value(counter, **labels):
+    return counter._values.get(counter.key(labels), 0)
+
+
+def test_transfer_bytes_before_compression(s3_backend, s3_client, tmp_path, monkeypatch):
+    from syncprojects.storage import appdata
+    from syncprojects.sync.backends import Verdict
+    from syncprojects.sync.backends.aws import s3
+    from syncprojects.sync.compression import ZLIB
+    from syncprojects.metrics import TRANSFER_BYTES
+    monkeypatch.setenv('THREADS_OFF', '1')
+    monkeypatch.setitem(appdata, 'compression', True)
+    s3_client.put_object("bucket", s3.FORMAT_KEY, b'{"version": 2}')
+    project = {'id': 1, 'name': "Project", 'songs': [dict(SONG)]}
+    song_dir = tmp_path / "Song"
+    song_dir.mkdir()
+    (song_dir / "Song.cpr").write_bytes(b"project")
+    (song_dir / "take.wav").write_bytes(b"syncprojects " * 10000)
+    # The Rust walker's manifest before it returned sizes
+    monkeypatch.setattr(s3, 'fast_walk_dir', lambda path, patterns: {
+        "Song.cpr": ("0" * 32, -1, 0.0), "take.wav": ("1" * 32, -1, 0.0)})
+    labels = {'direction': "upload", 'project': "Project", 'song': "Song"}
+    before = counter_value(TRANSFER_BYTES, **labels)
+    s3_backend.sync(project, project['songs'], Verdict.LOCAL)
+    assert s3_client.objects["1/2/take.wav"][1] == {s3.ENCODING_METADATA: ZLIB}
+    assert counter_value(TRANSFER_BYTES, **labels) - before == len(b"project") + len(b"syncprojects " * 10000)
+
+
+def test_download_stats_count_original_bytes(s3_backend, s3_client, tmp_path):
+    import io
+    from syncprojects.sync.backends.aws.s3 import ENCODING_METADATA
+    from syncprojects.sync.compression import CompressingReader, ZLIB
+    data = b"syncprojects " * 10000
+    encoded = CompressingReader(io.BytesIO(data), ZLIB).read()
+    s3_client.put_object("bucket", "1/2/take.wav", encoded, {ENCODING_METADATA: ZLIB})
+    s3_client.put_object("bucket", "1/2/raw.wav", b"raw")
+    s3_backend.remote_encodings["1/2/"] = {'take.wav': {'encoding': ZLIB, 'hash': "", 'size': len(encoded)}}
+    for key in ("take.wav", "raw.wav"):
+        s3_backend.download(SONG, key, "1/2/", str(tmp_path / key))
+    stats = s3_backend.get_compression_stats("1/2/")
+    assert stats.files == 2
+    assert stats.original_bytes == len(data) + 3
+    assert stats.encoded_bytes == len(encoded) + 3
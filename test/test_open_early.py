@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from syncprojects.sync.backends import Verdict
+from syncprojects.utils import get_song_dir
+
+SONG = {'id': 2, 'project': 1, 'name': "Song", 'directory_name': "Song", 'archived': False, 'sync_enabled': True,
+        'is_locked': False, 'revision': 1, 'project_name': "Project"}
+
+
+@pytest.fixture
+def project(s3_client, monkeypatch):
+    monkeypatch.setenv('THREADS_OFF', '1')
+    s3_client.put_object("bucket", "1/2/Song.cpr", b"\x00\x01Audio/take.wav\x00")
+    s3_client.put_object("bucket", "1/2/Audio/take.wav", b"take")
+    s3_client.put_object("bucket", "1/2/Audio/unused.wav", b"unused")
+    return {'id': 1, 'name': "Project", 'songs': [dict(SONG)]}
+
+
+def test_ready_once_project_file_is_down(sync_manager, project, tmp_path):
+    song_dir = tmp_path / get_song_dir(project['songs'][0])
+    seen = []
+
+    def on_ready(song):
+        seen.append((song['name'], sorted(os.listdir(song_dir / "Audio"))))
+
+    results = sync_manager.sync(project, Verdict.REMOTE, on_ready=on_ready)
+    assert [r['result'] for r in results['songs']] == ['success']
+    assert seen == [("Song", ["take.wav"])]
+    assert (song_dir / "Audio" / "unused.wav").read_bytes() == b"unused"
+
+
+def test_not_ready_without_project_file(sync_manager, project, s3_client, monkeypatch):
+    download_file = s3_client.download_file
+
+    def fail_project_file(bucket, key, target):
+        if key.endswith(".cpr"):
+            raise PermissionError(key)
+        download_file(bucket, key, target)
+
+    monkeypatch.setattr(s3_client, 'download_file', fail_project_file)
+    seen = []
+    results = sync_manager.sync(project, Verdict.REMOTE, on_ready=seen.append)
+    assert [r['result'] for r in results['songs']] == ['error']
+    assert seen == []
@@ -0,0 +1,98 @@
+import pytest
+
+from syncprojects.storage import appdata
+from syncprojects.sync import plan
+from syncprojects.sync.backends import Verdict
+from syncprojects.sync.plan import UPLOAD, DOWNLOAD, MIN_SAMPLE_BYTES, SMOOTHING
+from syncprojects.utils import get_song_dir
+
+SONG = {'id': 2, 'project': 1, 'name': "Song", 'directory_name': "Song", 'archived': False, 'sync_enabled': True,
+        'is_locked': False, 'revision': 1, 'project_name': "Project"}
+
+
+@pytest.fixture(autouse=True)
+def throughput(monkeypatch):
+    monkeypatch.setitem(appdata, 'throughput', {})
+
+
+@pytest.fixture
+def project(s3_client):
+    s3_client.put_object("bucket", "1/2/Song.cpr", b"project")
+    s3_client.put_object("bucket", "1/2/Audio/take.wav", b"x" * 1000)
+    return {'id': 1, 'name': "Project", 'songs': [dict(SONG)]}
+
+
+def test_record_throughput():
+    plan.record_throughput(DOWNLOAD, MIN_SAMPLE_BYTES - 1, 1)
+    assert plan.get_throughput(DOWNLOAD) is None
+    plan.record_throughput(DOWNLOAD, MIN_SAMPLE_BYTES, 1)
+    assert plan.get_throughput(DOWNLOAD) == MIN_SAMPLE_BYTES
+    plan.record_throughput(DOWNLOAD, MIN_SAMPLE_BYTES * 2, 1)
+    assert plan.get_throughput(DOWNLOAD) == pytest.approx(MIN_SAMPLE_BYTES * (1 + SMOOTHING))
+    assert plan.get_throughput(UPLOAD) is None
+
+
+def test_estimate_seconds():
+    assert plan.estimate_seconds(UPLOAD, 0) == 0.0
+    assert plan.estimate_seconds(UPLOAD, 100) is None
+    plan.record_throughput(UPLOAD, MIN_SAMPLE_BYTES * 4, 2)
+    assert plan.estimate_seconds(UPLOAD, MIN_SAMPLE_BYTES * 10) == 5.0
+
+
+def test_unknown_size():
+    plan.record_throughput(UPLOAD, MIN_SAMPLE_BYTES, 1)
+    assert plan.get_transfer(UPLOAD, ["a"], None) == {'direction': UPLOAD, 'files': 1, 'bytes': None, 'eta': None}
+    totals = plan.summarize([{'transfers': [plan.get_transfer(UPLOAD, ["a"], 10)]},
+                             {'transfers': [plan.get_transfer(UPLOAD, ["b"], None)]},
+                             {'transfers': [plan.get_transfer(UPLOAD, ["c"], 10)]}])
+    assert totals[UPLOAD] == {'files': 3, 'bytes': None, 'eta': None}
+
+
+def test_plan_upload_size_unknown(s3_backend, project, tmp_path, monkeypatch):
+    from syncprojects.sync.backends.aws import s3
+    (tmp_path / "Song").mkdir()
+    monkeypatch.setattr(s3, 'fast_walk_dir', lambda path, patterns: {"Song.cpr": ("0" * 32, -1, 0.0)})
+    plan.record_throughput(UPLOAD, MIN_SAMPLE_BYTES, 1)
+    [planned] = s3_backend.plan(project, project['songs'], Verdict.LOCAL)['songs']
+    assert planned['transfers'] == [{'direction': UPLOAD, 'files': 1, 'bytes': None, 'eta': None}]
+
+
+def test_summarize():
+    plan.record_throughput(DOWNLOAD, MIN_SAMPLE_BYTES, 1)
+    songs = [
+        {'song': "A", 'transfers': [plan.get_transfer(UPLOAD, ["a"], 10), plan.get_transfer(DOWNLOAD, ["a", "b"], 20)]},
+        {'song': "B", 'transfers': [plan.get_transfer(DOWNLOAD, ["c"], MIN_SAMPLE_BYTES)]},
+        {'song': "C", 'verdict': None},
+    ]
+    totals = plan.summarize(songs)
+    assert totals[UPLOAD] == {'files': 1, 'bytes': 10, 'eta': None}
+    assert totals[DOWNLOAD]['files'] == 3
+    assert totals[DOWNLOAD]['bytes'] == MIN_SAMPLE_BYTES + 20
+    assert totals[DOWNLOAD]['eta'] == pytest.approx(1.0, abs=0.1)
+
+
+def test_plan_download(s3_backend, project, tmp_path):
+    results = s3_backend.plan(project, project['songs'], Verdict.REMOTE)
+    [planned] = results['songs']
+    assert planned['verdict'] == Verdict.REMOTE.value
+    assert planned['transfers'] == [{'direction': DOWNLOAD, 'files': 2, 'bytes': 1007, 'eta': None}]
+    # Nothing was transferred
+    assert not (tmp_path / get_song_dir(project['songs'][0])).exists()
+
+
+def test_plan_upload_and_conflict(s3_backend, s3_client, project, tmp_path):
+    song_dir = tmp_path / get_song_dir(project['songs'][0])
+    (song_dir / "Audio").mkdir(parents=True)
+    (song_dir / "Song.cpr").write_bytes(b"project")
+    (song_dir / "Audio" / "take.wav").write_bytes(b"y" * 500)
+    (song_dir / "Audio" / "new.wav").write_bytes(b"z" * 20)
+    objects = dict(s3_client.objects)
+
+    [planned] = s3_backend.plan(project, project['songs'], Verdict.LOCAL)['songs']
+    assert planned['transfers'] == [{'direction': UPLOAD, 'files': 2, 'bytes': 520, 'eta': None}]
+
+    [planned] = s3_backend.plan(project, project['songs'], Verdict.CONFLICT)['songs']
+    assert [t['direction'] for t in planned['transfers']] == [UPLOAD, DOWNLOAD]
+    assert planned['transfers'][1]['files'] == 1
+    assert planned['transfers'][1]['bytes'] == 1000
+    assert s3_client.objects == objects
@@ -0,0 +1,117 @@
+import os
+import threading
+from hashlib import md5
+
+import pytest
+
+from syncprojects.sync.prefetch import STAGING_DIR, clear_partial, clear_staging, get_staged, get_staged_path
+from syncprojects.sync.manifest import Manifest
+
+SONG = {'id': 2, 'project': 1, 'name': "Song", 'project_name': "Project", 'directory_name': "Song",
+        'archived': False, 'sync_enabled': True, 'revision': 3}
+PROJECT = {'id': 1, 'name': "Project", 'songs': [SONG]}
+A = md5(b"a").hexdigest()
+B = md5(b"b").hexdigest()
+
+
+def test_get_staged(s3_backend):
+    manifest = Manifest()
+    manifest.add("a.wav", A, 1)
+    manifest.add("b.wav", B, 1)
+    manifest.add("c.wav", "../../../../c", 1)
+    path = get_staged_path(SONG, A)
+    os.makedirs(os.path.dirname(path))
+    open(path, 'wb').close()
+    assert get_staged(SONG, manifest, ["a.wav", "b.wav", "c.wav"]) == {"a.wav": path}
+    clear_staging(SONG)
+    assert get_staged(SONG, manifest, ["a.wav", "b.wav"]) == {}
+
+
+def test_staged_path_must_be_digest(s3_backend):
+    assert get_staged_path(SONG, A + "-3").endswith(A + "-3")
+    for digest in ("../escape", "/abs", A.upper(), A[:-1], ""):
+        with pytest.raises(ValueError):
+            get_staged_path(SONG, digest)
+
+
+def test_clear_partial(s3_backend):
+    path = get_staged_path(SONG, A)
+    os.makedirs(os.path.dirname(path))
+    open(path, 'wb').close()
+    open(path + ".part", 'wb').close()
+    assert clear_partial() == 1
+    assert os.path.isfile(path)
+    assert not os.path.isfile(path + ".part")
+
+
+def test_prefetch_stages_only_changed_files(s3_backend, s3_client, tmp_path, monkeypatch):
+    from syncprojects.utils import get_song_dir
+    monkeypatch.setenv('THREADS_OFF', '1')
+    s3_client.put_object("bucket", "1/2/new.wav", b"new")
+    s3_client.put_object("bucket", "1/2/changed.wav", b"changed")
+    s3_client.put_object("bucket", "1/2/ours.wav", b"ours")
+    song_dir = tmp_path / get_song_dir(SONG)
+    song_dir.mkdir(parents=True)
+    (song_dir / "changed.wav").write_bytes(b"old")
+    # Uploaded from here, so the local copy is newer than the object
+    (song_dir / "ours.wav").write_bytes(b"ours")
+    os.utime(song_dir / "ours.wav", (10 ** 9, 10 ** 9))
+    # Must not hash the local copy
+    monkeypatch.setattr(s3_backend, 'get_local_manifest', None)
+    assert s3_backend.prefetch(PROJECT, SONG, 1000) == 10
+    staging = tmp_path / STAGING_DIR / "1" / "2"
+    assert sorted((staging / name).read_bytes() for name in os.listdir(staging)) == [b"changed", b"new"]
+    # Already staged
+    assert s3_backend.prefetch(PROJECT, SONG, 1000) == 0
+
+
+def test_prefetch_respects_budget(s3_backend, s3_client, monkeypatch):
+    monkeypatch.setenv('THREADS_OFF', '1')
+    s3_client.put_object("bucket", "1/2/new.wav", b"new")
+    assert s3_backend.prefetch(PROJECT, SONG, 2) == 0
+
+
+def test_prefetch_skips_claimed_song(sync_manager, s3_client, monkeypatch):
+    monkeypatch.setenv('THREADS_OFF', '1')
+    s3_client.put_object("bucket", "1/2/new.wav", b"new")
+    manager = sync_manager
+    claimed = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with manager.claim(1, [2]):
+            claimed.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    claimed.wait()
+    try:
+        assert manager.prefetch(PROJECT, SONG, 1000) == 0
+    finally:
+        release.set()
+        holder.join()
+    assert manager.prefetch(PROJECT, SONG, 1000) == 3
+
+
+def test_prefetch_gives_way_to_waiting_command(sync_manager, s3_client, monkeypatch):
+    monkeypatch.setenv('THREADS_OFF', '1')
+    for name in ("a", "b", "c"):
+        s3_client.put_object("bucket", f"1/2/{name}.wav", name.encode())
+    download_file = s3_client.download_file
+    waiters = []
+
+    def download_then_wait(bucket, key, target):
+        download_file(bucket, key, target)
+        if not waiters:
+            # A workon wants the song while the first file is downloading
+            waiter = threading.Thread(target=lambda: sync_manager.claim(1, [2]).__enter__())
+            waiter.start()
+            waiters.append(waiter)
+            while not sync_manager.claims.waited_on(1, [2]):
+                threading.Event().wait(0.01)
+
+    monkeypatch.setattr(s3_client, 'download_file', download_then_wait)
+    assert sync_manager.prefetch(PROJECT, SONG, 1000) == 1
+    waiters[0].join(5)
+    assert not waiters[0].is_alive()
@@ -0,0 +1,38 @@
+import tracemalloc
+
+from syncprojects import profiling
+from syncprojects.profiling import ProfileSession
+
+
+def allocate():
+    return [bytearray(1024) for _ in range(100)]
+
+
+def test_session_records_run():
+    session = ProfileSession("test")
+    assert len(session.run(allocate)) == 100
+    assert len(session.profiles) == 1
+    assert session.peak > 0
+    assert session.end_snapshot is not None
+    assert not tracemalloc.is_tracing()
+
+
+def test_session_without_reset_peak(monkeypatch):
+    # Python 3.8 has no tracemalloc.reset_peak()
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    session = ProfileSession("test")
+    session.run(allocate)
+    assert session.peak > 0
+
+
+def test_wrap_collects_profiles():
+    session = ProfileSession("test")
+    wrapped = session.wrap(allocate)
+    session.run(lambda: wrapped())
+    assert len(session.profiles) >= 1
+
+
+def test_profiled_disabled_runs_plainly(monkeypatch):
+    monkeypatch.setattr(profiling, 'is_enabled', lambda: False)
+    assert profiling.profiled("test")(lambda: 42)() == 42
+    assert profiling.get_session() is None
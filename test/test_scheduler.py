@@ -0,0 +1,116 @@
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from syncprojects.sync.scheduler import BACKGROUND, INTERACTIVE, NORMAL, PriorityExecutor, bind, get_priority, \
+    get_transfer_executor, priority
+
+
+def blocked_executor(share=None):
+    """
+    :return: An executor with one thread, held busy until the returned event is set
+    """
+    executor = PriorityExecutor(1, 'test', share)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    executor.submit(block, level=BACKGROUND)
+    started.wait()
+    return executor, release
+
+
+def test_most_urgent_first():
+    executor, release = blocked_executor()
+    order = []
+    futures = [executor.submit(order.append, name, level=level)
+               for name, level in (("background", BACKGROUND), ("normal", NORMAL), ("interactive", INTERACTIVE),
+                                   ("normal 2", NORMAL))]
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ["interactive", "normal", "normal 2", "background"]
+    executor.shutdown()
+
+
+def test_runs_at_submitted_priority():
+    executor = PriorityExecutor(2, 'test')
+    with priority(INTERACTIVE):
+        assert executor.submit(get_priority).result(5) == INTERACTIVE
+    assert executor.submit(get_priority, level=BACKGROUND).result(5) == BACKGROUND
+    executor.shutdown()
+
+
+def test_bind_carries_priority():
+    with priority(BACKGROUND):
+        func = bind(get_priority)
+    assert get_priority() == NORMAL
+    assert func() == BACKGROUND
+
+
+def test_share_limits_background_while_interactive_waits():
+    executor = PriorityExecutor(3, 'test', share=1)
+    release = threading.Event()
+    started = []
+    lock = threading.Lock()
+
+    def work(name):
+        with lock:
+            started.append(name)
+        release.wait()
+
+    interactive_release = threading.Event()
+    executor.submit(interactive_release.wait, level=INTERACTIVE)
+    for i in range(3):
+        executor.submit(work, i, level=NORMAL)
+    threading.Event().wait(0.2)
+    assert len(started) == 1
+    interactive_release.set()
+    threading.Event().wait(0.2)
+    assert len(started) == 3
+    release.set()
+    executor.shutdown()
+
+
+def test_shutdown_cancels_queued():
+    executor, release = blocked_executor()
+    queued = executor.submit(lambda: None)
+    executor.shutdown(wait=False, cancel_futures=True)
+    with pytest.raises(CancelledError):
+        queued.result(5)
+    with pytest.raises(RuntimeError):
+        executor.submit(lambda: None)
+    release.set()
+
+
+def test_shutdown_waits_for_queued():
+    executor, release = blocked_executor()
+    queued = executor.submit(lambda: 42)
+    release.set()
+    executor.shutdown(wait=True)
+    assert queued.result(0) == 42
+    assert not executor._threads
+
+
+def test_resize_down():
+    executor = PriorityExecutor(4, 'test')
+    assert [f.result(5) for f in [executor.submit(lambda i=i: i) for i in range(8)]] == list(range(8))
+    executor.resize(1)
+    assert executor.submit(lambda: 1).result(5) == 1
+    executor.shutdown()
+
+
+def test_transfer_executor_shared(monkeypatch):
+    from syncprojects.sync import scheduler
+    monkeypatch.setattr(scheduler, '_transfer_executor', None)
+    executor = get_transfer_executor(4, 2)
+    assert executor.max_workers == 4
+    assert executor.share == 2
+    assert get_transfer_executor(2, 2) is executor
+    assert executor.max_workers == 2
+    assert executor.submit(lambda: 1).result(5) == 1
+    executor.shutdown()
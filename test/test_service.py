@@ -0,0 +1,116 @@
+import sys
+import threading
+from queue import Queue
+from types import SimpleNamespace
+
+import pytest
+
+from syncprojects import commands, config, sync
+from syncprojects.sync.scheduler import INTERACTIVE, NORMAL, PriorityExecutor, get_priority
+from syncprojects.ui.message import INFO, MessageBoxUI
+
+
+def test_run_service_shuts_down_executor(sync_manager, monkeypatch):
+    executors = []
+
+    class RecordingExecutor(PriorityExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            executors.append(self)
+
+    monkeypatch.setattr(sync, 'PriorityExecutor', RecordingExecutor)
+    ran = []
+    monkeypatch.setattr(sync_manager, 'run_command', ran.append)
+    sync_manager.api_client = SimpleNamespace(recv_queue=Queue(), send_queue=Queue(), queue_thread=None)
+    sync_manager.api_client.recv_queue.put({'task_id': "1", 'msg_type': 'tasks', 'data': {}})
+    sync_manager.api_client.recv_queue.put(None)
+    sync_manager.run_service()
+    assert executors[0]._shutdown
+    assert sync_manager.api_client.queue_thread is None
+
+
+def test_interactive_commands_run_first(sync_manager, monkeypatch):
+    monkeypatch.setattr(config, 'COMMAND_WORKERS', 1)
+    started = threading.Event()
+    release = threading.Event()
+    done = threading.Semaphore(0)
+    ran = []
+
+    def run_command(msg):
+        ran.append((msg['msg_type'], get_priority()))
+        if msg['task_id'] == "1":
+            started.set()
+            release.wait(5)
+        done.release()
+
+    monkeypatch.setattr(sync_manager, 'run_command', run_command)
+    sync_manager.api_client = SimpleNamespace(recv_queue=Queue(), send_queue=Queue(), queue_thread=None)
+
+    def feed():
+        recv_queue = sync_manager.api_client.recv_queue
+        recv_queue.put({'task_id': "1", 'msg_type': 'sync', 'data': {}})
+        started.wait(5)
+        recv_queue.put({'task_id': "2", 'msg_type': 'sync', 'data': {}})
+        recv_queue.put({'task_id': "3", 'msg_type': 'workon', 'data': {}})
+        # Let the service queue both before the first one finishes
+        threading.Event().wait(0.2)
+        release.set()
+        for _ in range(3):
+            done.acquire(timeout=5)
+        recv_queue.put(None)
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    sync_manager.run_service()
+    feeder.join()
+    assert ran == [('sync', NORMAL), ('workon', INTERACTIVE), ('sync', NORMAL)]
+
+
+@pytest.fixture
+def service(sync_manager):
+    sync_manager.api_client = SimpleNamespace(recv_queue=Queue(), send_queue=Queue(), queue_thread=None)
+    return sync_manager
+
+
+def test_update_runs_inline(service, monkeypatch):
+    threads = []
+
+    def run_command(msg):
+        threads.append(threading.current_thread())
+        sys.exit(0)
+
+    monkeypatch.setattr(service, 'run_command', run_command)
+    service.api_client.recv_queue.put({'task_id': "1", 'msg_type': 'update', 'data': {}})
+    with pytest.raises(SystemExit):
+        service.run_service()
+    assert threads == [threading.main_thread()]
+
+
+def test_exit_from_command_thread_stops_service(service, monkeypatch):
+    monkeypatch.setattr(commands.LogReportHandler, 'handle', lambda self, data: sys.exit(0))
+    service.api_client.recv_queue.put({'task_id': "1", 'msg_type': 'logs', 'data': {}})
+    with pytest.raises(SystemExit):
+        service.run_service()
+    assert not service.tasks
+
+
+def test_dialogs_shown_on_main_thread(service, monkeypatch):
+    shown = []
+
+    def show(self, message, title="", level=INFO):
+        shown.append((message, threading.current_thread()))
+        return True
+
+    monkeypatch.setattr(MessageBoxUI, '__init__', lambda self: None)
+    monkeypatch.setattr(MessageBoxUI, 'show', show)
+    answers = []
+
+    def run_command(msg):
+        answers.append(MessageBoxUI.yesno("Overwrite?"))
+        service.api_client.recv_queue.put(None)
+
+    monkeypatch.setattr(service, 'run_command', run_command)
+    service.api_client.recv_queue.put({'task_id': "1", 'msg_type': 'sync', 'data': {}})
+    service.run_service()
+    assert answers == [True]
+    assert shown == [("Overwrite?", threading.main_thread())]
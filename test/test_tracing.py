@@ -0,0 +1,50 @@
+import json
+import threading
+from uuid import uuid4
+
+from syncprojects import tracing
+
+
+def test_span_recorded_with_task():
+    task_id = str(uuid4())
+    with tracing.task(task_id):
+        with tracing.span('walk', cat="hash", song="Song"):
+            pass
+    with tracing.span('untagged'):
+        pass
+    [event] = tracing.get_events(task_id)
+    assert event['name'] == 'walk'
+    assert event['cat'] == "hash"
+    assert event['ph'] == 'X'
+    assert event['dur'] >= 0
+    assert event['args'] == {'song': "Song", 'task_id': task_id}
+    assert tracing.get_task_id() is None
+
+
+def test_span_recorded_on_error():
+    task_id = str(uuid4())
+    try:
+        with tracing.task(task_id), tracing.span('failing'):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert [event['name'] for event in tracing.get_events(task_id)] == ['failing']
+
+
+def test_bind_carries_task_to_thread():
+    task_id = str(uuid4())
+
+    def work():
+        with tracing.span('transfer'):
+            pass
+
+    with tracing.task(task_id):
+        thread = threading.Thread(target=tracing.bind(work), name="transfer_0")
+    thread.start()
+    thread.join()
+    trace = tracing.export(task_id)
+    json.dumps(trace)
+    events = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert [event['name'] for event in events] == ['transfer']
+    thread_names = [event['args']['name'] for event in trace['traceEvents'] if event['name'] == 'thread_name']
+    assert thread_names == ["transfer_0"]